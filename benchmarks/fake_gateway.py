@@ -0,0 +1,484 @@
+"""In-memory stand-in for an OMERO BlitzGateway
+
+The fake server holds a regular Project -> Dataset -> Image hierarchy that is
+generated on the fly (nothing is stored per object), and every round trip to the
+"server" sleeps for a configurable latency, so benchmarks measure how many calls
+an operation makes as well as the local work it does. Projects and datasets saved
+through the update service are kept in lists of their own.
+"""
+
+import threading
+import time
+
+
+class FakeServer(object):
+    """
+    The shared state behind any number of FakeGateways (like one OMERO server)
+    Args:
+        n_projects (int): number of projects
+        n_datasets (int): datasets per project
+        n_images (int): images per dataset
+        latency (float): seconds slept per server round trip
+        image_shape (tuple): (size_x, size_y, size_z, size_c, size_t) of every image
+        pixels_type (string): OMERO pixel type of every image
+        file_size (int): size in bytes of every original file
+    """
+
+    def __init__(self, n_projects=2, n_datasets=5, n_images=20, latency=0.0,
+                 image_shape=(256, 256, 4, 2, 1), pixels_type="uint16", file_size=8 * 1024 ** 2):
+        self.n_projects = n_projects
+        self.n_datasets = n_datasets
+        self.n_images = n_images
+        self.latency = latency
+        self.image_shape = image_shape
+        self.pixels_type = pixels_type
+        self.file_size = file_size
+        self.calls = 0
+        self.tags = {}
+        self.created_projects = {} # ID -> name
+        self.created_datasets = [] # (project ID, dataset ID, name)
+        self.next_id = 10 ** 9
+        self._lock = threading.Lock()
+
+    def round_trip(self, count=1):
+        with self._lock:
+            self.calls += count
+        if self.latency > 0:
+            time.sleep(self.latency * count)
+
+    def new_id(self):
+        with self._lock:
+            self.next_id += 1
+            return self.next_id
+
+    def add_project(self, name):
+        project_id = self.new_id()
+        with self._lock:
+            self.created_projects[project_id] = name
+        return project_id
+
+    def add_dataset(self, project_id, name):
+        dataset_id = self.new_id()
+        with self._lock:
+            self.created_datasets.append((project_id, dataset_id, name))
+        return dataset_id
+
+    def project_name(self, project_id):
+        if project_id in self.created_projects:
+            return self.created_projects[project_id]
+        return FakeProject(self, project_id).getName()
+
+    # ids: projects 1..P, datasets and images numbered consecutively across the hierarchy
+
+    def project_ids(self):
+        return range(1, self.n_projects + 1)
+
+    def dataset_ids(self, project_id):
+        start = (project_id - 1) * self.n_datasets + 1
+        return range(start, start + self.n_datasets)
+
+    def image_ids(self, dataset_id):
+        start = (dataset_id - 1) * self.n_images + 1
+        return range(start, start + self.n_images)
+
+    def project_of_dataset(self, dataset_id):
+        return (dataset_id - 1) // self.n_datasets + 1
+
+    def dataset_of_image(self, image_id):
+        return (image_id - 1) // self.n_images + 1
+
+    def has_project(self, project_id):
+        return 1 <= project_id <= self.n_projects
+
+    def has_dataset(self, dataset_id):
+        return 1 <= dataset_id <= self.n_projects * self.n_datasets
+
+    def has_image(self, image_id):
+        return 1 <= image_id <= self.n_projects * self.n_datasets * self.n_images
+
+class FakeObject(object):
+
+    OMERO_CLASS = ""
+
+    def __init__(self, server, obj_id):
+        self._server = server
+        self.id = obj_id
+
+    def getId(self):
+        return self.id
+
+    def getName(self):
+        return self.OMERO_CLASS.lower() + " " + str(self.id)
+
+    def getDescription(self):
+        return ""
+
+class FakeProject(FakeObject):
+
+    OMERO_CLASS = "Project"
+
+    def listChildren(self):
+        self._server.round_trip()
+        return [FakeDataset(self._server, ds_id) for ds_id in self._server.dataset_ids(self.id)]
+
+class FakeDataset(FakeObject):
+
+    OMERO_CLASS = "Dataset"
+
+    def listChildren(self):
+        self._server.round_trip()
+        return [FakeImage(self._server, img_id) for img_id in self._server.image_ids(self.id)]
+
+    def getParent(self):
+        self._server.round_trip()
+        return FakeProject(self._server, self._server.project_of_dataset(self.id))
+
+class FakeOriginalFile(FakeObject):
+
+    OMERO_CLASS = "OriginalFile"
+
+    def getName(self):
+        return "image_" + str(self.id) + ".nd2"
+
+    def getSize(self):
+        return self._server.file_size
+
+class FakeFileset(FakeObject):
+
+    OMERO_CLASS = "Fileset"
+
+    def listFiles(self):
+        self._server.round_trip()
+        return [FakeOriginalFile(self._server, self.id)]
+
+class FakePixels(FakeObject):
+
+    OMERO_CLASS = "Pixels"
+
+    def getPlane(self, theZ=0, theC=0, theT=0):
+        import numpy as np
+
+        size_x, size_y = self._server.image_shape[:2]
+        self._server.round_trip()
+        return np.zeros((size_y, size_x), dtype=self._server.pixels_type)
+
+    def getPlanes(self, zctList):
+        for z, c, t in zctList:
+            yield self.getPlane(z, c, t)
+
+class FakeImage(FakeObject):
+
+    OMERO_CLASS = "Image"
+
+    def getSizeX(self):
+        return self._server.image_shape[0]
+
+    def getSizeY(self):
+        return self._server.image_shape[1]
+
+    def getSizeZ(self):
+        return self._server.image_shape[2]
+
+    def getSizeC(self):
+        return self._server.image_shape[3]
+
+    def getSizeT(self):
+        return self._server.image_shape[4]
+
+    def getPixelsType(self):
+        return self._server.pixels_type
+
+    def getPrimaryPixels(self):
+        self._server.round_trip()
+        return FakePixels(self._server, self.id)
+
+    def getFileset(self):
+        self._server.round_trip()
+        return FakeFileset(self._server, self.id)
+
+    def getParent(self):
+        self._server.round_trip()
+        return FakeDataset(self._server, self._server.dataset_of_image(self.id))
+
+class FakeTag(FakeObject):
+
+    OMERO_CLASS = "TagAnnotation"
+
+    def __init__(self, server, obj_id, text_value):
+        FakeObject.__init__(self, server, obj_id)
+        self.text_value = text_value
+
+    def getValue(self):
+        return self.text_value
+
+    def getTextValue(self):
+        return self.text_value
+
+class FakeEventContext(object):
+
+    def __init__(self):
+        self.sessionUuid = "fake-session"
+        self.groupId = 0
+        self.userId = 0
+
+class FakeQueryService(object):
+    """
+    Answers the HQL projections issued by omero-bifrost (requires omero-py for the rtypes)
+    """
+
+    def __init__(self, server):
+        self._server = server
+
+    def projection(self, query, params, ctx=None):
+        from omero.rtypes import rstring, rlong, rtype, unwrap
+
+        self._server.round_trip()
+        server = self._server
+
+        if "from ProjectDatasetLink" in query:
+            project_names = set(unwrap(params.map["pnames"]))
+            dataset_names = set(unwrap(params.map["dnames"]))
+            rows = []
+            for project_id in server.project_ids():
+                project_name = FakeProject(server, project_id).getName()
+                if project_name not in project_names:
+                    continue
+                for dataset_id in server.dataset_ids(project_id):
+                    dataset_name = FakeDataset(server, dataset_id).getName()
+                    if dataset_name in dataset_names:
+                        rows.append([rstring(project_name), rstring(dataset_name), rlong(dataset_id)])
+            for project_id, dataset_id, dataset_name in server.created_datasets:
+                if server.project_name(project_id) in project_names and dataset_name in dataset_names:
+                    rows.append([rstring(server.project_name(project_id)), rstring(dataset_name), rlong(dataset_id)])
+            return rows
+
+        if "from Project p where p.name in (:pnames)" in query:
+            project_names = set(unwrap(params.map["pnames"]))
+            project_ids = list(server.project_ids()) + sorted(server.created_projects)
+            return [[rlong(project_id), rstring(server.project_name(project_id))] for project_id in project_ids
+                    if server.project_name(project_id) in project_names]
+
+        if "from DatasetImageLink dl join dl.parent d join dl.child i" in query:
+            project_name = unwrap(params.map["pname"])
+            dataset_name = unwrap(params.map["dname"]) if "dname" in params.map else None
+            rows = []
+            for project_id in server.project_ids():
+                if FakeProject(server, project_id).getName() != project_name:
+                    continue
+                for dataset_id in server.dataset_ids(project_id):
+                    if dataset_name is None or FakeDataset(server, dataset_id).getName() == dataset_name:
+                        rows.extend([rlong(image_id)] for image_id in server.image_ids(dataset_id))
+            return rows
+
+        if "from Plate p left outer join p.screenLinks" in query:
+            return [[rlong(1), rstring("plate 1"), rlong(1), rstring("screen 1")]]
+
+        if "from Well w join w.plate p" in query:
+            # plate 1: 2 rows x 3 columns, 2 fields per well, showing images 1..12
+            if unwrap(params.map["pid"]) != 1:
+                return []
+            return [[rstring("plate 1"), rstring("letter"), rstring("number"), rlong(10 * row + column + 1),
+                     rtype(row), rtype(column), rlong(image_id), rstring(FakeImage(server, image_id).getName()), rtype(None)]
+                    for row in range(2) for column in range(3)
+                    for image_id in [(row * 3 + column) * 2 + 1, (row * 3 + column) * 2 + 2]]
+
+        if "from WellAnnotationLink l" in query:
+            return [[rlong(10 * row + column + 1), rstring("compound"), rstring("cmpd_" + str(column))]
+                    for row in range(2) for column in range(3)]
+
+        if "(:ids)" in query:
+            image_ids = [image_id for image_id in unwrap(params.map["ids"]) if server.has_image(image_id)]
+            return [[rtype(value) for value in row] for image_id in image_ids
+                    for row in self._image_rows(query, image_id)]
+
+        raise NotImplementedError("FakeQueryService: unsupported query: " + query)
+
+    def _image_rows(self, query, image_id):
+        # every image has its pixels, one original file, one dataset, two key-value pairs, one tag and one attached file
+        server = self._server
+        dataset_id = server.dataset_of_image(image_id)
+
+        if "from Pixels p" in query:
+            physical_sizes = [0.65, 0.65, 2.0] if "physicalSize" in query else []
+            return [[image_id, FakeImage(server, image_id).getName()] + list(server.image_shape) +
+                    [server.pixels_type] + physical_sizes]
+        if "from Image i join i.fileset" in query:
+            return [[image_id, image_id, FakeOriginalFile(server, image_id).getName(), server.file_size]]
+        if "from DatasetImageLink dl" in query:
+            return [[image_id, FakeProject(server, server.project_of_dataset(dataset_id)).getName(),
+                     FakeDataset(server, dataset_id).getName()]]
+        if "MapAnnotation a" in query:
+            return [[image_id, "condition", "treated" if image_id % 2 else "control"],
+                    [image_id, "well", "A" + str(image_id % 12 + 1)]]
+        if "TagAnnotation a" in query:
+            return [[image_id, "bench_tag"]]
+        if "FileAnnotation a" in query:
+            return [[image_id, "analysis_" + str(image_id) + ".csv"]]
+
+        raise NotImplementedError("FakeQueryService: unsupported query: " + query)
+
+class FakeUpdateService(object):
+    """
+    Saves new projects and project-dataset links (requires omero-py for the model objects).
+    Like the server, it saves every element of an array on its own and returns new objects:
+    an unsaved project shared by several links is created once per link.
+    """
+
+    def __init__(self, server):
+        self._server = server
+
+    def saveAndReturnArray(self, objects, ctx=None):
+        self._server.round_trip()
+        return [self._save(obj) for obj in objects]
+
+    def _save(self, obj):
+        from omero.model import ProjectI, DatasetI, ProjectDatasetLinkI
+        from omero.rtypes import rstring, unwrap
+
+        if isinstance(obj, ProjectI):
+            project = ProjectI(self._server.add_project(unwrap(obj.getName())), True)
+            project.setName(rstring(unwrap(obj.getName())))
+            return project
+
+        if isinstance(obj, ProjectDatasetLinkI):
+            parent = obj.getParent()
+            project_id = unwrap(parent.getId())
+            if project_id is None:
+                project_id = self._server.add_project(unwrap(parent.getName()))
+            dataset_id = self._server.add_dataset(project_id, unwrap(obj.getChild().getName()))
+            link = ProjectDatasetLinkI()
+            link.setParent(ProjectI(project_id, False))
+            link.setChild(DatasetI(dataset_id, False))
+            return link
+
+        raise NotImplementedError("FakeUpdateService: unsupported object: " + type(obj).__name__)
+
+class FakeGateway(object):
+    """
+    Implements the subset of the BlitzGateway API used by omero-bifrost against a FakeServer
+    """
+
+    SERVICE_OPTS = None
+
+    def __init__(self, server):
+        self._server = server
+        self.closed = False
+
+    def getQueryService(self):
+        return FakeQueryService(self._server)
+
+    def getUpdateService(self):
+        return FakeUpdateService(self._server)
+
+    def connect(self, sUuid=None):
+        self._server.round_trip()
+        return True
+
+    def setSecure(self, secure):
+        pass
+
+    def keepAlive(self):
+        self._server.round_trip()
+        return not self.closed
+
+    def close(self, hard=True):
+        self.closed = True
+
+    def getEventContext(self):
+        return FakeEventContext()
+
+    def getUser(self):
+        return FakeObject(self._server, 0)
+
+    def _lookup(self, obj_type, obj_id):
+        server = self._server
+        if obj_type == "Project" and server.has_project(obj_id):
+            return FakeProject(server, obj_id)
+        if obj_type == "Dataset" and server.has_dataset(obj_id):
+            return FakeDataset(server, obj_id)
+        if obj_type == "Image" and server.has_image(obj_id):
+            return FakeImage(server, obj_id)
+        return None
+
+    def _all_objects(self, obj_type, opts):
+        server = self._server
+        if obj_type == "Project":
+            for project_id in server.project_ids():
+                yield FakeProject(server, project_id)
+        elif obj_type == "Dataset":
+            project_ids = [opts["project"]] if "project" in opts else server.project_ids()
+            for project_id in project_ids:
+                for dataset_id in server.dataset_ids(int(project_id)):
+                    yield FakeDataset(server, dataset_id)
+        elif obj_type == "Image":
+            if "dataset" in opts:
+                dataset_ids = [int(opts["dataset"])]
+            else:
+                dataset_ids = (ds_id for project_id in server.project_ids() for ds_id in server.dataset_ids(project_id))
+            for dataset_id in dataset_ids:
+                for image_id in server.image_ids(dataset_id):
+                    yield FakeImage(server, image_id)
+        elif obj_type == "TagAnnotation":
+            for text_value, tag_id in list(server.tags.items()):
+                yield FakeTag(server, tag_id, text_value)
+
+    def getObjects(self, obj_type, ids=None, params=None, attributes=None, opts=None):
+        import itertools
+
+        self._server.round_trip()
+        opts = opts or {}
+
+        if ids is not None:
+            objects = (self._lookup(obj_type, int(obj_id)) for obj_id in ids)
+            objects = (obj for obj in objects if obj is not None)
+        else:
+            objects = self._all_objects(obj_type, opts)
+
+        if attributes:
+            objects = (obj for obj in objects if all(_attribute_matches(obj, key, value) for key, value in attributes.items()))
+
+        offset = opts.get("offset", 0)
+        limit = opts.get("limit", None)
+        stop = None if limit is None else offset + limit
+
+        return (obj for obj in itertools.islice(objects, offset, stop))
+
+    def getObject(self, obj_type, oid=None, params=None, attributes=None, opts=None):
+        if oid is not None:
+            self._server.round_trip()
+            return self._lookup(obj_type, int(oid))
+
+        for obj in self.getObjects(obj_type, attributes=attributes, opts=opts):
+            return obj
+        return None
+
+    def getThumbnailSet(self, image_ids, max_size=64):
+        # placeholder JPEG data (start and end markers), about the size of a real thumbnail
+        self._server.round_trip()
+        data = b"\xff\xd8" + bytes(max_size * max_size // 2) + b"\xff\xd9"
+        return dict((int(image_id), data) for image_id in image_ids if self._server.has_image(int(image_id)))
+
+    def createImageFromNumpySeq(self, zctPlanes, imageName, sizeZ=1, sizeC=1, sizeT=1, description=None, dataset=None, **kwargs):
+        for plane in zctPlanes:
+            self._server.round_trip()
+        return FakeImage(self._server, self._server.new_id())
+
+def _attribute_matches(obj, key, value):
+
+    if key == "name":
+        return obj.getName() == value
+    if key == "textValue":
+        return obj.getTextValue() == value
+    return False
+
+def fake_gateway_factory(server):
+    """
+    Returns a gateway_factory for omero_bifrost.utils.pool_ops.ConnectionPool
+    """
+
+    def factory(session_uuid):
+        conn = FakeGateway(server)
+        conn.connect(session_uuid)
+        return conn
+
+    return factory
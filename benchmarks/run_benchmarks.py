@@ -0,0 +1,240 @@
+"""Benchmark suite for omero-bifrost against a fake OMERO server
+
+Runs the query, pull and push operations against an in-memory FakeGateway and
+the fake OMERO CLI in benchmarks/bin, at several scales, and writes the timings
+as JSON so they can be compared between revisions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scale small --scale medium --latency 0.002 --output results.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from benchmarks.fake_gateway import FakeServer, FakeGateway, fake_gateway_factory
+
+# (projects, datasets per project, images per dataset, images pulled/annotated)
+SCALES = {"small": (2, 5, 20, 4),
+          "medium": (5, 10, 200, 16),
+          "large": (10, 20, 500, 64)}
+
+# modules that log in through omero_connect and get the fake gateway instead
+CONNECT_USERS = ["omero_bifrost.cli",
+                 "omero_bifrost.push.push_ops"]
+
+
+@contextlib.contextmanager
+def fake_connections(server):
+    import importlib
+
+    patched = []
+    for module_name in CONNECT_USERS:
+        module = importlib.import_module(module_name)
+        patched.append((module, module.omero_connect))
+        module.omero_connect = lambda usr, pwd, host, port: FakeGateway(server)
+    try:
+        yield
+    finally:
+        for module, original in patched:
+            module.omero_connect = original
+
+def write_config(work_dir):
+    config_path = os.path.join(work_dir, "imaging_config.properties")
+    with open(config_path, "w") as config_file:
+        config_file.write("[OmeroServerSection]\n"
+                          "omero.username = bench\n"
+                          "omero.password = bench\n"
+                          "omero.host = localhost\n"
+                          "omero.port = 4064\n")
+    return config_path
+
+def run_cli(argv):
+    from omero_bifrost.utils.util_ops import invoke_cli_command
+
+    exit_code, std_out, std_err = invoke_cli_command(argv)
+    if exit_code != 0:
+        raise RuntimeError("omero-bifrost " + " ".join(argv) + " failed:\n" + std_out + std_err)
+
+########################################
+#benchmarks, each returns the function to time
+
+def bench_fetch_all_objects(server, scale, work_dir, config_path):
+    from omero_bifrost.query.query_ops import fetch_all_objects
+
+    conn = FakeGateway(server)
+    return lambda: fetch_all_objects(conn)
+
+def bench_query_img_ids(server, scale, work_dir, config_path):
+    output_path = os.path.join(work_dir, "img_ids.tsv")
+    return lambda: run_cli(["query", "img-ids", "-c", config_path, "-o", output_path])
+
+def bench_get_image_array(server, scale, work_dir, config_path):
+    from omero_bifrost.pull.pull_ops import get_image_array
+
+    conn = FakeGateway(server)
+    return lambda: [get_image_array(conn, img_id) for img_id in range(1, scale[3] + 1)]
+
+def bench_get_image_array_pool(server, scale, work_dir, config_path):
+    from omero_bifrost.pull.pull_ops import get_image_array
+    from omero_bifrost.utils.pool_ops import ConnectionPool
+
+    conn = FakeGateway(server)
+    pool = ConnectionPool("bench", "bench", "localhost", 4064, size=4, gateway_factory=fake_gateway_factory(server))
+    return lambda: [get_image_array(conn, img_id, pool=pool) for img_id in range(1, scale[3] + 1)]
+
+def bench_register_image_array(server, scale, work_dir, config_path):
+    import numpy as np
+    import omero # dataset names are resolved with an HQL query
+    from omero_bifrost.push.push_ops import register_image_array
+
+    size_x, size_y, size_z, size_c, size_t = server.image_shape
+    img = np.zeros((size_t, size_c, size_y, size_x, size_z), dtype=server.pixels_type)
+    last_project = "project " + str(server.n_projects)
+    last_dataset = "dataset " + str(server.n_projects * server.n_datasets)
+    return lambda: register_image_array(img, "bench", "", last_project, last_dataset, "bench", "bench", "localhost")
+
+def bench_bulk_tagging(server, scale, work_dir, config_path):
+    ops_path = os.path.join(work_dir, "tag_ops.jsonl")
+    with open(ops_path, "w") as ops_file:
+        for img_id in range(1, scale[3] + 1):
+            ops_file.write(json.dumps({"command": "push img-tag", "args": [str(img_id), "bench_tag"]}) + "\n")
+    result_path = os.path.join(work_dir, "tag_results.jsonl")
+    return lambda: run_cli(["batch", ops_path, "-c", config_path, "--parallel", "4", "-o", result_path])
+
+def bench_pull_ome_tiffs(server, scale, work_dir, config_path):
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    argv = ["pull", "ome-tiffs", output_dir, "-c", config_path]
+    for img_id in range(1, scale[3] + 1):
+        argv.extend(["--img-id", str(img_id)])
+    return lambda: run_cli(argv)
+
+def bench_pull_orig_files(server, scale, work_dir, config_path):
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    argv = ["pull", "orig-files", output_dir, "-c", config_path]
+    for img_id in range(1, scale[3] + 1):
+        argv.extend(["--img-id", str(img_id)])
+    return lambda: run_cli(argv)
+
+def bench_pull_metadata(server, scale, work_dir, config_path):
+    import omero # metadata is fetched with HQL queries
+
+    output_path = os.path.join(work_dir, "metadata.csv")
+    return lambda: run_cli(["pull", "metadata", output_path, "--project", "project 1", "-c", config_path])
+
+def bench_pull_thumbnails(server, scale, work_dir, config_path):
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    argv = ["pull", "thumbnails", output_dir, "-c", config_path]
+    for img_id in range(1, scale[3] + 1):
+        argv.extend(["--img-id", str(img_id)])
+    return lambda: run_cli(argv)
+
+def bench_pull_plate(server, scale, work_dir, config_path):
+    import omero # the plate layout is loaded with an HQL query
+
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    return lambda: run_cli(["pull", "plate", "1", output_dir, "--workers", "4", "-c", config_path])
+
+BENCHMARKS = [("fetch_all_objects", bench_fetch_all_objects),
+              ("query_img_ids", bench_query_img_ids),
+              ("get_image_array", bench_get_image_array),
+              ("get_image_array_pool", bench_get_image_array_pool),
+              ("register_image_array", bench_register_image_array),
+              ("bulk_tagging", bench_bulk_tagging),
+              ("pull_ome_tiffs", bench_pull_ome_tiffs),
+              ("pull_orig_files", bench_pull_orig_files),
+              ("pull_metadata", bench_pull_metadata),
+              ("pull_thumbnails", bench_pull_thumbnails),
+              ("pull_plate", bench_pull_plate)]
+
+########################################
+
+def run_benchmark(name, bench_function, scale_name, args, work_dir, config_path):
+    scale = SCALES[scale_name]
+    server = FakeServer(scale[0], scale[1], scale[2], latency=args.latency)
+    result = {"name": name, "scale": scale_name,
+              "projects": scale[0], "datasets_per_project": scale[1], "images_per_dataset": scale[2],
+              "latency": args.latency}
+
+    with fake_connections(server):
+        try:
+            timed_function = bench_function(server, scale, work_dir, config_path)
+        except ImportError as e:
+            result["skipped"] = "missing dependency: " + str(e)
+            return result
+
+        seconds = []
+        calls = []
+        for _ in range(args.repeat):
+            server.calls = 0
+            start = time.perf_counter()
+            timed_function()
+            seconds.append(time.perf_counter() - start)
+            calls.append(server.calls)
+
+    result.update({"seconds": seconds,
+                   "min_seconds": min(seconds),
+                   "median_seconds": statistics.median(seconds),
+                   "server_calls": calls[-1]})
+
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, universal_newlines=True).strip()
+    except Exception:
+        return ""
+
+def main():
+    parser = argparse.ArgumentParser(description="omero-bifrost benchmarks against a fake OMERO server")
+    parser.add_argument("--scale", action="append", choices=sorted(SCALES.keys()), help="Scale(s) to run (default: small)")
+    parser.add_argument("--bench", action="append", help="Benchmark(s) to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0.001, help="Simulated seconds per server round trip")
+    parser.add_argument("--startup", type=float, default=0.5, help="Simulated start-up seconds per OMERO CLI call")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument("--output", default="-", help="JSON results file ('-' for standard output)")
+    args = parser.parse_args()
+
+    os.environ["PATH"] = os.path.join(BENCH_DIR, "bin") + os.pathsep + os.environ.get("PATH", "")
+    os.environ["FAKE_OMERO_STARTUP"] = str(args.startup)
+
+    scales = args.scale or ["small"]
+    benchmarks = [(name, function) for name, function in BENCHMARKS if not args.bench or name in args.bench]
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_path = write_config(work_dir)
+        # keep the simulated transfers out of the user's throughput history
+        os.environ["OMERO_BIFROST_THROUGHPUT"] = os.path.join(work_dir, "throughput.json")
+        for scale_name in scales:
+            for name, bench_function in benchmarks:
+                result = run_benchmark(name, bench_function, scale_name, args, work_dir, config_path)
+                sys.stderr.write(name + " [" + scale_name + "]: " + str(result.get("median_seconds", result.get("skipped"))) + "\n")
+                results.append(result)
+
+    report = {"timestamp": time.time(),
+              "git_revision": git_revision(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "results": results}
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Asyncio versions of the push, pull and query operations
+
+Importer/exporter calls run as asyncio subprocesses, gateway (Ice) calls and the
+remaining OMERO CLI calls are offloaded to the default thread pool executor.
+All functions take an optional OperationScheduler that caps how many operations
+of each type run against the server at the same time.
+"""
+
+import time
+import asyncio
+import functools
+
+from omero_bifrost.utils.util_ops import parse_omero_cli_ids, get_path_size
+from omero_bifrost.utils.limit_ops import throttle
+from omero_bifrost.utils.trace_ops import trace_span
+from omero_bifrost.utils.plan_ops import record_transfer
+from omero_bifrost.utils.util_ops import omero_connect as omero_connect_sync
+from omero_bifrost.query.query_ops import fetch_all_objects as fetch_all_objects_sync
+from omero_bifrost.query.query_ops import get_omero_dataset_id as get_omero_dataset_id_sync
+from omero_bifrost.push.push_ops import get_import_cmd
+from omero_bifrost.push.push_ops import attach_file_to_image as attach_file_to_image_sync
+from omero_bifrost.push.push_ops import create_tag as create_tag_sync
+from omero_bifrost.push.push_ops import add_tag_to_image as add_tag_to_image_sync
+from omero_bifrost.push.push_ops import add_kv_to_image as add_kv_to_image_sync
+from omero_bifrost.pull.pull_ops import get_download_cmd, get_export_cmd, get_export_path
+from omero_bifrost.pull.pull_ops import get_image_array as get_image_array_sync
+
+# a single BlitzGateway must not be used from several threads at once,
+# raise the "gateway" limit only when concurrent calls use different connections
+DEFAULT_LIMITS = {"import": 2,
+                  "export": 4,
+                  "download": 4,
+                  "annotate": 4,
+                  "gateway": 1}
+
+
+class OperationScheduler(object):
+    """
+    Caps the number of concurrently running server operations per operation type
+    Example:
+        scheduler = OperationScheduler({"export": 8})
+        await asyncio.gather(*[export_ome_tiff_file(i, path_i, usr, pwd, host, scheduler=scheduler) for ...])
+    Args:
+        limits (dict): operation type -> maximum number of concurrent operations,
+                overrides DEFAULT_LIMITS for the given types
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits is not None:
+            self.limits.update(limits)
+        self._semaphores = {}
+
+    def _get_semaphore(self, op_type):
+        # created lazily, so the semaphores belong to the running event loop
+        if op_type not in self._semaphores:
+            self._semaphores[op_type] = asyncio.Semaphore(self.limits.get(op_type, 1))
+        return self._semaphores[op_type]
+
+    async def run(self, op_type, coro_function, *args, **kwargs):
+        """
+        Awaits coro_function(*args, **kwargs) once a slot for op_type is free
+        """
+
+        async with self._get_semaphore(op_type):
+            return await coro_function(*args, **kwargs)
+
+
+async def _schedule(scheduler, op_type, coro_function, *args, **kwargs):
+
+    if scheduler is None:
+        return await coro_function(*args, **kwargs)
+
+    return await scheduler.run(op_type, coro_function, *args, **kwargs)
+
+async def _run_in_thread(func, *args, **kwargs):
+
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+async def run_omero_cmd(cmd, nbytes=0):
+    """
+    Runs an OMERO CLI command line as an asyncio subprocess
+    Args:
+        cmd (string): the command line
+        nbytes (int): bytes the command uploads, accounted for by the transfer limiter
+    Returns:
+        int, string, string: return code, standard output and standard error of the command
+    """
+
+    await _run_in_thread(throttle, 1, nbytes)
+
+    with trace_span("subprocess", cmd.split(" -s ")[0], nbytes):
+        proc = await asyncio.create_subprocess_shell(cmd,
+                                                     stdout=asyncio.subprocess.PIPE,
+                                                     stderr=asyncio.subprocess.PIPE)
+
+        std_out, std_err = await proc.communicate()
+
+    return int(proc.returncode), std_out.decode(errors="replace"), std_err.decode(errors="replace")
+
+async def _run_timed_omero_cmd(cmd, nbytes=0):
+    # run_omero_cmd, also returning its duration for record_transfer: timed once the
+    # scheduler has started it, so that waiting for a free slot is not counted
+    start = time.time()
+    return_code, std_out, std_err = await run_omero_cmd(cmd, nbytes)
+
+    return return_code, std_out, std_err, time.time() - start
+
+########################################
+#push
+
+async def register_image_file_with_dataset_id(file_path, dataset_id, usr, pwd, host, port=4064, scheduler=None):
+    """
+    Async version of push_ops.register_image_file_with_dataset_id (operation type "import")
+    Returns:
+        list of strings: list of newly generated omero IDs for registered images
+    """
+
+    image_ids = []
+
+    if dataset_id != -1:
+        cmd = get_import_cmd(file_path, dataset_id, usr, pwd, host, port)
+        import_size = get_path_size(file_path)
+        return_code, std_out, std_err, seconds = await _schedule(scheduler, "import", _run_timed_omero_cmd, cmd, import_size)
+
+        if return_code == 0:
+            record_transfer("import", import_size, seconds)
+            image_ids = parse_omero_cli_ids(std_out, "Image:")
+
+    return image_ids
+
+async def register_image_folder_with_dataset_id(folder_path, dataset_id, usr, pwd, host, port=4064, scheduler=None):
+    """
+    Async version of push_ops.register_image_folder_with_dataset_id (operation type "import")
+    Returns:
+        list of strings: list of newly generated omero IDs for registered images
+    """
+
+    image_ids = []
+
+    if dataset_id != -1:
+        cmd = get_import_cmd(folder_path, dataset_id, usr, pwd, host, port, depth=1)
+        import_size = get_path_size(folder_path, depth=1)
+        return_code, std_out, std_err, seconds = await _schedule(scheduler, "import", _run_timed_omero_cmd, cmd, import_size)
+
+        if return_code == 0:
+            record_transfer("import", import_size, seconds)
+            image_ids = parse_omero_cli_ids(std_out, "Image:", first_only=False)
+
+    return image_ids
+
+async def attach_file_to_image(file_path, image_id, usr, pwd, host, port=4064, scheduler=None):
+    """
+    Async version of push_ops.attach_file_to_image (operation type "annotate")
+    """
+
+    return await _schedule(scheduler, "annotate", _run_in_thread, attach_file_to_image_sync, file_path, image_id, usr, pwd, host, port)
+
+async def create_tag(tag_value, tag_desc, usr, pwd, host, port=4064, scheduler=None):
+    """
+    Async version of push_ops.create_tag (operation type "annotate")
+    """
+
+    return await _schedule(scheduler, "annotate", _run_in_thread, create_tag_sync, tag_value, tag_desc, usr, pwd, host, port)
+
+async def add_tag_to_image(image_id, tag_id, usr, pwd, host, port=4064, scheduler=None):
+    """
+    Async version of push_ops.add_tag_to_image (operation type "annotate")
+    """
+
+    return await _schedule(scheduler, "annotate", _run_in_thread, add_tag_to_image_sync, image_id, tag_id, usr, pwd, host, port)
+
+async def add_kv_to_image(conn, image_id, key_value_data, scheduler=None):
+    """
+    Async version of push_ops.add_kv_to_image (operation type "gateway")
+    """
+
+    return await _schedule(scheduler, "gateway", _run_in_thread, add_kv_to_image_sync, conn, image_id, key_value_data)
+
+########################################
+#pull
+
+async def export_ome_tiff_file(image_id, download_path, usr, pwd, host, port=4064, scheduler=None):
+    """
+    Async version of pull_ops.export_ome_tiff_file (operation type "export")
+    Returns:
+        string, string: standard output and standard error of the exporter
+    """
+
+    std_out, std_err = "", ""
+
+    if image_id != -1:
+        cmd = get_export_cmd(image_id, download_path, usr, pwd, host, port)
+        return_code, std_out, std_err, seconds = await _schedule(scheduler, "export", _run_timed_omero_cmd, cmd)
+        file_size = get_path_size(get_export_path(download_path))
+        if return_code == 0:
+            record_transfer("export", file_size, seconds)
+        await _run_in_thread(throttle, 0, file_size)
+
+    return std_out, std_err
+
+async def download_original_image_file(orig_file_id, download_path, usr, pwd, host, port=4064, scheduler=None):
+    """
+    Async version of pull_ops.download_original_image_file (operation type "download")
+    Returns:
+        string, string: standard output and standard error of the download
+    """
+
+    std_out, std_err = "", ""
+
+    if orig_file_id != -1:
+        cmd = get_download_cmd(orig_file_id, download_path, usr, pwd, host, port)
+        return_code, std_out, std_err, seconds = await _schedule(scheduler, "download", _run_timed_omero_cmd, cmd)
+        file_size = get_path_size(download_path)
+        if return_code == 0:
+            record_transfer("download", file_size, seconds)
+        await _run_in_thread(throttle, 0, file_size)
+
+    return std_out, std_err
+
+async def get_image_array(conn, image_id, scheduler=None):
+    """
+    Async version of pull_ops.get_image_array (operation type "gateway")
+    """
+
+    return await _schedule(scheduler, "gateway", _run_in_thread, get_image_array_sync, conn, image_id)
+
+########################################
+#query
+
+async def omero_connect(usr, pwd, host, port, scheduler=None):
+    """
+    Async version of util_ops.omero_connect (operation type "gateway")
+    """
+
+    return await _schedule(scheduler, "gateway", _run_in_thread, omero_connect_sync, usr, pwd, host, port)
+
+async def fetch_all_objects(conn, scheduler=None):
+    """
+    Async version of query_ops.fetch_all_objects (operation type "gateway")
+    """
+
+    return await _schedule(scheduler, "gateway", _run_in_thread, fetch_all_objects_sync, conn)
+
+async def get_omero_dataset_id(conn, project_name, dataset_name, scheduler=None):
+    """
+    Async version of query_ops.get_omero_dataset_id (operation type "gateway")
+    """
+
+    return await _schedule(scheduler, "gateway", _run_in_thread, get_omero_dataset_id_sync, conn, project_name, dataset_name)
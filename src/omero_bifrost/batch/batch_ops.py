@@ -0,0 +1,153 @@
+
+
+def read_batch_file(ops_file_path):
+    """
+    Reads a JSONL file of omero-bifrost operations, one JSON object per line.
+    Empty lines and lines starting with '#' are ignored.
+    Example line:
+        {"command": "push key-value", "args": ["1234", "--kv-pair", "key1:value1"], "group": "img_1234"}
+    Args:
+        ops_file_path (string): path to the JSONL file
+    Returns:
+        list of dicts: operations with keys "line", "argv" and "group"
+    """
+
+    import json
+    import shlex
+
+    ops = []
+
+    with open(ops_file_path) as ops_file:
+        for line_number, line in enumerate(ops_file, start=1):
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+
+            entry = json.loads(line)
+
+            if "argv" in entry:
+                argv = [str(arg) for arg in entry["argv"]]
+            else:
+                argv = shlex.split(entry["command"]) + [str(arg) for arg in entry.get("args", [])]
+
+            if len(argv) == 0 or argv[0] in ("batch", "serve"):
+                raise ValueError("Line " + str(line_number) + ": not a runnable omero-bifrost command: " + line)
+
+            ops.append({"line": line_number,
+                        "argv": argv,
+                        "group": entry.get("group", None)})
+
+    return ops
+
+def group_batch_ops(ops):
+    """
+    Splits operations into groups that can run independently of each other.
+    Operations sharing a "group" value keep their file order and run one after
+    the other; operations without a group form a group of their own.
+    """
+
+    groups = []
+    named_groups = {}
+
+    for op in ops:
+        if op["group"] is None:
+            groups.append([op])
+        elif op["group"] in named_groups:
+            named_groups[op["group"]].append(op)
+        else:
+            named_groups[op["group"]] = [op]
+            groups.append(named_groups[op["group"]])
+
+    return groups
+
+def run_batch(ops_file_path, result_file, config_file_path="", parallel=1):
+    """
+    Runs all operations of a JSONL batch file in this process. Gateways are kept
+    open and reused across operations (one per worker thread), independent
+    groups of operations run on up to 'parallel' worker threads, and one JSON
+    result line per operation is written to result_file as soon as it finishes.
+    If an operation fails, the remaining operations of its group are skipped.
+
+    Args:
+        ops_file_path (string): path to the JSONL batch file (see read_batch_file)
+        result_file: writable text stream for the JSONL results
+        config_file_path (string): OMERO config file added to operations that do not set --config/-c
+        parallel (int): number of worker threads
+    Returns:
+        int: number of operations that failed or were skipped
+    """
+
+    import json
+    import time
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+
+    from omero_bifrost.utils.util_ops import enable_session_cache, close_cached_sessions, close_thread_sessions, invoke_cli_command
+
+    ops = read_batch_file(ops_file_path)
+
+    if config_file_path != "":
+        for op in ops:
+            if "--config" not in op["argv"] and "-c" not in op["argv"]:
+                op["argv"] = op["argv"] + ["--config", config_file_path]
+
+    owns_session_cache = enable_session_cache()
+
+    results = queue.Queue()
+
+    def run_group(group):
+        failed = False
+        for op in group:
+            result = {"line": op["line"], "argv": op["argv"]}
+            if failed:
+                result.update({"exit_code": None, "skipped": True})
+            else:
+                start_time = time.time()
+                exit_code, std_out, std_err = invoke_cli_command(op["argv"])
+                result.update({"exit_code": exit_code,
+                               "seconds": round(time.time() - start_time, 3),
+                               "stdout": std_out,
+                               "stderr": std_err})
+                failed = exit_code != 0
+            results.put(result)
+
+    def run_worker(group_queue):
+        try:
+            while True:
+                try:
+                    group = group_queue.get_nowait()
+                except queue.Empty:
+                    return
+                run_group(group)
+        finally:
+            # the worker threads end with the batch: their gateways must not stay open in
+            # a session cache that outlives it (e.g. the daemon's)
+            close_thread_sessions()
+
+    groups = group_batch_ops(ops)
+    failures = 0
+
+    group_queue = queue.Queue()
+    for group in groups:
+        group_queue.put(group)
+    workers = max(1, min(parallel, len(groups)))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_worker, group_queue) for _ in range(workers)]
+
+            # results are written from this thread only, as they arrive
+            for _ in range(len(ops)):
+                result = results.get()
+                if result["exit_code"] != 0:
+                    failures += 1
+                result_file.write(json.dumps(result) + "\n")
+                result_file.flush()
+
+            for future in futures:
+                future.result()
+    finally:
+        if owns_session_cache:
+            close_cached_sessions()
+
+    return failures
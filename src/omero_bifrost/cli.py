@@ -11,6 +11,8 @@ It contains the following functions:
     
 """
 
+import threading
+
 import typer
 from rich import print
 from typing_extensions import Annotated
@@ -18,16 +20,26 @@ from typing import List
 
 #####################################
 
-from omero_bifrost.utils.util_ops import get_omero_config, format_xml_ouput, omero_connect, img_map_from_tsv
-from omero_bifrost.query.query_ops import fetch_all_objects, print_data_tree, print_data_ids, get_omero_dataset_id
+from omero_bifrost.utils.util_ops import get_omero_config, format_xml_ouput, omero_connect, omero_close, img_map_from_tsv, write_output_stream
+from omero_bifrost.query.query_ops import DEFAULT_PAGE_SIZE, fetch_all_objects, iter_all_objects, iter_filtered_images, print_data_tree, print_data_ids, get_omero_dataset_id, resolve_dataset_ids, get_scope_image_ids
 from omero_bifrost.push.push_ops import register_image_file_with_dataset_id, register_image_folder_with_dataset_id 
 from omero_bifrost.push.push_ops import attach_file_to_image, create_tag, add_tag_to_image, add_kv_to_image
 from omero_bifrost.pull.pull_ops import download_original_image_file, export_ome_tiff_file
+from omero_bifrost.pull.pull_ops import ExportBundle, bundle_omero_cmd_output, get_export_cmd, get_download_cmd
+from omero_bifrost.pull.pull_ops import METADATA_CHUNK_SIZE, METADATA_COLUMNS, METADATA_FORMATS, fetch_image_metadata, write_metadata_table
+from omero_bifrost.pull.pull_ops import THUMBNAIL_BATCH_SIZE, THUMBNAIL_FORMATS, iter_thumbnails, iter_projections, write_thumbnails
+from omero_bifrost.utils.trace_ops import trace_span
+from omero_bifrost.utils.plan_ops import plan_pull_orig_files, plan_pull_ome_tiffs, plan_push
+from omero_bifrost.hcs.hcs_ops import LAYOUT_COLUMNS, LAYOUT_HEADER, list_plates, load_plate_layout, select_fields, pull_plate_fields, fetch_plate_metadata
 
 #####################################
 
 app = typer.Typer()
 
+# nesting depth of command invocations in this process (batch lines run inside the batch command)
+_invocation_depth = 0
+_invocation_lock = threading.Lock()
+
 query_app = typer.Typer()
 push_app = typer.Typer()
 pull_app = typer.Typer()
@@ -36,30 +48,234 @@ app.add_typer(push_app, name="push", help="Push image data into an OMERO Server.
 app.add_typer(pull_app, name="pull", help="Pull image data from an OMERO Server.")
 
 
+@app.callback()
+def main(
+        ctx: typer.Context,
+        max_bytes_per_sec: Annotated[str, typer.Option(help="Cap on the aggregate transfer rate of all workers, e.g. '50M' (0: unlimited, default: [TransferLimitSection] of the config file)")] = "",
+        max_calls_per_sec: Annotated[str, typer.Option(help="Cap on the aggregate rate of server calls of all workers (0: unlimited)")] = "",
+        limit_profiles: Annotated[str, typer.Option(help="Time-window limits overriding the caps, e.g. '08:00-20:00=20M/10; 20:00-08:00=0/0'")] = "",
+        profile: Annotated[bool, typer.Option(help="Trace logins, server calls, subprocesses and file I/O and print a summary table")] = False,
+        trace_json: Annotated[str, typer.Option(help="Path to write a JSON trace of all traced operations")] = "",
+        prometheus: Annotated[str, typer.Option(help="Path to write trace totals in the Prometheus text format (e.g. for the node exporter textfile collector)")] = ""
+        ):
+
+    from omero_bifrost.utils.limit_ops import configure_transfer_limits, parse_size, parse_limit_profiles
+    from omero_bifrost.utils.limit_ops import save_transfer_limits, restore_transfer_limits
+    from omero_bifrost.utils.trace_ops import enable_tracing
+    from omero_bifrost.utils.plan_ops import save_throughput_history
+
+    outermost = enter_invocation()
+    ctx.call_on_close(exit_invocation)
+
+    # the transfer limiter is process-wide too: the limits and the throttle report belong to
+    # the outermost invocation, and the earlier limits (e.g. of a daemon) are restored after it
+    cli_limits = max_bytes_per_sec != "" or max_calls_per_sec != "" or limit_profiles != ""
+    if outermost:
+        limits_state = save_transfer_limits()
+        ctx.call_on_close(lambda: restore_transfer_limits(limits_state))
+        if cli_limits:
+            configure_transfer_limits(parse_size(max_bytes_per_sec or "0"),
+                                      float(max_calls_per_sec or "0"),
+                                      parse_limit_profiles(limit_profiles))
+        ctx.call_on_close(print_throttle_report)
+    elif cli_limits:
+        from rich.console import Console
+        Console(stderr=True).print("[bold yellow]Warning: transfer limits of batch lines are ignored, set them on the batch command")
+
+    ctx.call_on_close(save_throughput_history)
+
+    # the tracer is process-wide: only the outermost invocation (not the lines of a batch)
+    # turns it on, and only the invocation that turned it on reports and turns it off
+    if outermost and (profile or trace_json != "" or prometheus != ""):
+        enable_tracing(keep_events=trace_json != "")
+        ctx.call_on_close(lambda: write_trace_reports(profile, trace_json, prometheus))
+
+def enter_invocation():
+    """
+    Counts a (possibly nested, e.g. batch line) command invocation in this process
+    Returns:
+        bool: True for the outermost invocation
+    """
+
+    global _invocation_depth
+
+    with _invocation_lock:
+        _invocation_depth += 1
+        return _invocation_depth == 1
+
+def exit_invocation():
+
+    global _invocation_depth
+
+    with _invocation_lock:
+        _invocation_depth -= 1
+
+def suspend_invocations():
+    """
+    Makes the next invocation the outermost one again, for the requests that the
+    daemon runs inside its own serve invocation
+    Returns:
+        int: the current depth, to be put back with resume_invocations
+    """
+
+    global _invocation_depth
+
+    with _invocation_lock:
+        depth = _invocation_depth
+        _invocation_depth = 0
+        return depth
+
+def resume_invocations(depth):
+
+    global _invocation_depth
+
+    with _invocation_lock:
+        _invocation_depth = depth
+
+def write_trace_reports(profile, trace_json, prometheus):
+
+    from rich.console import Console
+    from omero_bifrost.utils.trace_ops import disable_tracing, format_trace_table, write_trace_json, write_trace_prometheus
+
+    tracer = disable_tracing()
+
+    if tracer is None:
+        return
+
+    if profile:
+        Console(stderr=True).print(format_trace_table(tracer))
+    if trace_json != "":
+        write_trace_json(tracer, trace_json)
+    if prometheus != "":
+        write_trace_prometheus(tracer, prometheus)
+
+def get_log_print(to_stderr):
+    """
+    Returns the print function for progress messages: rich print, or printing
+    to standard error if standard output carries the command's results
+    """
+
+    if not to_stderr:
+        return print
+
+    from rich.console import Console
+
+    return Console(stderr=True).print
+
+def print_throttle_report():
+
+    from rich.console import Console
+    from omero_bifrost.utils.limit_ops import get_throttle_report
+
+    report = get_throttle_report()
+
+    if report is not None and report["throttled_count"] > 0:
+        Console(stderr=True).print("[bold yellow]Throttled " + str(report["throttled_count"]) + " times for "
+                                   + str(report["throttled_seconds"]) + "s (" + str(report["calls"]) + " calls, "
+                                   + str(report["bytes"]) + " bytes accounted)")
+
+def print_transfer_plan(plan, output_path="", log=print):
+    """
+    Prints a transfer plan (see plan_ops) with the estimated duration from the throughput
+    history and, for pulls to local files, the free disk space
+    Returns:
+        bool: False if the output file system does not have enough free space
+    """
+
+    from omero_bifrost.utils.plan_ops import estimate_duration, get_free_disk_space, format_size, format_duration
+
+    log("[bold green]Plan: " + plan["operation"] + " (dry run, nothing is transferred)")
+    log("[bold blue]Files: " + str(plan["file_count"]) + ", data: " + format_size(plan["bytes"])
+        + ", expected output: " + format_size(plan["expected_bytes"]))
+
+    if len(plan["missing"]) > 0:
+        log("[bold red]Not found: " + str(len(plan["missing"])) + " images " + str(plan["missing"][:20]))
+
+    seconds = estimate_duration(plan["kind"], plan["transfer_count"], plan["bytes"])
+    if seconds is None:
+        log("[bold blue]Estimated duration: unknown (no earlier " + plan["kind"] + " runs recorded)")
+    else:
+        rate = format_size(plan["bytes"] / seconds) + "/s" if seconds > 0 else "-"
+        log("[bold blue]Estimated duration: " + format_duration(seconds) + " (" + rate + " from earlier " + plan["kind"] + " runs)")
+
+    if output_path == "" or output_path == "-":
+        return True
+
+    free_bytes = get_free_disk_space(output_path)
+    enough_space = free_bytes >= plan["expected_bytes"]
+    log(("[bold blue]" if enough_space else "[bold red]") + "Free space at " + output_path + ": "
+        + format_size(free_bytes) + (" (enough)" if enough_space else " (NOT ENOUGH)"))
+
+    return enough_space
+
+@app.command("serve", help="Run a daemon that keeps OMERO sessions open; other omero-bifrost calls are forwarded to it while it runs")
+def serve(
+        socket_path: Annotated[str, typer.Option("--socket", "-s", help="Path to the Unix socket (default: $OMERO_BIFROST_SOCKET, or a private per-user directory in $XDG_RUNTIME_DIR or the temp dir)")] = "",
+        idle_timeout: Annotated[int, typer.Option(help="Stop after this many seconds without requests (0: run until stopped)")] = 0,
+        stop: Annotated[bool, typer.Option(help="Stop a running daemon")] = False
+        ):
+
+    from omero_bifrost.serve.serve_ops import get_socket_path, run_server, stop_server
+
+    if stop:
+        if stop_server(socket_path):
+            print("[bold blue]Daemon stopped.")
+        else:
+            print("[bold red]No daemon running on: " + get_socket_path(socket_path))
+        return
+
+    print("[bold blue]Listening on: " + get_socket_path(socket_path))
+    try:
+        run_server(socket_path, idle_timeout)
+    except RuntimeError as e:
+        print("[bold red]Error: " + str(e))
+        raise typer.Exit(code=1)
+
+
+@app.command("batch", help="Run a JSONL file of omero-bifrost operations in one process, reusing the OMERO session")
+def batch(
+        ops_file_path: Annotated[str, typer.Argument(help="Path to a JSONL file, one operation per line, e.g. {\"command\": \"push img-tag\", \"args\": [\"1234\", \"tag1\"], \"group\": \"img_1234\"}")],
+        config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file, used by lines that do not set --config")] = "./imaging_config.properties",
+        parallel: Annotated[int, typer.Option("--parallel", "-j", help="Number of operation groups run in parallel (lines sharing a 'group' value always run in order)")] = 1,
+        output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output JSONL results file ('-' for standard output)")] = "-"
+        ):
+
+    import sys
+
+    from omero_bifrost.batch.batch_ops import run_batch
+
+    if output_file_path == "-":
+        failures = run_batch(ops_file_path, sys.stdout, config_file_path, parallel)
+    else:
+        with open(output_file_path, "w") as result_file:
+            failures = run_batch(ops_file_path, result_file, config_file_path, parallel)
+
+    if failures > 0:
+        raise typer.Exit(code=1)
+
+
 @query_app.command("list-all", help="Query all accessible OMERO objects")
 def query_list_all(
         config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties",
-        output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output XML file")] = "./omero_bifrost_output.xml",
-        to_file: Annotated[bool, typer.Option(help="output to XML file")] = False,
+        output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output file ('-' for standard output)")] = "./omero_bifrost_output.xml",
+        output_format: Annotated[str, typer.Option("--format", "-f", help="Output file format: xml, xml-stream (written while fetched, count at the end), tsv or jsonl")] = "xml",
+        page_size: Annotated[int, typer.Option(min=1, help="Number of objects fetched per server query")] = DEFAULT_PAGE_SIZE,
+        to_file: Annotated[bool, typer.Option(help="output to file")] = False,
         to_xml: Annotated[bool, typer.Option(help="Print XML ouput to system console")] = False
         ):
 
-    import xml.etree.ElementTree as ET
-    
     omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
     conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
 
+    # results are written while they are fetched (except for xml, which needs the count up front)
     if to_file:
-        xml_tree = format_xml_ouput(fetch_all_objects(conn))
-        xml_tree.write(output_file_path)
+        write_output_stream(iter_all_objects(conn, page_size), output_file_path, output_format, ["type", "name", "id"])
     elif to_xml:
-        xml_tree = format_xml_ouput(fetch_all_objects(conn))
-        xml_str = ET.tostring(xml_tree.getroot(), encoding='unicode')
-        print("[bold red]" + xml_str)
+        write_output_stream(iter_all_objects(conn, page_size), "-", "xml", ["type", "name", "id"])
     else:
-        print_data_tree(conn)
+        print_data_tree(conn, page_size)
 
-    conn.close()
+    omero_close(conn)
 
 
 @query_app.command("dataset-id", help="Query the ID of an OMERO dataset using project and dataset names")
@@ -86,7 +302,8 @@ def query_dataset_id(
 
     if to_file:
         xml_tree = format_xml_ouput(output_map)
-        xml_tree.write(output_file_path)
+        with trace_span("io", "write XML"):
+            xml_tree.write(output_file_path)
     elif to_xml:
         xml_tree = format_xml_ouput(output_map)
         xml_str = ET.tostring(xml_tree.getroot(), encoding='unicode')
@@ -94,7 +311,7 @@ def query_dataset_id(
     else:
         print("[bold red]" + str(output_map))
 
-    conn.close()
+    omero_close(conn)
 
 @query_app.command("img-ids", help="Query image IDs from OMERO using key-value pairs and tags")
 def query_image_ids(
@@ -102,15 +319,15 @@ def query_image_ids(
         kv_pair: Annotated[List[str], typer.Option(default=..., help="Pairs of key-values for query, in format '--kv-pair key1:value1 --kv-pair key2:value2'")] = [],
         tag: Annotated[List[str], typer.Option(default=..., help="Tag values for query, in format '--tag value1 --tag value2'")] = [],
         config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties",
-        output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output TSV file")] = "./omero_bifrost_output.tsv",
+        output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output file ('-' for standard output)")] = "./omero_bifrost_output.tsv",
+        output_format: Annotated[str, typer.Option("--format", "-f", help="Output file format: tsv, xml, xml-stream (written while fetched, count at the end) or jsonl")] = "tsv",
+        page_size: Annotated[int, typer.Option(min=1, help="Number of images fetched and filtered per server query")] = DEFAULT_PAGE_SIZE,
         to_file: Annotated[bool, typer.Option(help="output to XML file")] = False,
         to_xml: Annotated[bool, typer.Option(help="Print XML ouput to system console")] = False
         ):
     
-    import xml.etree.ElementTree as ET
-
-    import ezomero
-    import csv
+    # keep standard output clean for the results when they are written there
+    log = get_log_print(output_file_path == "-")
 
     project_name_list = p_name
 
@@ -126,56 +343,63 @@ def query_image_ids(
     omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
     conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
 
-    if len(project_name_list) > 0:
-        project_obj_list = []
-        for project_name in project_name_list:
-            project_obj_list.extend(list(conn.getObjects("Project", attributes={"name": project_name})))
-    else:
-        project_obj_list = list(conn.getObjects("Project"))
+    output_items = iter_filtered_images(conn, project_name_list, key_value_data, tag_list, page_size, log)
+    output_count = write_output_stream(output_items, output_file_path, output_format, ["id", "path", "name"],
+                                       header=['OMERO_IMG_ID', 'OMERO_IMG_PATH', 'OMERO_IMG_NAME'])
+
+    log("[bold green]Number of output images: " + str(output_count))
 
-    image_map = {}
-    for project in project_obj_list:
-        print("[bold blue]Inspecting project: " + str(project.getName()) + " (ID: " + str(project.getId()) + ")")
-        for dataset in project.listChildren():
-            for image in dataset.listChildren():
-                img_path = (project.getName() + "/" + dataset.getName()).replace(" ", "_")
-                img_name = image.getName().replace(" ", "_")
-                image_map[int(image.getId())] = [img_path, img_name] # id -> path and name
+    omero_close(conn)
 
-    image_id_list = list(image_map.keys())
 
-    for kv in key_value_data:
-        image_id_list = ezomero.filter_by_kv(conn, image_id_list, key=kv[0], value=kv[1], across_groups=True)
+def get_target_dataset_id(dataset_id, project_name, dataset_name, create, usr, pwd, host, port):
+    """
+    Returns the target dataset ID of a push command: the given ID, or the ID
+    resolved (and created if requested) from the project and dataset names
+    """
 
-    for tag in tag_list:
-        image_id_list = ezomero.filter_by_tag_value(conn, image_id_list, tag_value=tag, across_groups=True)
+    if dataset_id != "":
+        return int(dataset_id)
 
-    print("[bold green]Output image IDs: " + str(image_id_list))
+    if project_name == "" or dataset_name == "":
+        print("[bold red]Error: give a dataset ID or both --project and --dataset")
+        raise typer.Exit(code=1)
 
-    with open(output_file_path, 'w', newline='') as tsvfile:
-        writer = csv.writer(tsvfile, delimiter='\t', lineterminator='\n')
-        writer.writerow(['OMERO_IMG_ID', 'OMERO_IMG_PATH', 'OMERO_IMG_NAME'])
-        for img_id in image_id_list:
-            writer.writerow([img_id, image_map[img_id][0], image_map[img_id][1]])
+    conn = omero_connect(usr, pwd, host, str(port))
+    ds_id = resolve_dataset_ids(conn, [(project_name, dataset_name)], create_missing=create)[(project_name, dataset_name)]
+    omero_close(conn)
 
-    conn.close()
+    if ds_id == -1:
+        print("[bold red]Error: dataset not found: " + project_name + "/" + dataset_name + " (use --create to create it)")
+        raise typer.Exit(code=1)
 
+    return ds_id
 
 @push_app.command("img-file", help="Import an image file into OMERO")
 def push_image_file(
         file_path: Annotated[str, typer.Argument(help="Path to the input image file")],
-        dataset_id: Annotated[str, typer.Argument(help="ID of target dataset")],
+        dataset_id: Annotated[str, typer.Argument(help="ID of target dataset (or use --project and --dataset)")] = "",
+        project_name: Annotated[str, typer.Option("--project", help="Name of the target project, used with --dataset instead of a dataset ID")] = "",
+        dataset_name: Annotated[str, typer.Option("--dataset", help="Name of the target dataset, used with --project instead of a dataset ID")] = "",
+        create: Annotated[bool, typer.Option(help="Create the target project and dataset if they do not exist")] = False,
         config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties",
         output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output XML file")] = "./omero_bifrost_output.xml",
         to_file: Annotated[bool, typer.Option(help="output to XML file")] = False,
-        to_xml: Annotated[bool, typer.Option(help="Print XML ouput to system console")] = False
+        to_xml: Annotated[bool, typer.Option(help="Print XML ouput to system console")] = False,
+        dry_run: Annotated[bool, typer.Option(help="Only report the number and size of the files to import and the estimated duration")] = False
         ):
     
     import xml.etree.ElementTree as ET
+
+    if dry_run:
+        print_transfer_plan(plan_push(file_path, depth=1))
+        return
     
     omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
 
-    img_ids = register_image_file_with_dataset_id(file_path, int(dataset_id), omero_username, omero_password, omero_host, str(omero_port))
+    ds_id = get_target_dataset_id(dataset_id, project_name, dataset_name, create, omero_username, omero_password, omero_host, omero_port)
+
+    img_ids = register_image_file_with_dataset_id(file_path, ds_id, omero_username, omero_password, omero_host, str(omero_port))
 
     output_map = {}
     output_count = 0
@@ -188,7 +412,8 @@ def push_image_file(
 
     if to_file:
         xml_tree = format_xml_ouput(output_map)
-        xml_tree.write(output_file_path)
+        with trace_span("io", "write XML"):
+            xml_tree.write(output_file_path)
     elif to_xml:
         xml_tree = format_xml_ouput(output_map)
         xml_str = ET.tostring(xml_tree.getroot(), encoding='unicode')
@@ -199,18 +424,28 @@ def push_image_file(
 @push_app.command("img-folder", help="Import a folder containing image files into OMERO")
 def push_image_folder(
         folder_path: Annotated[str, typer.Argument(help="Path to the input folder containing image files (depth=1)")],
-        dataset_id: Annotated[str, typer.Argument(help="ID of target dataset")],
+        dataset_id: Annotated[str, typer.Argument(help="ID of target dataset (or use --project and --dataset)")] = "",
+        project_name: Annotated[str, typer.Option("--project", help="Name of the target project, used with --dataset instead of a dataset ID")] = "",
+        dataset_name: Annotated[str, typer.Option("--dataset", help="Name of the target dataset, used with --project instead of a dataset ID")] = "",
+        create: Annotated[bool, typer.Option(help="Create the target project and dataset if they do not exist")] = False,
         config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties",
         output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output XML file")] = "./omero_bifrost_output.xml",
         to_file: Annotated[bool, typer.Option(help="output to XML file")] = False,
-        to_xml: Annotated[bool, typer.Option(help="Print XML ouput to system console")] = False
+        to_xml: Annotated[bool, typer.Option(help="Print XML ouput to system console")] = False,
+        dry_run: Annotated[bool, typer.Option(help="Only report the number and size of the files to import and the estimated duration")] = False
         ):
     
     import xml.etree.ElementTree as ET
+
+    if dry_run:
+        print_transfer_plan(plan_push(folder_path, depth=1))
+        return
     
     omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
 
-    img_ids = register_image_folder_with_dataset_id(folder_path, int(dataset_id), omero_username, omero_password, omero_host, str(omero_port))
+    ds_id = get_target_dataset_id(dataset_id, project_name, dataset_name, create, omero_username, omero_password, omero_host, omero_port)
+
+    img_ids = register_image_folder_with_dataset_id(folder_path, ds_id, omero_username, omero_password, omero_host, str(omero_port))
 
     output_map = {}
     output_count = 0
@@ -223,7 +458,8 @@ def push_image_folder(
 
     if to_file:
         xml_tree = format_xml_ouput(output_map)
-        xml_tree.write(output_file_path)
+        with trace_span("io", "write XML"):
+            xml_tree.write(output_file_path)
     elif to_xml:
         xml_tree = format_xml_ouput(output_map)
         xml_str = ET.tostring(xml_tree.getroot(), encoding='unicode')
@@ -253,7 +489,7 @@ def push_key_value(
 
     add_kv_to_image(conn, image_id, key_value_data)
 
-    conn.close()
+    omero_close(conn)
     print("[bold red]Done.")
 
 @push_app.command("img-tag", help="Tag an image, create OMERO tag if needed")
@@ -284,7 +520,7 @@ def push_image_tag(
     if int(tag_id) > -1:
         std_out, std_err = add_tag_to_image(image_id, tag_id, omero_username, omero_password, omero_host, str(omero_port))
 
-    conn.close()
+    omero_close(conn)
 
     print("[bold blue]Output: " + std_out)
     print("[bold red]Error: " + std_err)
@@ -305,28 +541,56 @@ def push_file_atch(
 
     print("[bold blue]File Annotation ID: " + str(img_ann_id))
 
+def get_export_bundle(output_path, bundle_format, conn):
+    """
+    Returns the ExportBundle of a pull command, None if no bundle format is given;
+    exits with an error if the format is unknown or cannot be written here
+    """
+
+    if bundle_format == "":
+        return None
+
+    try:
+        return ExportBundle(output_path, bundle_format)
+    except ValueError as e:
+        omero_close(conn)
+        print("[bold red]Error: " + str(e))
+        raise typer.Exit(code=1)
+
 @pull_app.command("ome-tiffs", help="Export OME-TIFF image files from a list of OMERO image IDs")
 def pull_ome_tiff_files(
-        output_path: Annotated[str, typer.Argument(help="Output path, destination of pulled files")],
+        output_path: Annotated[str, typer.Argument(help="Output path, destination of pulled files (the archive path with --bundle)")],
         img_id: Annotated[List[str], typer.Option(default=..., help="List of image IDs, in format '--img-id id1 --img-id id2'")] = [],
         id_list_path: Annotated[str, typer.Option("--list", "-l", help="Path to a TSV file with image IDs, takes priority if not empty")] = "",
+        bundle: Annotated[str, typer.Option(help="Stream the files into an archive instead of the output directory: tar, tar.gz, zip, or '-' for a tar stream on standard output")] = "",
+        dry_run: Annotated[bool, typer.Option(help="Only report the number and size of the files to pull, the free disk space and the estimated duration")] = False,
         config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties"
         ):
 
     import os
 
+    # keep standard output clean for the archive when it is streamed there
+    log = get_log_print(bundle == "-")
+
     if id_list_path == "":
         img_id_list = img_id
     else:
         img_map = img_map_from_tsv(id_list_path)
         img_id_list = list(img_map.keys())
 
-    print("[bold green]Processing image ID list: " + str(img_id_list))
+    log("[bold green]Processing image ID list: " + str(img_id_list))
     
     omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
     
     conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
 
+    if dry_run:
+        enough_space = print_transfer_plan(plan_pull_ome_tiffs(conn, img_id_list), "" if bundle == "-" else output_path, log)
+        omero_close(conn)
+        if not enough_space:
+            raise typer.Exit(code=1)
+        return
+
     file_map = {}
     for img_id in img_id_list:
         image = conn.getObject("Image", img_id)
@@ -336,38 +600,63 @@ def pull_ome_tiff_files(
     # TODO: fix, previously imported '.tif' files are not automatically exported as OME-TIFF by OMERO,
     #       these files need to be downloaded as original files. Look into triggering OME-TIFF generation in OMERO
 
-    for img_id in file_map.keys():
-        ouput_file_path = os.path.join(output_path, "omero_img_id_" + str(img_id) + "__" + file_map[img_id] + ".ome.tiff")
-        print("[bold blue]Pulling: " + ouput_file_path)
-        std_out, std_err = export_ome_tiff_file(img_id, ouput_file_path, omero_username, omero_password, omero_host, str(omero_port))
-        print("[bold blue]Output: " + std_out)
-        print("[bold red]Error: " + std_err)
+    export_bundle = get_export_bundle(output_path, bundle, conn)
 
-    conn.close()
+    for img_id in file_map.keys():
+        file_name = "omero_img_id_" + str(img_id) + "__" + file_map[img_id] + ".ome.tiff"
+        if export_bundle is None:
+            ouput_file_path = os.path.join(output_path, file_name)
+            log("[bold blue]Pulling: " + ouput_file_path)
+            std_out, std_err = export_ome_tiff_file(img_id, ouput_file_path, omero_username, omero_password, omero_host, str(omero_port))
+            log("[bold blue]Output: " + std_out)
+        else:
+            log("[bold blue]Pulling into bundle: " + file_name)
+            cmd = get_export_cmd(img_id, "-", omero_username, omero_password, omero_host, str(omero_port))
+            manifest_entry, std_err = bundle_omero_cmd_output(export_bundle, cmd, file_name, image_id=img_id)
+            log("[bold blue]Output: " + str(manifest_entry["bytes"]) + " bytes, sha256 " + manifest_entry["sha256"] + " (" + manifest_entry["status"] + ")")
+        log("[bold red]Error: " + std_err)
+
+    if export_bundle is not None:
+        export_bundle.close()
+
+    omero_close(conn)
 
 @pull_app.command("orig-files", help="Download original image files from a list of OMERO image IDs")
 def pull_original_image_files(
-        output_path: Annotated[str, typer.Argument(help="Output path, destination of pulled files")],
+        output_path: Annotated[str, typer.Argument(help="Output path, destination of pulled files (the archive path with --bundle)")],
         img_id: Annotated[List[str], typer.Option(default=..., help="List of image IDs, in format '--img-id id1 --img-id id2'")] = [],
         id_list_path: Annotated[str, typer.Option("--list", "-l", help="Path to a TSV file with image IDs, takes priority if not empty")] = "",
+        bundle: Annotated[str, typer.Option(help="Stream the files into an archive instead of the output directory: tar, tar.gz, zip, or '-' for a tar stream on standard output")] = "",
+        dry_run: Annotated[bool, typer.Option(help="Only report the number and size of the files to pull, the free disk space and the estimated duration")] = False,
         config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties"
         ):
 
     import os
 
+    # keep standard output clean for the archive when it is streamed there
+    log = get_log_print(bundle == "-")
+
     if id_list_path == "":
         img_id_list = img_id
     else:
         img_map = img_map_from_tsv(id_list_path)
         img_id_list = list(img_map.keys())
 
-    print("[bold green]Processing image ID list: " + str(img_id_list))
+    log("[bold green]Processing image ID list: " + str(img_id_list))
     
     omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
 
     conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
 
+    if dry_run:
+        enough_space = print_transfer_plan(plan_pull_orig_files(conn, img_id_list), "" if bundle == "-" else output_path, log)
+        omero_close(conn)
+        if not enough_space:
+            raise typer.Exit(code=1)
+        return
+
     orig_file_map = {}
+    orig_file_info = {} # file id -> image id and size
     for img_id in img_id_list:
         image = conn.getObject("Image", img_id)
 
@@ -376,13 +665,220 @@ def pull_original_image_files(
             orig_file_id = str(orig_file_obj.getId()) 
             if not orig_file_id in orig_file_map.keys():
                 orig_file_map[orig_file_id] = str(orig_file_obj.getName())
+                orig_file_info[orig_file_id] = [img_id, orig_file_obj.getSize()]
+
+    export_bundle = get_export_bundle(output_path, bundle, conn)
 
     for orig_file_id in orig_file_map.keys():
-        ouput_file_path = os.path.join(output_path, "omero_file_id_" + str(orig_file_id) + "__" + orig_file_map[orig_file_id])
-        print("[bold blue]Pulling: " + ouput_file_path)
-        std_out, std_err = download_original_image_file(orig_file_id, ouput_file_path, omero_username, omero_password, omero_host, str(omero_port))
-        print("[bold blue]Output: " + std_out)
-        print("[bold red]Error: " + std_err)
+        file_name = "omero_file_id_" + str(orig_file_id) + "__" + orig_file_map[orig_file_id]
+        if export_bundle is None:
+            ouput_file_path = os.path.join(output_path, file_name)
+            log("[bold blue]Pulling: " + ouput_file_path)
+            std_out, std_err = download_original_image_file(orig_file_id, ouput_file_path, omero_username, omero_password, omero_host, str(omero_port))
+            log("[bold blue]Output: " + std_out)
+        else:
+            log("[bold blue]Pulling into bundle: " + file_name)
+            cmd = get_download_cmd(orig_file_id, "-", omero_username, omero_password, omero_host, str(omero_port))
+            file_size = orig_file_info[orig_file_id][1]
+            manifest_entry, std_err = bundle_omero_cmd_output(export_bundle, cmd, file_name,
+                                                              size=None if file_size is None else int(file_size),
+                                                              image_id=orig_file_info[orig_file_id][0], file_id=orig_file_id)
+            log("[bold blue]Output: " + str(manifest_entry["bytes"]) + " bytes, sha256 " + manifest_entry["sha256"] + " (" + manifest_entry["status"] + ")")
+        log("[bold red]Error: " + std_err)
+
+    if export_bundle is not None:
+        export_bundle.close()
+
+    omero_close(conn)
+
+@pull_app.command("metadata", help="Pull the metadata (pixel sizes, key-value pairs, tags, file annotations) of many images into one table")
+def pull_image_metadata(
+        output_path: Annotated[str, typer.Argument(help="Output table path ('-' for standard output, CSV only)")],
+        img_id: Annotated[List[str], typer.Option(default=..., help="List of image IDs, in format '--img-id id1 --img-id id2'")] = [],
+        id_list_path: Annotated[str, typer.Option("--list", "-l", help="Path to a TSV file with image IDs, takes priority if not empty")] = "",
+        project_name: Annotated[str, typer.Option("--project", help="Pull all images of this project (or of --dataset in it)")] = "",
+        dataset_name: Annotated[str, typer.Option("--dataset", help="Restrict --project to the dataset with this name")] = "",
+        output_format: Annotated[str, typer.Option("--format", "-f", help="Output table format: csv or parquet")] = "csv",
+        chunk_size: Annotated[int, typer.Option(help="Number of images per server query")] = METADATA_CHUNK_SIZE,
+        config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties"
+        ):
+
+    # keep standard output clean for the table when it is written there
+    log = get_log_print(output_path == "-")
+
+    if not output_format in METADATA_FORMATS:
+        print("[bold red]Error: unknown output format: " + output_format)
+        raise typer.Exit(code=1)
+
+    if output_format == "parquet":
+        import importlib.util
+        if importlib.util.find_spec("pandas") is None:
+            print("[bold red]Error: Parquet output requires pandas and pyarrow (pip install pandas pyarrow)")
+            raise typer.Exit(code=1)
+
+    if dataset_name != "" and project_name == "":
+        print("[bold red]Error: --dataset needs the --project it belongs to")
+        raise typer.Exit(code=1)
+
+    omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
+    conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
+
+    if id_list_path != "":
+        img_id_list = list(img_map_from_tsv(id_list_path).keys())
+    elif project_name != "":
+        img_id_list = get_scope_image_ids(conn, project_name, dataset_name)
+    else:
+        img_id_list = img_id
+
+    log("[bold green]Pulling metadata of " + str(len(img_id_list)) + " images")
+
+    rows, columns = fetch_image_metadata(conn, img_id_list, chunk_size)
+    write_metadata_table(rows, columns, output_path, output_format)
+
+    log("[bold green]Number of output images: " + str(len(rows)) + ", key-value columns: " + str(len(columns) - len(METADATA_COLUMNS)))
+
+    omero_close(conn)
+
+@pull_app.command("thumbnails", help="Pull thumbnails or server-rendered max-intensity projections of many images")
+def pull_thumbnails(
+        output_path: Annotated[str, typer.Argument(help="Output directory, or the .npy file with --format npy")],
+        img_id: Annotated[List[str], typer.Option(default=..., help="List of image IDs, in format '--img-id id1 --img-id id2'")] = [],
+        id_list_path: Annotated[str, typer.Option("--list", "-l", help="Path to a TSV file with image IDs, takes priority if not empty")] = "",
+        size: Annotated[int, typer.Option(help="Size in pixels of the longest side of the previews")] = 96,
+        output_format: Annotated[str, typer.Option("--format", "-f", help="Output format: jpeg or png files, or npy (a single NumPy stack)")] = "jpeg",
+        projection: Annotated[bool, typer.Option(help="Render a maximum intensity projection on the server instead of the thumbnail")] = False,
+        channel: Annotated[int, typer.Option(help="Projection only: index (from 0) of the channel to render, all active channels if negative")] = -1,
+        z_range: Annotated[str, typer.Option(help="Projection only: z planes to project, in format 'first:last', all if empty")] = "",
+        batch_size: Annotated[int, typer.Option(help="Number of images per thumbnail-set call")] = THUMBNAIL_BATCH_SIZE,
+        workers: Annotated[int, typer.Option(help="Number of parallel server connections")] = 1,
+        config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties"
+        ):
+
+    if not output_format in THUMBNAIL_FORMATS:
+        print("[bold red]Error: unknown output format: " + output_format)
+        raise typer.Exit(code=1)
+
+    if id_list_path == "":
+        img_id_list = img_id
+    else:
+        img_map = img_map_from_tsv(id_list_path)
+        img_id_list = list(img_map.keys())
+
+    print("[bold green]Pulling previews of " + str(len(img_id_list)) + " images")
+
+    omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
+    conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
+
+    pool = None
+    if workers > 1:
+        from omero_bifrost.utils.pool_ops import ConnectionPool
+        pool = ConnectionPool(omero_username, omero_password, omero_host, int(omero_port), size=workers)
+
+    if projection:
+        z_first_last = None if z_range == "" else [int(z) for z in z_range.split(":")]
+        items = iter_projections(conn, img_id_list, size, None if channel < 0 else channel, z_first_last, pool=pool)
+    else:
+        items = iter_thumbnails(conn, img_id_list, size, batch_size, pool)
+
+    output_count = write_thumbnails(items, output_path, output_format, size)
+
+    print("[bold green]Number of output images: " + str(output_count))
+
+    if pool is not None:
+        pool.close()
+    omero_close(conn)
+
+
+def get_plate_fields(conn, plate_id, well_list, field_list):
+    """
+    Returns the selected fields of a plate layout, exits with an error on invalid well selections
+    """
+
+    try:
+        return select_fields(load_plate_layout(conn, plate_id), well_list, field_list)
+    except ValueError as e:
+        omero_close(conn)
+        print("[bold red]Error: " + str(e))
+        raise typer.Exit(code=1)
+
+@query_app.command("plates", help="Query all accessible OMERO plates and their screens")
+def query_plates(
+        config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties",
+        output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output file ('-' for standard output)")] = "-",
+        output_format: Annotated[str, typer.Option("--format", "-f", help="Output file format: tsv, xml, xml-stream (written while fetched, count at the end) or jsonl")] = "tsv"
+        ):
+
+    log = get_log_print(output_file_path == "-")
+
+    omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
+    conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
+
+    output_count = write_output_stream(list_plates(conn), output_file_path, output_format,
+                                       ["plate_id", "plate_name", "screen_id", "screen_name"],
+                                       header=["OMERO_PLATE_ID", "OMERO_PLATE_NAME", "OMERO_SCREEN_ID", "OMERO_SCREEN_NAME"])
+
+    log("[bold green]Number of output plates: " + str(output_count))
+
+    omero_close(conn)
+
+@query_app.command("plate", help="Query the layout (wells, fields and image IDs) of an OMERO plate")
+def query_plate_layout(
+        plate_id: Annotated[str, typer.Argument(help="ID of the plate")],
+        well: Annotated[List[str], typer.Option(default=..., help="Wells to select: names ('B03'), positions ('1,2', from 0), rows ('B'), columns ('3') or ranges ('B03:D05'), in format '--well B03 --well C'")] = [],
+        field: Annotated[List[int], typer.Option(default=..., help="Fields to select (from 0), in format '--field 0 --field 1'")] = [],
+        config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties",
+        output_file_path: Annotated[str, typer.Option("--output", "-o", help="Path to output file ('-' for standard output)")] = "./omero_bifrost_output.tsv",
+        output_format: Annotated[str, typer.Option("--format", "-f", help="Output file format: tsv, xml, xml-stream (written while fetched, count at the end) or jsonl")] = "tsv"
+        ):
+
+    log = get_log_print(output_file_path == "-")
+
+    omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
+    conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
+
+    field_entries = get_plate_fields(conn, plate_id, well, field)
+    output_count = write_output_stream(field_entries, output_file_path, output_format, LAYOUT_COLUMNS, header=LAYOUT_HEADER)
+
+    log("[bold green]Number of output fields: " + str(output_count) + " in " + str(len(set(entry["well_id"] for entry in field_entries))) + " wells")
+
+    omero_close(conn)
+
+@pull_app.command("plate", help="Export the fields of selected wells of an OMERO plate as OME-TIFF files, in parallel")
+def pull_plate(
+        plate_id: Annotated[str, typer.Argument(help="ID of the plate")],
+        output_path: Annotated[str, typer.Argument(help="Output path, destination of pulled files")],
+        well: Annotated[List[str], typer.Option(default=..., help="Wells to pull: names ('B03'), positions ('1,2', from 0), rows ('B'), columns ('3') or ranges ('B03:D05'), all if not given")] = [],
+        field: Annotated[List[int], typer.Option(default=..., help="Fields to pull (from 0), all if not given")] = [],
+        workers: Annotated[int, typer.Option(help="Number of parallel exports")] = 4,
+        metadata_path: Annotated[str, typer.Option("--metadata", help="Also write a CSV table with the layout, well key-value pairs and image metadata of the pulled fields")] = "",
+        dry_run: Annotated[bool, typer.Option(help="Only report the number and size of the files to pull, the free disk space and the estimated duration")] = False,
+        config_file_path: Annotated[str, typer.Option("--config", "-c", help="Path to the OMERO config file")] = "./imaging_config.properties"
+        ):
+
+    omero_username, omero_password, omero_host, omero_port = get_omero_config(config_file_path)
+    conn = omero_connect(omero_username, omero_password, omero_host, str(omero_port))
+
+    field_entries = get_plate_fields(conn, plate_id, well, field)
+
+    print("[bold green]Pulling " + str(len(field_entries)) + " fields of plate " + str(plate_id))
+
+    if dry_run:
+        enough_space = print_transfer_plan(plan_pull_ome_tiffs(conn, [entry["image_id"] for entry in field_entries]), output_path)
+        omero_close(conn)
+        if not enough_space:
+            raise typer.Exit(code=1)
+        return
+
+    if metadata_path != "":
+        rows, columns = fetch_plate_metadata(conn, plate_id, field_entries)
+        write_metadata_table(rows, columns, metadata_path)
+
+    omero_close(conn)
+
+    results = pull_plate_fields(field_entries, output_path, omero_username, omero_password, omero_host, str(omero_port), workers, print)
 
-    conn.close()
+    for entry, file_path, std_err in results:
+        if std_err != "":
+            print("[bold red]Error (" + entry["well"] + ", field " + str(entry["field"]) + "): " + std_err)
 
+    print("[bold green]Number of output files: " + str(len(results)))
@@ -0,0 +1,232 @@
+
+from omero_bifrost.utils.trace_ops import trace_span
+
+
+# columns of the plate layout output, OMERO_IMG_ID/PATH/NAME first so that it can be used as an image ID list (--list)
+LAYOUT_COLUMNS = ["image_id", "path", "image_name", "well", "row", "column", "field", "well_id", "acquisition"]
+LAYOUT_HEADER = ["OMERO_IMG_ID", "OMERO_IMG_PATH", "OMERO_IMG_NAME", "WELL", "ROW", "COLUMN", "FIELD", "OMERO_WELL_ID", "ACQUISITION"]
+
+
+########################################
+#functions to traverse screens and plates
+
+def list_plates(conn):
+    """
+    Returns all accessible plates with their screens, with a single server query
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+    Returns:
+        list of dicts: {"plate_id", "plate_name", "screen_id", "screen_name"}, one per plate
+                and screen (screen ID and name are empty for plates without a screen)
+    """
+
+    from omero.sys import ParametersI
+    from omero.rtypes import unwrap
+
+    query = ("select p.id, p.name, s.id, s.name from Plate p left outer join p.screenLinks sl "
+             "left outer join sl.parent s order by s.id, p.id")
+
+    plates = []
+    for row in conn.getQueryService().projection(query, ParametersI(), conn.SERVICE_OPTS):
+        plate_id, plate_name, screen_id, screen_name = [unwrap(value) for value in row]
+        plates.append({"plate_id": int(plate_id), "plate_name": str(plate_name),
+                       "screen_id": "" if screen_id is None else int(screen_id),
+                       "screen_name": "" if screen_name is None else str(screen_name)})
+
+    return plates
+
+def get_well_name(row, column, row_naming="letter", column_naming="number"):
+    """
+    Returns the name of a well from its row and column index (from 0), e.g. (1, 2) -> 'B03'
+    following the naming conventions of the plate ('letter' or 'number')
+    """
+
+    def index_name(index, naming, digits):
+        if naming == "letter":
+            name = ""
+            index += 1
+            while index > 0:
+                index, rest = divmod(index - 1, 26)
+                name = chr(ord("A") + rest) + name
+            return name
+        return str(index + 1).zfill(digits)
+
+    return index_name(row, row_naming or "letter", 1) + index_name(column, column_naming or "number", 2)
+
+def load_plate_layout(conn, plate_id):
+    """
+    Loads the layout of a plate (wells, fields and their images) with a single server query
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        plate_id (int): An OMERO plate ID
+    Returns:
+        list of dicts: one per field (well sample), ordered by row, column and field, with the
+                keys of LAYOUT_COLUMNS; field is the index (from 0) of the well sample in its well
+    """
+
+    from omero.sys import ParametersI
+    from omero.rtypes import rlong, unwrap
+
+    params = ParametersI()
+    params.add("pid", rlong(int(plate_id)))
+
+    query = ("select p.name, p.rowNamingConvention, p.columnNamingConvention, w.id, w.row, w.column, "
+             "i.id, i.name, pa.name from Well w join w.plate p join w.wellSamples ws join ws.image i "
+             "left outer join ws.plateAcquisition pa where p.id = :pid order by w.row, w.column, ws.id")
+
+    with trace_span("gateway", "plate layout"):
+        rows = [[unwrap(value) for value in row]
+                for row in conn.getQueryService().projection(query, params, conn.SERVICE_OPTS)]
+
+    layout = []
+    field_counts = {}
+    for plate_name, row_naming, column_naming, well_id, row, column, img_id, img_name, acquisition in rows:
+        well = get_well_name(int(row), int(column), row_naming, column_naming)
+        field = field_counts.get(well_id, 0)
+        field_counts[well_id] = field + 1
+        layout.append({"image_id": int(img_id),
+                       "path": str(plate_name) + "/" + well + "/" + str(field),
+                       "image_name": str(img_name),
+                       "well": well,
+                       "row": int(row),
+                       "column": int(column),
+                       "field": field,
+                       "well_id": int(well_id),
+                       "acquisition": "" if acquisition is None else str(acquisition)})
+
+    return layout
+
+def _parse_well(well_spec):
+    # 'B03' / 'B3' -> (1, 2); '1,2' -> (1, 2); 'B' -> (1, None); '3' -> (None, 2)
+    import re
+
+    well_spec = well_spec.strip().upper()
+
+    position = re.fullmatch(r"(\d+)\s*,\s*(\d+)", well_spec)
+    if position:
+        return int(position.group(1)), int(position.group(2))
+
+    name = re.fullmatch(r"([A-Z]*)(\d*)", well_spec)
+    if name is None or well_spec == "":
+        raise ValueError("Invalid well: " + well_spec)
+
+    row = None
+    if name.group(1) != "":
+        row = 0
+        for letter in name.group(1):
+            row = row * 26 + ord(letter) - ord("A") + 1
+        row -= 1
+    column = int(name.group(2)) - 1 if name.group(2) != "" else None
+
+    return row, column
+
+def select_fields(layout, well_list=None, field_list=None):
+    """
+    Selects fields of a plate layout by well and field
+    Args:
+        layout (list of dicts): plate layout (see load_plate_layout)
+        well_list (list of strings): wells by name ('B03' or 'B3', for plates with lettered rows and numbered
+                columns), position ('1,2': row and column index from 0), whole rows ('B') or columns ('3'),
+                or rectangles ('B03:D05'); all if empty
+        field_list (list of ints): field indices (from 0); all if empty
+    Returns:
+        list of dicts: the selected layout entries
+    """
+
+    matchers = []
+    for well_spec in well_list or []:
+        if ":" in well_spec:
+            (first_row, first_column), (last_row, last_column) = [_parse_well(corner) for corner in well_spec.split(":", 1)]
+            if None in (first_row, first_column, last_row, last_column):
+                raise ValueError("Invalid well range: " + well_spec)
+            matchers.append(lambda row, column, r0=min(first_row, last_row), r1=max(first_row, last_row),
+                            c0=min(first_column, last_column), c1=max(first_column, last_column):
+                            r0 <= row <= r1 and c0 <= column <= c1)
+        else:
+            well_row, well_column = _parse_well(well_spec)
+            matchers.append(lambda row, column, well_row=well_row, well_column=well_column:
+                            (well_row is None or row == well_row) and (well_column is None or column == well_column))
+
+    fields = set(int(field) for field in field_list or [])
+
+    return [entry for entry in layout
+            if (len(matchers) == 0 or any(matcher(entry["row"], entry["column"]) for matcher in matchers))
+            and (len(fields) == 0 or entry["field"] in fields)]
+
+
+########################################
+#functions to pull plates
+
+def pull_plate_fields(field_entries, output_path, usr, pwd, host, port=4064, workers=4, log=None):
+    """
+    Exports the images of many plate fields as OME-TIFF files, running several
+    exports in parallel. Files are named '<well>_f<field>__omero_img_id_<id>.ome.tiff'
+    Args:
+        field_entries (list of dicts): selected layout entries (see select_fields)
+        output_path (string): output directory
+        usr, pwd, host, port: OMERO server login
+        workers (int): number of parallel exports
+        log: optional print function for progress messages
+    Returns:
+        list of tuples: (layout entry, output file path, standard error) per field, in input order
+    """
+
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from omero_bifrost.pull.pull_ops import export_ome_tiff_file
+
+    def export_field(entry):
+        file_name = entry["well"] + "_f" + str(entry["field"]) + "__omero_img_id_" + str(entry["image_id"]) + ".ome.tiff"
+        file_path = os.path.join(output_path, file_name)
+        std_out, std_err = export_ome_tiff_file(entry["image_id"], file_path, usr, pwd, host, port)
+        if log is not None:
+            log("[bold blue]Pulled: " + file_path)
+        return entry, file_path, std_err
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(export_field, field_entries))
+
+def fetch_plate_metadata(conn, plate_id, field_entries):
+    """
+    Builds the metadata table of plate fields: the layout columns, the well key-value pairs
+    ('WELL_KV:<key>' columns, fetched with one query) and the image metadata of
+    pull_ops.fetch_image_metadata
+    Returns:
+        rows (list of dicts): one row per field
+        columns (list of strings): column names
+    """
+
+    from omero.sys import ParametersI
+    from omero.rtypes import rlong, unwrap
+    from omero_bifrost.pull.pull_ops import fetch_image_metadata, METADATA_VALUE_SEPARATOR
+
+    params = ParametersI()
+    params.add("pid", rlong(int(plate_id)))
+    query = ("select l.parent.id, mv.name, mv.value from WellAnnotationLink l, MapAnnotation a "
+             "join a.mapValue mv where l.child.id = a.id and l.parent.plate.id = :pid order by a.id")
+
+    well_kv = {}
+    with trace_span("gateway", "metadata well kv"):
+        for row in conn.getQueryService().projection(query, params, conn.SERVICE_OPTS):
+            well_id, key, value = [unwrap(item) for item in row]
+            values = well_kv.setdefault(int(well_id), {}).setdefault("WELL_KV:" + str(key), [])
+            if str(value) not in values:
+                values.append(str(value))
+
+    image_rows, image_columns = fetch_image_metadata(conn, [entry["image_id"] for entry in field_entries])
+    image_rows = dict((row["OMERO_IMG_ID"], row) for row in image_rows)
+
+    well_columns = sorted(set(key for values in well_kv.values() for key in values))
+    columns = LAYOUT_HEADER + well_columns + [column for column in image_columns if column not in ("OMERO_IMG_ID", "OMERO_IMG_NAME")]
+
+    rows = []
+    for entry in field_entries:
+        row = dict(zip(LAYOUT_HEADER, [entry[column] for column in LAYOUT_COLUMNS]))
+        for column in well_columns:
+            row[column] = METADATA_VALUE_SEPARATOR.join(well_kv.get(entry["well_id"], {}).get(column, []))
+        image_row = image_rows.get(entry["image_id"], {})
+        for column in columns[len(LAYOUT_HEADER) + len(well_columns):]:
+            row[column] = image_row.get(column, "")
+        rows.append(row)
+
+    return rows, columns
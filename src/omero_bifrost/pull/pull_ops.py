@@ -1,19 +1,55 @@
 
+import time
+
+from omero_bifrost.utils.util_ops import get_omero_cli_cmd, run_omero_cmd, open_omero_cmd_stream, get_path_size
+from omero_bifrost.utils.limit_ops import throttle
+from omero_bifrost.utils.trace_ops import trace_span, trace_bytes
+from omero_bifrost.utils.plan_ops import record_transfer
+
+
+def get_download_cmd(orig_file_id, download_path, usr, pwd, host, port=4064):
+    """
+    Builds the OMERO CLI command line used by download_original_image_file
+    """
+
+    return get_omero_cli_cmd("download", usr, pwd, host, port) + " " + str(orig_file_id) + " " + download_path
+
+def get_export_path(download_path):
+    """
+    Returns the path of the file written by the command line of get_export_cmd
+    """
+
+    import os
+
+    # add ome.tiff extension if missing in filename ('-' exports to standard output)
+    name, ext = os.path.splitext(download_path)
+    if  download_path != "-" and ext != ".tif" and ext != ".tiff":
+        download_path = download_path + "ome.tiff"
+
+    return download_path
+
+def get_export_cmd(image_id, download_path, usr, pwd, host, port=4064):
+    """
+    Builds the OMERO CLI command line used by export_ome_tiff_file
+    """
+
+    return get_omero_cli_cmd("export", usr, pwd, host, port) + " --file " + str(get_export_path(download_path)) + " --type TIFF Image:" + str(image_id)
+
 def download_original_image_file(orig_file_id, download_path, usr, pwd, host, port=4064):
     """
     """
 
-    import subprocess
+    std_out, std_err = "", ""
 
     if orig_file_id != -1:
-        cmd = "omero download -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " " + str(orig_file_id) + " " + download_path
-        proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True,
-                            universal_newlines=True)
-
-        std_out, std_err = proc.communicate()
+        cmd = get_download_cmd(orig_file_id, download_path, usr, pwd, host, port)
+        start = time.time()
+        return_code, std_out, std_err = run_omero_cmd(cmd)
+        file_size = get_path_size(download_path)
+        if return_code == 0:
+            record_transfer("download", file_size, time.time() - start)
+        throttle(nbytes=file_size)
+        trace_bytes("io", "downloaded file", file_size)
     
     return std_out, std_err
 
@@ -21,34 +57,265 @@ def export_ome_tiff_file(image_id, download_path, usr, pwd, host, port=4064):
     """
     """
 
-    import subprocess
-    import os
+    std_out, std_err = "", ""
 
     if image_id != -1:
-        
-        # add ome.tiff extension if missing in filename
-        name, ext = os.path.splitext(download_path)
-        if  ext != ".tif" and ext != ".tiff":
-            download_path = download_path + "ome.tiff"
-
-        cmd = "omero export -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " --file " + str(download_path) + " --type TIFF Image:" + str(image_id)
-        proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True,
-                            universal_newlines=True)
-
-        std_out, std_err = proc.communicate()
+        cmd = get_export_cmd(image_id, download_path, usr, pwd, host, port)
+        start = time.time()
+        return_code, std_out, std_err = run_omero_cmd(cmd)
+        file_size = get_path_size(get_export_path(download_path))
+        if return_code == 0:
+            record_transfer("export", file_size, time.time() - start)
+        throttle(nbytes=file_size)
+        trace_bytes("io", "exported file", file_size)
     
     return std_out, std_err
 
 
+########################################
+#functions to pull into archives
+
+BUNDLE_FORMATS = ["tar", "tar.gz", "zip", "-"]
+
+# exports of unknown size are buffered in memory up to this size, then on disk (one file at a time)
+BUNDLE_SPOOL_SIZE = 64 * 1024 ** 2
+
+BUNDLE_CHUNK_SIZE = 1024 ** 2
+
+
+class _HashingReader(object):
+
+    def __init__(self, stream, hasher):
+        self._stream = stream
+        self._hasher = hasher
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._hasher.update(data)
+        self.nbytes += len(data)
+        return data
+
+class _ThrottledReader(object):
+    # accounts for every chunk read against the transfer limits: while the reader sleeps,
+    # the pipe fills up and blocks the producing subprocess, which limits its actual rate
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        throttle(nbytes=len(data))
+        return data
+
+class _SizedReader(object):
+    # reads exactly size bytes for a tar entry of known size: a short stream is padded with
+    # zeros (so that the archive stays valid) and flagged, extra data is flagged by check_end
+
+    def __init__(self, reader, size):
+        self._reader = reader
+        self._remaining = size
+        self.mismatch = False
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        chunks = []
+        missing = size
+        while missing > 0 and not self.mismatch:
+            data = self._reader.read(missing)
+            if not data:
+                self.mismatch = True
+                break
+            chunks.append(data)
+            missing -= len(data)
+        chunks.append(bytes(missing))
+        self._remaining -= size
+        return b"".join(chunks)
+
+    def check_end(self):
+        # reads (and hashes) any data beyond the expected size
+        while True:
+            data = self._reader.read(BUNDLE_CHUNK_SIZE)
+            if not data:
+                break
+            self.mismatch = True
+
+class ExportBundle(object):
+    """
+    Archive that pulled files are streamed into, without writing them to the output directory first.
+    A manifest (MANIFEST.tsv: image ID, file ID, archive name, size, SHA-256, status) is added
+    as the last archive entry and, for archive files, also written next to the archive.
+    Example:
+        bundle = ExportBundle("pulled.tar.gz", "tar.gz")
+        bundle_omero_cmd_output(bundle, get_export_cmd(101, "-", usr, pwd, host), "img_101.ome.tiff", image_id=101)
+        bundle.close()
+    Args:
+        bundle_path (string): path of the archive (ignored for '-')
+        bundle_format (string): tar, tar.gz, zip, or '-' for a tar stream on standard output
+    """
+
+    def __init__(self, bundle_path, bundle_format):
+        import sys
+        import tarfile
+        import zipfile
+
+        if bundle_format not in BUNDLE_FORMATS:
+            raise ValueError("Unknown bundle format: " + str(bundle_format))
+
+        self.bundle_path = bundle_path
+        self.bundle_format = bundle_format
+        self.manifest = []
+        self._tar = None
+        self._zip = None
+
+        if bundle_format == "-":
+            # batch lines capture standard output as text (the daemon streams a binary one)
+            std_out = getattr(sys.stdout, "buffer", None)
+            if std_out is None:
+                raise ValueError("A bundle on standard output ('-') needs a binary standard output, "
+                                 "which is not available in batch calls: write the bundle to a file")
+            self._tar = tarfile.open(fileobj=std_out, mode="w|")
+        elif bundle_format == "tar":
+            self._tar = tarfile.open(bundle_path, "w")
+        elif bundle_format == "tar.gz":
+            self._tar = tarfile.open(bundle_path, "w:gz")
+        else:
+            self._zip = zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_STORED, allowZip64=True)
+
+    def add_stream(self, name, stream, size=None, succeeded=None, image_id="", file_id=""):
+        """
+        Streams a file into the archive. Tar entries need their size up front: if it
+        is not given, the file is buffered (in memory, then on disk) before it is added.
+        If a file of known size comes back shorter (e.g. a failed download), its tar entry
+        is padded with zeros to keep the archive valid, and a file of another size than the
+        given one is marked as an error in the manifest.
+        Args:
+            name (string): name of the archive entry
+            stream: readable binary stream with the file content
+            size (int): size of the content, if known
+            succeeded (callable): called once the stream is consumed, returns False if
+                    the producer failed (a buffered file is then left out of the archive)
+            image_id, file_id: IDs recorded in the manifest
+        Returns:
+            dict: the manifest entry of the file
+        """
+        import time
+        import shutil
+        import hashlib
+        import tarfile
+        import tempfile
+
+        hasher = hashlib.sha256()
+        reader = _HashingReader(stream, hasher)
+        status = "ok"
+
+        if self._zip is not None:
+            with self._zip.open(name, "w", force_zip64=True) as entry:
+                shutil.copyfileobj(reader, entry, BUNDLE_CHUNK_SIZE)
+            if size is not None and reader.nbytes != size:
+                status = "error"
+        elif size is not None:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = time.time()
+            sized_reader = _SizedReader(reader, size)
+            self._tar.addfile(info, sized_reader)
+            sized_reader.check_end()
+            if sized_reader.mismatch:
+                status = "error"
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=BUNDLE_SPOOL_SIZE) as spool:
+                shutil.copyfileobj(reader, spool, BUNDLE_CHUNK_SIZE)
+                if succeeded is not None and not succeeded():
+                    status = "error"
+                else:
+                    info = tarfile.TarInfo(name)
+                    info.size = reader.nbytes
+                    info.mtime = time.time()
+                    spool.seek(0)
+                    self._tar.addfile(info, spool)
+
+        if status == "ok" and succeeded is not None and not succeeded():
+            status = "error"
+
+        manifest_entry = {"image_id": str(image_id),
+                          "file_id": str(file_id),
+                          "name": name,
+                          "bytes": reader.nbytes,
+                          "sha256": hasher.hexdigest(),
+                          "status": status}
+        self.manifest.append(manifest_entry)
+
+        return manifest_entry
+
+    def get_manifest_tsv(self):
+
+        lines = ["OMERO_IMG_ID\tOMERO_FILE_ID\tNAME\tBYTES\tSHA256\tSTATUS"]
+        for entry in self.manifest:
+            lines.append("\t".join([entry["image_id"], entry["file_id"], entry["name"],
+                                    str(entry["bytes"]), entry["sha256"], entry["status"]]))
+
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def close(self):
+        """
+        Adds the manifest and finishes the archive
+        """
+        import io
+        import time
+        import tarfile
+
+        manifest_data = self.get_manifest_tsv()
+
+        if self._zip is not None:
+            self._zip.writestr("MANIFEST.tsv", manifest_data)
+            self._zip.close()
+        else:
+            info = tarfile.TarInfo("MANIFEST.tsv")
+            info.size = len(manifest_data)
+            info.mtime = time.time()
+            self._tar.addfile(info, io.BytesIO(manifest_data))
+            self._tar.close()
+
+        if self.bundle_format != "-":
+            with open(self.bundle_path + ".manifest.tsv", "wb") as manifest_file:
+                manifest_file.write(manifest_data)
+
+def bundle_omero_cmd_output(bundle, cmd, name, size=None, image_id="", file_id=""):
+    """
+    Runs an OMERO CLI command writing a file to its standard output (see get_export_cmd and
+    get_download_cmd with download_path '-') and streams that file into an ExportBundle,
+    throttled chunk by chunk
+    Returns:
+        dict, string: the manifest entry of the file and the standard error of the command
+    """
+
+    proc, std_err_file = open_omero_cmd_stream(cmd)
+
+    try:
+        with trace_span("subprocess", cmd.split(" -s ")[0]) as span:
+            manifest_entry = bundle.add_stream(name, _ThrottledReader(proc.stdout), size,
+                                               lambda: proc.wait() == 0, image_id, file_id)
+            span.nbytes = manifest_entry["bytes"]
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+    std_err_file.seek(0)
+    std_err = std_err_file.read().decode(errors="replace")
+    std_err_file.close()
+
+    return manifest_entry, std_err
+
+
 ########################################
 #functions to pull numpy arrays
 
-def get_image_array(conn, image_id):
+def get_image_array(conn, image_id, pool=None):
     """
     This function retrieves an image from an OMERO server as a numpy array
+    If a ConnectionPool is given, the planes are fetched in parallel over its gateways
     TODO
     """
 
@@ -68,13 +335,381 @@ def get_image_array(conn, image_id):
     # See Documentation here https://downloads.openmicroscopy.org/omero/5.5.1/api/python/omero/omero.gateway.html#omero.gateway._BlitzGateway
     hypercube = np.zeros((size_t, size_c, size_y, size_x, size_z))
 
+    if pool is not None:
+        zct_list = [(z, c, t) for t in range(size_t) for c in range(size_c) for z in range(size_z)]
+        fetch_planes_with_pool(pool, image_id, zct_list, hypercube)
+        return hypercube
+
     pixels = image.getPrimaryPixels()
 
     for t in range(size_t):
         for c in range(size_c):
             for z in range(size_z):
-                plane = pixels.getPlane(z, c, t)      # get a numpy array.
+                with trace_span("gateway", "getPlane") as span:
+                    plane = pixels.getPlane(z, c, t)      # get a numpy array.
+                    span.nbytes = plane.nbytes
+                throttle(calls=1, nbytes=plane.nbytes)
                 hypercube[t, c, :, :, z] = plane
 
     return hypercube
 
+def fetch_planes_with_pool(pool, image_id, zct_list, hypercube):
+    """
+    Fetches the (z, c, t) planes of an image in parallel, one chunk of planes
+    per pooled gateway, and stores them in a (t, c, y, x, z) array
+    Args:
+        pool: a ConnectionPool
+        image_id (int): An OMERO image ID
+        zct_list (list of tuples): the (z, c, t) indices of the planes
+        hypercube (numpy array): the output array
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch_chunk(chunk):
+        with pool.connection() as pool_conn:
+            pixels = pool_conn.getObject("Image", image_id).getPrimaryPixels()
+            with trace_span("gateway", "getPlanes") as span:
+                chunk_bytes = 0
+                for (z, c, t), plane in zip(chunk, pixels.getPlanes(chunk)):
+                    chunk_bytes += plane.nbytes
+                    throttle(calls=1, nbytes=plane.nbytes)
+                    hypercube[t, c, :, :, z] = plane
+                span.nbytes = chunk_bytes
+
+    chunk_count = min(pool.size, len(zct_list))
+    chunks = [zct_list[i::chunk_count] for i in range(chunk_count)]
+
+    with ThreadPoolExecutor(max_workers=max(1, chunk_count)) as executor:
+        for result in executor.map(fetch_chunk, chunks):
+            pass
+
+
+########################################
+#functions to pull metadata
+
+METADATA_CHUNK_SIZE = 1000
+
+METADATA_FORMATS = ["csv", "parquet"]
+
+# fixed columns of the metadata table, followed by one "KV:<key>" column per map annotation key
+METADATA_COLUMNS = ["OMERO_IMG_ID", "OMERO_IMG_NAME", "OMERO_PROJECT", "OMERO_DATASET",
+                    "SIZE_X", "SIZE_Y", "SIZE_Z", "SIZE_C", "SIZE_T", "PIXEL_TYPE",
+                    "PHYSICAL_SIZE_X", "PHYSICAL_SIZE_Y", "PHYSICAL_SIZE_Z",
+                    "TAGS", "FILE_ANNOTATIONS"]
+
+# separator of multiple values in one cell (several tags, or several values of a key)
+METADATA_VALUE_SEPARATOR = ";"
+
+_METADATA_QUERIES = {
+    "pixels": ("select i.id, i.name, p.sizeX, p.sizeY, p.sizeZ, p.sizeC, p.sizeT, pt.value, "
+               "p.physicalSizeX.value, p.physicalSizeY.value, p.physicalSizeZ.value "
+               "from Pixels p join p.image i join p.pixelsType pt where i.id in (:ids)"),
+    "containers": ("select dl.child.id, p.name, d.name from DatasetImageLink dl join dl.parent d "
+                   "left outer join d.projectLinks pl left outer join pl.parent p "
+                   "where dl.child.id in (:ids) order by d.id"),
+    "kv": ("select l.parent.id, mv.name, mv.value from ImageAnnotationLink l, MapAnnotation a "
+           "join a.mapValue mv where l.child.id = a.id and l.parent.id in (:ids) order by a.id"),
+    "tags": ("select l.parent.id, a.textValue from ImageAnnotationLink l, TagAnnotation a "
+             "where l.child.id = a.id and l.parent.id in (:ids) order by a.id"),
+    "files": ("select l.parent.id, f.name from ImageAnnotationLink l, FileAnnotation a join a.file f "
+              "where l.child.id = a.id and l.parent.id in (:ids) order by a.id"),
+}
+
+
+def _add_cell_value(row, column, value):
+    if value is None:
+        return
+    value = str(value)
+    if column in row and row[column] != "":
+        if value not in row[column].split(METADATA_VALUE_SEPARATOR):
+            row[column] += METADATA_VALUE_SEPARATOR + value
+    else:
+        row[column] = value
+
+def fetch_image_metadata(conn, image_id_list, chunk_size=METADATA_CHUNK_SIZE):
+    """
+    Fetches the metadata of many images (names, containers, pixel sizes and types, physical sizes,
+    key-value pairs, tags and file annotation names) with five projection queries per chunk of
+    images, instead of loading and listing the annotations of every image
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        image_id_list (list): image IDs
+        chunk_size (int): number of images per query
+    Returns:
+        rows (list of dicts): one row per found image (column name -> value), in input order
+        columns (list of strings): METADATA_COLUMNS followed by the sorted "KV:<key>" columns
+    """
+
+    from omero.sys import ParametersI
+    from omero.rtypes import rlong, rlist, unwrap
+
+    image_id_list = list(dict.fromkeys(int(img_id) for img_id in image_id_list))
+    query_service = conn.getQueryService()
+
+    rows = {}
+    kv_keys = set()
+
+    for start in range(0, len(image_id_list), chunk_size):
+        chunk = image_id_list[start:start + chunk_size]
+        params = ParametersI()
+        params.add("ids", rlist([rlong(img_id) for img_id in chunk]))
+
+        results = {}
+        for name, query in _METADATA_QUERIES.items():
+            with trace_span("gateway", "metadata " + name):
+                results[name] = [[unwrap(value) for value in row]
+                                 for row in query_service.projection(query, params, conn.SERVICE_OPTS)]
+
+        for values in results["pixels"]:
+            rows[int(values[0])] = dict(zip(METADATA_COLUMNS[:13], values[:1] + [str(values[1])] + ["", ""] + values[2:]))
+
+        for img_id, project_name, dataset_name in results["containers"]:
+            if int(img_id) in rows:
+                _add_cell_value(rows[int(img_id)], "OMERO_PROJECT", project_name)
+                _add_cell_value(rows[int(img_id)], "OMERO_DATASET", dataset_name)
+
+        for img_id, key, value in results["kv"]:
+            if int(img_id) in rows:
+                _add_cell_value(rows[int(img_id)], "KV:" + str(key), value)
+                kv_keys.add("KV:" + str(key))
+
+        for img_id, tag in results["tags"]:
+            if int(img_id) in rows:
+                _add_cell_value(rows[int(img_id)], "TAGS", tag)
+
+        for img_id, file_name in results["files"]:
+            if int(img_id) in rows:
+                _add_cell_value(rows[int(img_id)], "FILE_ANNOTATIONS", file_name)
+
+    columns = METADATA_COLUMNS + sorted(kv_keys)
+    row_list = []
+    for img_id in image_id_list:
+        if img_id in rows:
+            row = dict((column, "") for column in columns)
+            row.update((column, "" if value is None else value) for column, value in rows[img_id].items())
+            row_list.append(row)
+
+    return row_list, columns
+
+def write_metadata_table(rows, columns, output_path, output_format="csv"):
+    """
+    Writes a metadata table (see fetch_image_metadata) as CSV ('-' for standard output)
+    or Parquet (requires pandas with pyarrow or fastparquet)
+    """
+
+    import csv
+    import sys
+
+    if output_format == "parquet":
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("Parquet output requires pandas and pyarrow (pip install pandas pyarrow)")
+        numeric_columns = METADATA_COLUMNS[4:9] + METADATA_COLUMNS[10:13]
+        table = pd.DataFrame(rows, columns=columns)
+        for column in columns:
+            if column in numeric_columns:
+                table[column] = pd.to_numeric(table[column], errors="coerce")
+            else:
+                table[column] = table[column].astype(str)
+        with trace_span("io", "write Parquet"):
+            table.to_parquet(output_path, index=False)
+        return
+
+    with trace_span("io", "write CSV"):
+        if output_path == "-":
+            writer = csv.DictWriter(sys.stdout, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            with open(output_path, "w", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+
+
+########################################
+#functions to pull thumbnails and projections
+
+THUMBNAIL_BATCH_SIZE = 100
+
+THUMBNAIL_FORMATS = ["jpeg", "png", "npy"]
+
+
+def _map_with_pool(conn, pool, function, chunks):
+    # applies function(conn, chunk) to every chunk, in parallel over the pooled gateways if a
+    # pool is given, and generates the results in order
+    if pool is None:
+        for chunk in chunks:
+            yield function(conn, chunk)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def pooled_function(chunk):
+        with pool.connection() as pool_conn:
+            return function(pool_conn, chunk)
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        for result in executor.map(pooled_function, chunks):
+            yield result
+
+def _fetch_thumbnail_batch(conn, image_id_batch, max_size):
+    with trace_span("gateway", "getThumbnailSet") as span:
+        thumbnails = conn.getThumbnailSet(image_id_batch, max_size)
+        batch_bytes = sum(len(data) for data in thumbnails.values())
+        span.nbytes = batch_bytes
+    throttle(calls=1, nbytes=batch_bytes)
+
+    return [(img_id, thumbnails[img_id]) for img_id in image_id_batch if img_id in thumbnails]
+
+def iter_thumbnails(conn, image_id_list, max_size=96, batch_size=THUMBNAIL_BATCH_SIZE, pool=None):
+    """
+    Generates the JPEG thumbnails of many images, fetched with one thumbnail-set call per batch
+    of images (in parallel over the gateways of a ConnectionPool, if given)
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        image_id_list (list): image IDs
+        max_size (int): size in pixels of the longest side of the thumbnails
+        batch_size (int): number of images per thumbnail-set call
+        pool: an optional ConnectionPool
+    Returns:
+        generator of tuples: (image ID, JPEG bytes), in input order, images without a thumbnail are skipped
+    """
+
+    image_id_list = [int(img_id) for img_id in image_id_list]
+    batches = [image_id_list[i:i + batch_size] for i in range(0, len(image_id_list), batch_size)]
+
+    fetch_batch = lambda batch_conn, batch: _fetch_thumbnail_batch(batch_conn, batch, max_size)
+    for thumbnails in _map_with_pool(conn, pool, fetch_batch, batches):
+        for item in thumbnails:
+            yield item
+
+def render_projection(conn, image_id, max_size=None, channel=None, z_range=None, t=0):
+    """
+    Renders the maximum intensity projection of an image on the server and returns it as JPEG
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        image_id (int): An OMERO image ID
+        max_size (int): if given, the projection is scaled down to this size of its longest side
+        channel (int): index (from 0) of the only channel to render, all active channels if None
+        z_range (tuple): (first, last) z index of the projection, all planes if None
+        t (int): timepoint index
+    Returns:
+        bytes: the JPEG image, None if the image was not found
+    """
+
+    image = conn.getObject("Image", image_id)
+    if image is None:
+        return None
+
+    image.setProjection("intmax")
+    if z_range is not None:
+        image.setProjectionRange(int(z_range[0]), int(z_range[1]))
+    if channel is not None:
+        image.setActiveChannels([int(channel) + 1]) # channels are numbered from 1
+
+    with trace_span("gateway", "renderJpeg") as span:
+        data = image.renderJpeg(0, int(t))
+        data_bytes = len(data) if data is not None else 0
+        span.nbytes = data_bytes
+    throttle(calls=1, nbytes=data_bytes)
+
+    if data is not None and max_size is not None:
+        data = _scale_jpeg(data, max_size)
+
+    return data
+
+def _scale_jpeg(data, max_size):
+    import io
+    from PIL import Image
+
+    rendered = Image.open(io.BytesIO(data))
+    if max(rendered.size) <= max_size:
+        return data
+
+    rendered.thumbnail((max_size, max_size))
+    output = io.BytesIO()
+    rendered.convert("RGB").save(output, format="JPEG")
+    return output.getvalue()
+
+def iter_projections(conn, image_id_list, max_size=None, channel=None, z_range=None, t=0, pool=None):
+    """
+    Generates server-rendered maximum intensity projections of many images (see render_projection),
+    rendered in parallel over the gateways of a ConnectionPool, if given
+
+    Returns:
+        generator of tuples: (image ID, JPEG bytes), in input order, images not found are skipped
+    """
+
+    render = lambda render_conn, img_id: (img_id, render_projection(render_conn, img_id, max_size, channel, z_range, t))
+    for img_id, data in _map_with_pool(conn, pool, render, [int(img_id) for img_id in image_id_list]):
+        if data is not None:
+            yield img_id, data
+
+def write_thumbnails(items, output_path, output_format="jpeg", max_size=96):
+    """
+    Writes (image ID, JPEG bytes) items as image files named 'omero_img_id_<id>.jpg/.png'
+    in the output directory, or as a single (n, max_size, max_size, 3) uint8 NumPy stack
+    (images padded at the bottom/right) with a '<stack>.npy.ids.tsv' list of the image IDs
+    (the .npy extension is added to the stack path if missing, as numpy does)
+
+    Returns:
+        int: number of written images
+    """
+
+    import io
+    import os
+    import csv
+
+    count = 0
+
+    if output_format == "npy":
+        import numpy as np
+        from PIL import Image
+
+        # np.save appends .npy itself: the ID list has to be named after the actual file
+        if not output_path.endswith(".npy"):
+            output_path += ".npy"
+
+        image_id_list = []
+        planes = []
+        for img_id, data in items:
+            rgb = np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))[:max_size, :max_size]
+            plane = np.zeros((max_size, max_size, 3), dtype=np.uint8)
+            plane[:rgb.shape[0], :rgb.shape[1]] = rgb
+            planes.append(plane)
+            image_id_list.append(img_id)
+
+        with trace_span("io", "write NumPy stack"):
+            np.save(output_path, np.stack(planes) if planes else np.zeros((0, max_size, max_size, 3), dtype=np.uint8))
+            with open(output_path + ".ids.tsv", "w", newline="") as file:
+                writer = csv.writer(file, delimiter="\t")
+                writer.writerow(["OMERO_IMG_ID", "STACK_INDEX"])
+                writer.writerows([img_id, index] for index, img_id in enumerate(image_id_list))
+
+        return len(planes)
+
+    os.makedirs(output_path, exist_ok=True)
+
+    for img_id, data in items:
+        if output_format == "png":
+            from PIL import Image
+
+            output = io.BytesIO()
+            Image.open(io.BytesIO(data)).save(output, format="PNG")
+            data = output.getvalue()
+            file_path = os.path.join(output_path, "omero_img_id_" + str(img_id) + ".png")
+        else:
+            file_path = os.path.join(output_path, "omero_img_id_" + str(img_id) + ".jpg")
+
+        with trace_span("io", "write thumbnail", len(data)):
+            with open(file_path, "wb") as file:
+                file.write(data)
+        count += 1
+
+    return count
@@ -1,3 +1,28 @@
+import time
+
+from omero_bifrost.utils.util_ops import omero_connect, omero_close, get_omero_cli_cmd, run_omero_cmd, parse_omero_cli_ids, get_path_size
+from omero_bifrost.utils.limit_ops import throttle
+from omero_bifrost.utils.plan_ops import record_transfer
+from omero_bifrost.query.query_ops import resolve_dataset_ids
+
+
+def get_import_cmd(import_path, dataset_id, usr, pwd, host, port=4064, depth=None):
+    """
+    Builds the OMERO CLI command line used to import a file (or a folder, if depth is given) into a dataset
+    """
+
+    cmd = get_omero_cli_cmd("import", usr, pwd, host, port) + " -d " + str(int(dataset_id))
+    if depth is not None:
+        cmd = cmd + " --depth " + str(depth)
+
+    return cmd + " " + import_path
+
+def get_create_tag_cmd(tag_value, tag_desc, usr, pwd, host, port=4064):
+    """
+    Builds the OMERO CLI command line used by create_tag
+    """
+
+    return get_omero_cli_cmd("tag create", usr, pwd, host, port) + " --name " + str(tag_value) + " --desc '" + str(tag_desc) + "'"
 
 def register_image_file_with_dataset_id(file_path, dataset_id, usr, pwd, host, port=4064):
     """
@@ -18,32 +43,24 @@ def register_image_file_with_dataset_id(file_path, dataset_id, usr, pwd, host, p
                 (a file can contain many images)
     """
 
-    import subprocess
-
     image_ids = []
 
     ds_id = dataset_id
 
     if ds_id != -1:
-        cmd = "omero import -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " -d " + str(int(ds_id)) + " " + file_path
-        proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True,
-                            universal_newlines=True)
-
-        std_out, std_err = proc.communicate()
+        cmd = get_import_cmd(file_path, ds_id, usr, pwd, host, port)
+        import_size = get_path_size(file_path)
+        start = time.time()
+        return_code, std_out, std_err = run_omero_cmd(cmd, import_size)
 
         # the terminal output of the omero-importer tool provides a lot of information on the registration process 
         # we are looking for a line with this format: "Image:id_1,1d_2,id_3,...,id_n"
         # where id_1,...,id_n are a list of ints, which denote the unique OMERO image IDs for the image file
         # (one file can have many images)
 
-        if int(proc.returncode) == 0:
-            for line in std_out.splitlines():
-                if line[:6] == "Image:":
-                    image_ids = line[6:].split(',')
-                    break
+        if return_code == 0:
+            record_transfer("import", import_size, time.time() - start)
+            image_ids = parse_omero_cli_ids(std_out, "Image:")
         else:
             image_ids = []
     else:
@@ -54,31 +71,24 @@ def register_image_folder_with_dataset_id(folder_path, dataset_id, usr, pwd, hos
     """
     """
 
-    import subprocess
-
     image_ids = []
 
     ds_id = dataset_id
 
     if ds_id != -1:
-        cmd = "omero import -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " -d " + str(int(ds_id)) + " --depth 1 " + folder_path
-        proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True,
-                            universal_newlines=True)
-
-        std_out, std_err = proc.communicate()
+        cmd = get_import_cmd(folder_path, ds_id, usr, pwd, host, port, depth=1)
+        import_size = get_path_size(folder_path, depth=1)
+        start = time.time()
+        return_code, std_out, std_err = run_omero_cmd(cmd, import_size)
 
         # the terminal output of the omero-importer tool provides a lot of information on the registration process 
         # we are looking for a line with this format: "Image:id_1,1d_2,id_3,...,id_n"
         # where id_1,...,id_n are a list of ints, which denote the unique OMERO image IDs for the image file
         # (one file can have many images)
 
-        if int(proc.returncode) == 0:
-            for line in std_out.splitlines():
-                if line[:6] == "Image:":
-                    image_ids.extend(line[6:].split(','))
+        if return_code == 0:
+            record_transfer("import", import_size, time.time() - start)
+            image_ids = parse_omero_cli_ids(std_out, "Image:", first_only=False)
         else:
             image_ids = []
     else:
@@ -104,61 +114,33 @@ def attach_file_to_image(file_path, image_id, usr, pwd, host, port=4064):
                 (a file can contain many images)
     """
 
-    import subprocess
-
     original_file_id = ""
     file_ann_id = ""
     image_ann_link_id = ""
 
     # upload original file and get ID
 
-    cmd = "omero upload -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " " + file_path
-    proc = subprocess.Popen(cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        shell=True,
-                        universal_newlines=True)
-    std_out, std_err = proc.communicate()
+    cmd = get_omero_cli_cmd("upload", usr, pwd, host, port) + " " + file_path
+    return_code, std_out, std_err = run_omero_cmd(cmd, get_path_size(file_path))
 
-    if int(proc.returncode) == 0:
-        for line in std_out.splitlines():
-            if line[:13] == "OriginalFile:":
-                original_file_id = line[13:]
-                break
+    if return_code == 0:
+        original_file_id = "".join(parse_omero_cli_ids(std_out, "OriginalFile:"))
 
     # create new file annotation
 
-    cmd = "omero obj -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " " + "new FileAnnotation file=OriginalFile:" + original_file_id
-
-    proc = subprocess.Popen(cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        shell=True,
-                        universal_newlines=True)
-    std_out, std_err = proc.communicate()
+    cmd = get_omero_cli_cmd("obj", usr, pwd, host, port) + " " + "new FileAnnotation file=OriginalFile:" + original_file_id
+    return_code, std_out, std_err = run_omero_cmd(cmd)
 
-    if int(proc.returncode) == 0:
-        for line in std_out.splitlines():
-            if line[:15] == "FileAnnotation:":
-                file_ann_id = line[15:]
-                break
+    if return_code == 0:
+        file_ann_id = "".join(parse_omero_cli_ids(std_out, "FileAnnotation:"))
 
     # create new annotation link
 
-    cmd = "omero obj -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " " + "new ImageAnnotationLink parent=Image:" + str(image_id) + " child=FileAnnotation:" + file_ann_id
+    cmd = get_omero_cli_cmd("obj", usr, pwd, host, port) + " " + "new ImageAnnotationLink parent=Image:" + str(image_id) + " child=FileAnnotation:" + file_ann_id
+    return_code, std_out, std_err = run_omero_cmd(cmd)
 
-    proc = subprocess.Popen(cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        shell=True,
-                        universal_newlines=True)
-    std_out, std_err = proc.communicate()
-
-    if int(proc.returncode) == 0:
-        for line in std_out.splitlines():
-            if line[:20] == "ImageAnnotationLink:":
-                image_ann_link_id = line[20:]
-                break
+    if return_code == 0:
+        image_ann_link_id = "".join(parse_omero_cli_ids(std_out, "ImageAnnotationLink:"))
 
     return image_ann_link_id
 
@@ -166,24 +148,15 @@ def create_tag(tag_value, tag_desc, usr, pwd, host, port=4064):
     """
     """
 
-    import subprocess
-
     tag_id = -1
 
-    cmd = "omero tag create -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " --name " + str(tag_value) + " --desc '" + str(tag_desc) + "'"
-    proc = subprocess.Popen(cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        shell=True,
-                        universal_newlines=True)
+    cmd = get_create_tag_cmd(tag_value, tag_desc, usr, pwd, host, port)
+    return_code, std_out, std_err = run_omero_cmd(cmd)
 
-    std_out, std_err = proc.communicate()
-
-    if int(proc.returncode) == 0:
-        for line in std_out.splitlines():
-            if line[:14] == "TagAnnotation:":
-                tag_id = int(line[14:])
-                break
+    if return_code == 0:
+        tag_ids = parse_omero_cli_ids(std_out, "TagAnnotation:")
+        if len(tag_ids) > 0:
+            tag_id = int(tag_ids[0])
     
     return tag_id
 
@@ -191,16 +164,8 @@ def add_tag_to_image(image_id, tag_id, usr, pwd, host, port=4064):
     """
     """
 
-    import subprocess
-    
-    cmd = "omero tag link -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd + " Image:" + str(image_id) + " " + str(tag_id)
-    proc = subprocess.Popen(cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        shell=True,
-                        universal_newlines=True)
-
-    std_out, std_err = proc.communicate()
+    cmd = get_omero_cli_cmd("tag link", usr, pwd, host, port) + " Image:" + str(image_id) + " " + str(tag_id)
+    return_code, std_out, std_err = run_omero_cmd(cmd)
     
     return std_out, std_err
 
@@ -220,6 +185,8 @@ def add_kv_to_image(conn, image_id, key_value_data):
 
     import omero
 
+    throttle(calls=3)
+
     map_ann = omero.gateway.MapAnnotationWrapper(conn)
     # Use 'client' namespace to allow editing in Insight & web
     namespace = omero.constants.metadata.NSCLIENTMAPANNOTATION
@@ -234,6 +201,33 @@ def add_kv_to_image(conn, image_id, key_value_data):
     return 0
 
 
+def add_kv_to_images(pool, image_id_list, key_value_data):
+    """
+    Adds the same key-value pairs to many images, in parallel over the gateways of a ConnectionPool
+    Example:
+        with ConnectionPool("joe_usr", "joe_pwd", "192.168.2.2", size=8) as pool:
+            add_kv_to_images(pool, [101, 102, 103], [["Drug Name", "Monastrol"]])
+    Args:
+        pool: a ConnectionPool
+        image_id_list (list of ints): OMERO image IDs
+        key_value_data (list of lists): list of key-value pairs
+    Returns:
+        int: not relevant atm
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def annotate(image_id):
+        with pool.connection() as conn:
+            return add_kv_to_image(conn, image_id, key_value_data)
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        for result in executor.map(annotate, image_id_list):
+            pass
+
+    return 0
+
+
 ########################################
 #functions to push numpy arrays
 
@@ -292,22 +286,15 @@ def register_image_array(img, img_name, img_desc, project_id, sample_id, usr, pw
     """
 
     img_id = -1
-    save_flag = 0
 
     conn = omero_connect(usr, pwd, host, str(port))
 
-    for project in conn.getObjects("Project"):
-        if project.getName() == project_id:
-            for dataset in project.listChildren():
-                if dataset.getName() == sample_id:
+    dataset_id = resolve_dataset_ids(conn, [(project_id, sample_id)])[(str(project_id), str(sample_id))]
 
-                    img_id = create_array(conn, img, img_name, img_desc, dataset)
+    if dataset_id != -1:
+        dataset = conn.getObject("Dataset", dataset_id)
+        img_id = create_array(conn, img, img_name, img_desc, dataset)
 
-                    save_flag = 1
-                    break
-        if save_flag == 1:
-            break
+    omero_close(conn)
 
     return int(img_id)
-
-
@@ -1,33 +1,164 @@
 
-def fetch_all_objects(conn):
+DEFAULT_PAGE_SIZE = 1000
 
-    output_map = {}
-    output_count = 0
 
-    for project in conn.getObjects("Project"):
+def iter_object_pages(conn, obj_type, page_size=DEFAULT_PAGE_SIZE, opts=None, attributes=None):
+    """
+    Generates the objects of a type page by page (offset/limit, ordered by ID),
+    so that at most one page is held in memory at a time
 
-        output_map[output_count] = {"type": "project",
-                                  "name": str(project.getName()),
-                                  "id": str(project.getId())}
-        output_count += 1
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        obj_type (string): OMERO object type, e.g. "Project", "Dataset" or "Image"
+        page_size (int): number of objects fetched per query
+        opts (dict): BlitzGateway.getObjects options, e.g. {"project": 1} or {"dataset": 2}
+        attributes (dict): BlitzGateway.getObjects attribute filter, e.g. {"name": "proj"}
 
-        for dataset in project.listChildren():
+    Returns:
+        generator of lists: pages of object wrappers
+    """
+
+    if page_size < 1:
+        raise ValueError("Invalid page size: " + str(page_size))
+
+    offset = 0
+
+    while True:
+        page_opts = dict(opts or {})
+        page_opts.update({"offset": offset, "limit": page_size, "order_by": "obj.id"})
+
+        page = list(conn.getObjects(obj_type, attributes=attributes, opts=page_opts))
+        if len(page) > 0:
+            yield page
+
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+def iter_objects(conn, obj_type, page_size=DEFAULT_PAGE_SIZE, opts=None, attributes=None):
+    """
+    Generates the objects of a type one by one, fetched page by page (see iter_object_pages)
+    """
+
+    for page in iter_object_pages(conn, obj_type, page_size, opts, attributes):
+        for obj in page:
+            yield obj
+
+def iter_projects(conn, page_size=DEFAULT_PAGE_SIZE, project_name=None):
+    """
+    Generates all accessible projects (or those with the given name), fetched page by page
+    """
+
+    attributes = None if project_name is None else {"name": project_name}
+
+    return iter_objects(conn, "Project", page_size, attributes=attributes)
+
+def iter_datasets(conn, project_id, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Generates the datasets of a project, fetched page by page
+    """
 
-            output_map[output_count] = {"type": "dataset",
-                                      "name": str(dataset.getName()),
-                                      "id": str(dataset.getId())}
-            output_count += 1
+    return iter_objects(conn, "Dataset", page_size, opts={"project": int(project_id)})
+
+def iter_images(conn, dataset_id, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Generates the images of a dataset, fetched page by page
+    """
+
+    return iter_objects(conn, "Image", page_size, opts={"dataset": int(dataset_id)})
+
+def iter_all_objects(conn, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Generates all accessible Projects, Datasets and Images (depth-first) as output items,
+    fetching children page by page
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        page_size (int): number of objects fetched per query
+
+    Returns:
+        generator of dicts: {"type": ..., "name": ..., "id": ...}
+    """
+
+    for project in iter_projects(conn, page_size):
+
+        yield {"type": "project",
+               "name": str(project.getName()),
+               "id": str(project.getId())}
+
+        for dataset in iter_datasets(conn, project.getId(), page_size):
+
+            yield {"type": "dataset",
+                   "name": str(dataset.getName()),
+                   "id": str(dataset.getId())}
             
-            for image in dataset.listChildren():
+            for image in iter_images(conn, dataset.getId(), page_size):
+
+                yield {"type": "image",
+                       "name": str(image.getName()),
+                       "id": str(image.getId())}
 
-                output_map[output_count] = {"type": "image",
-                                          "name": str(image.getName()),
-                                          "id": str(image.getId())}
-                output_count += 1
+def fetch_all_objects(conn):
+
+    output_map = {}
+
+    for output_count, output_item in enumerate(iter_all_objects(conn)):
+        output_map[output_count] = output_item
 
     return output_map
 
-def print_data_tree(conn):
+def iter_filtered_images(conn, project_name_list, key_value_data, tag_list, page_size=DEFAULT_PAGE_SIZE, log=None):
+    """
+    Generates the images matching all key-value pairs and tags, one page of images
+    at a time, so results are available after the first page and memory use
+    does not grow with the number of images
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        project_name_list (list of strings): projects to search (all projects if empty)
+        key_value_data (list of lists): key-value pairs the images must have
+        tag_list (list of strings): tag values the images must have
+        page_size (int): number of images fetched (and filtered) per query
+        log: optional print function for progress messages
+
+    Returns:
+        generator of dicts: {"id": ..., "path": "project/dataset", "name": ...}
+    """
+
+    if len(key_value_data) > 0 or len(tag_list) > 0:
+        import ezomero
+
+    if len(project_name_list) > 0:
+        projects = (project for project_name in project_name_list for project in iter_projects(conn, page_size, project_name))
+    else:
+        projects = iter_projects(conn, page_size)
+
+    for project in projects:
+        if log is not None:
+            log("[bold blue]Inspecting project: " + str(project.getName()) + " (ID: " + str(project.getId()) + ")")
+
+        for dataset in iter_datasets(conn, project.getId(), page_size):
+            img_path = (project.getName() + "/" + dataset.getName()).replace(" ", "_")
+
+            for page in iter_object_pages(conn, "Image", page_size, opts={"dataset": int(dataset.getId())}):
+                image_map = {}
+                for image in page:
+                    image_map[int(image.getId())] = image.getName().replace(" ", "_") # id -> name
+
+                image_id_list = list(image_map.keys())
+
+                for kv in key_value_data:
+                    if len(image_id_list) > 0:
+                        image_id_list = ezomero.filter_by_kv(conn, image_id_list, key=kv[0], value=kv[1], across_groups=True)
+
+                for tag in tag_list:
+                    if len(image_id_list) > 0:
+                        image_id_list = ezomero.filter_by_tag_value(conn, image_id_list, tag_value=tag, across_groups=True)
+
+                for img_id in image_id_list:
+                    yield {"id": img_id, "path": img_path, "name": image_map[img_id]}
+
+def print_data_tree(conn, page_size=DEFAULT_PAGE_SIZE):
     """
     Prints all IDs of the data objects(Projects, Datasets, Images) associated with the logged in user on the OMERO server
 
@@ -45,11 +176,11 @@ def print_data_tree(conn):
 
     tree = Tree("OMERO Data")
 
-    for project in conn.getObjects("Project"):
+    for project in iter_projects(conn, page_size):
     
         project_branch = tree.add("[bold red]" + str(project.getName()) + " : " + str(project.getId()))
         
-        for dataset in project.listChildren():
+        for dataset in iter_datasets(conn, project.getId(), page_size):
     
             dataset_branch = project_branch.add("[blue]" + str(dataset.getName()) + " : " + str(dataset.getId()))
 
@@ -59,7 +190,7 @@ def print_data_tree(conn):
 
             dataset_branch.add(image_table)
 
-            for image in dataset.listChildren():
+            for image in iter_images(conn, dataset.getId(), page_size):
 
                 image_table.add_row(str(image.getName()), str(image.getId()))
 
@@ -100,25 +231,172 @@ def get_omero_dataset_id(conn, project_name, dataset_name):
 
     """
 
-    omero_dataset_id = -1
-    found_id = False
+    return resolve_dataset_ids(conn, [(project_name, dataset_name)])[(str(project_name), str(dataset_name))]
 
-    my_exp_id = conn.getUser().getId()
-    default_group_id = conn.getEventContext().groupId
+########################################
+#batch name resolution
 
-    for project in conn.getObjects("Project"):
+# (session UUID, project name, dataset name) -> dataset ID
+_dataset_id_cache = {}
 
-        if found_id:
-            break
+RESOLVE_CHUNK_SIZE = 500
+
+
+def resolve_dataset_ids(conn, name_pairs, create_missing=False):
+    """
+    Resolves many (project name, dataset name) pairs to dataset IDs with a few
+    bulk queries instead of a scan per pair. Results are memoized per session.
+    If a name pair matches several datasets, the one with the lowest ID is used.
+
+    Example:
+        resolve_dataset_ids(conn, [("project_x", "sample_1"), ("project_x", "sample_2")], create_missing=True)
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        name_pairs (list of tuples): (project name, dataset name) pairs
+        create_missing (bool): create missing projects and datasets (in one batched save)
+    Returns:
+        dict: (project name, dataset name) -> dataset ID, -1 for pairs that were not found
+    """
+
+    session_uuid = conn.getEventContext().sessionUuid
+
+    dataset_ids = {}
+    missing_pairs = []
+
+    for pair in name_pairs:
+        pair = (str(pair[0]), str(pair[1]))
+        if pair in dataset_ids:
+            continue
+        cached_id = _dataset_id_cache.get((session_uuid,) + pair)
+        if cached_id is None:
+            missing_pairs.append(pair)
+            dataset_ids[pair] = -1
+        else:
+            dataset_ids[pair] = cached_id
+
+    for start in range(0, len(missing_pairs), RESOLVE_CHUNK_SIZE):
+        chunk = missing_pairs[start:start + RESOLVE_CHUNK_SIZE]
+        for pair, dataset_id in _query_dataset_ids(conn, chunk).items():
+            dataset_ids[pair] = dataset_id
+
+    if create_missing:
+        still_missing = [pair for pair in missing_pairs if dataset_ids[pair] == -1]
+        if len(still_missing) > 0:
+            dataset_ids.update(create_datasets(conn, still_missing))
+
+    for pair in missing_pairs:
+        if dataset_ids[pair] != -1:
+            _dataset_id_cache[(session_uuid,) + pair] = dataset_ids[pair]
+
+    return dataset_ids
+
+def _query_dataset_ids(conn, name_pairs):
+
+    from omero.sys import ParametersI
+    from omero.rtypes import rstring, rlist, unwrap
+
+    params = ParametersI()
+    params.add("pnames", rlist([rstring(name) for name in set(pair[0] for pair in name_pairs)]))
+    params.add("dnames", rlist([rstring(name) for name in set(pair[1] for pair in name_pairs)]))
+
+    query = ("select p.name, d.name, d.id from ProjectDatasetLink l join l.parent p join l.child d "
+             "where p.name in (:pnames) and d.name in (:dnames) order by d.id")
+
+    wanted = set(name_pairs)
+    dataset_ids = {}
+
+    for row in conn.getQueryService().projection(query, params, conn.SERVICE_OPTS):
+        project_name, dataset_name, dataset_id = [unwrap(value) for value in row]
+        pair = (project_name, dataset_name)
+        if pair in wanted and pair not in dataset_ids:
+            dataset_ids[pair] = int(dataset_id)
+
+    return dataset_ids
+
+def create_datasets(conn, name_pairs):
+    """
+    Creates datasets (and their projects, if missing) for many (project name, dataset name)
+    pairs with at most two server calls: one saving the missing projects, one saving all
+    datasets with their project links
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        name_pairs (list of tuples): (project name, dataset name) pairs
+    Returns:
+        dict: (project name, dataset name) -> ID of the new dataset
+    """
+
+    from omero.model import ProjectI, DatasetI, ProjectDatasetLinkI
+    from omero.sys import ParametersI
+    from omero.rtypes import rstring, rlist, unwrap
+
+    project_names = sorted(set(pair[0] for pair in name_pairs))
+
+    params = ParametersI()
+    params.add("pnames", rlist([rstring(name) for name in project_names]))
+    query = "select p.id, p.name from Project p where p.name in (:pnames) order by p.id"
+
+    projects = {}
+    for row in conn.getQueryService().projection(query, params, conn.SERVICE_OPTS):
+        project_id, project_name = [unwrap(value) for value in row]
+        if project_name not in projects:
+            projects[project_name] = ProjectI(int(project_id), False)
+
+    # saved before the links: the server saves every element of an array on its own, so a new
+    # project shared by several links would be created once per link
+    new_projects = []
+    for project_name in project_names:
+        if project_name not in projects:
+            project = ProjectI()
+            project.setName(rstring(project_name))
+            new_projects.append(project)
+
+    if len(new_projects) > 0:
+        for project in conn.getUpdateService().saveAndReturnArray(new_projects, conn.SERVICE_OPTS):
+            projects[unwrap(project.getName())] = ProjectI(project.getId().getValue(), False)
+
+    links = []
+    for project_name, dataset_name in name_pairs:
+        dataset = DatasetI()
+        dataset.setName(rstring(dataset_name))
+        link = ProjectDatasetLinkI()
+        link.setParent(projects[project_name])
+        link.setChild(dataset)
+        links.append(link)
+
+    saved_links = conn.getUpdateService().saveAndReturnArray(links, conn.SERVICE_OPTS)
+
+    dataset_ids = {}
+    for pair, link in zip(name_pairs, saved_links):
+        dataset_ids[pair] = int(link.getChild().getId().getValue())
+
+    return dataset_ids
+
+def get_scope_image_ids(conn, project_name, dataset_name=""):
+    """
+    Returns the IDs of all images in a project, or in one of its datasets,
+    with a single server query
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+        project_name (string): name of the project
+        dataset_name (string): name of the dataset, all datasets of the project if empty
+    Returns:
+        list of ints: image IDs, ordered and without duplicates
+    """
 
-        if project.getName() == project_name:
-            for dataset in project.listChildren():
+    from omero.sys import ParametersI
+    from omero.rtypes import rstring, unwrap
 
-                if dataset.getName() == dataset_name:
-                    omero_dataset_id = dataset.getId()
+    params = ParametersI()
+    params.add("pname", rstring(project_name))
 
-                    found_id = True
-                    break
+    query = ("select distinct i.id from DatasetImageLink dl join dl.parent d join dl.child i, "
+             "ProjectDatasetLink pl join pl.parent p where pl.child.id = d.id and p.name = :pname")
+    if dataset_name != "":
+        params.add("dname", rstring(dataset_name))
+        query += " and d.name = :dname"
 
-    return omero_dataset_id
+    rows = conn.getQueryService().projection(query + " order by i.id", params, conn.SERVICE_OPTS)
 
+    return [int(unwrap(row[0])) for row in rows]
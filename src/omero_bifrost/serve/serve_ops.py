@@ -0,0 +1,401 @@
+import io
+import threading
+
+
+def get_socket_path(socket_path=""):
+    """
+    Returns the path of the Unix socket used by the bifrost daemon: the given path,
+    else $OMERO_BIFROST_SOCKET, else bifrost.sock in a directory private to the user
+    (see get_socket_dir).
+    """
+
+    import os
+
+    if socket_path != "":
+        return socket_path
+
+    env_path = os.environ.get("OMERO_BIFROST_SOCKET", "")
+    if env_path != "":
+        return env_path
+
+    return os.path.join(get_socket_dir(), "bifrost.sock")
+
+def get_socket_dir():
+    """
+    Returns the directory of the default daemon socket: $XDG_RUNTIME_DIR/omero-bifrost,
+    or omero-bifrost-<uid> in the temp directory. run_server creates it with mode 0700,
+    so that other local users cannot put a socket of their own in its place.
+    """
+
+    import os
+    import tempfile
+
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+    if runtime_dir != "" and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "omero-bifrost")
+
+    user_id = str(os.getuid()) if hasattr(os, "getuid") else "default"
+
+    return os.path.join(tempfile.gettempdir(), "omero-bifrost-" + user_id)
+
+def _make_private_dir(path):
+    import os
+
+    os.makedirs(path, mode=0o700, exist_ok=True)
+
+    if hasattr(os, "getuid"):
+        info = os.stat(path)
+        if info.st_uid != os.getuid() or info.st_mode & 0o077 != 0:
+            raise RuntimeError("The socket directory " + path + " is not private to this user (owner and mode 0700)")
+
+def _is_own_socket(socket_path):
+    # a socket created by another user could fake the results of our commands
+    import os
+
+    if not hasattr(os, "getuid"):
+        return True
+
+    try:
+        return os.stat(socket_path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+def _connect(socket_path):
+    # connected socket of the daemon, None if no daemon of this user is listening
+    import os
+    import socket
+
+    if not os.path.exists(socket_path) or not _is_own_socket(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    return sock
+
+def send_request(request, socket_path=""):
+    """
+    Sends a JSON control request to the bifrost daemon and waits for its JSON response.
+
+    Args:
+        request (dict): the request, e.g. {"op": "ping"} or {"op": "stop"}
+        socket_path (string): path of the daemon socket (see get_socket_path)
+    Returns:
+        dict: the daemon response, None if no daemon is listening on the socket
+    """
+
+    import json
+
+    sock = _connect(get_socket_path(socket_path))
+    if sock is None:
+        return None
+
+    with sock:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    data = b"".join(chunks)
+    if len(data) == 0:
+        return {"exit_code": 1, "stdout": "", "stderr": "Error: the bifrost daemon closed the connection without a response\n"}
+
+    return json.loads(data.decode("utf-8"))
+
+def forward_to_server(argv, socket_path=""):
+    """
+    Runs a command line on the bifrost daemon, if one is running, and writes its
+    output to standard output and standard error as the daemon streams it back
+    (see OutputFrameWriter), so long and binary outputs work as in a local run.
+    Forwarding is skipped when $OMERO_BIFROST_NO_DAEMON is set.
+
+    Args:
+        argv (list of strings): command line arguments, without the program name
+        socket_path (string): path of the daemon socket (see get_socket_path)
+    Returns:
+        int: exit code of the forwarded command, None if there is no daemon to forward
+                to or the daemon is busy with another command (run it locally then)
+    """
+
+    import os
+    import sys
+    import json
+    import base64
+
+    if os.environ.get("OMERO_BIFROST_NO_DAEMON", "") != "":
+        return None
+
+    sock = _connect(get_socket_path(socket_path))
+    if sock is None:
+        return None
+
+    exit_code = None
+
+    with sock:
+        sock.sendall(json.dumps({"argv": list(argv), "cwd": os.getcwd()}).encode("utf-8") + b"\n")
+
+        for line in sock.makefile("rb"):
+            frame = json.loads(line.decode("utf-8"))
+            if frame.get("busy", False):
+                return None
+            if "exit_code" in frame:
+                exit_code = int(frame["exit_code"])
+                break
+
+            stream = sys.stdout if frame["stream"] == "stdout" else sys.stderr
+            stream.flush()
+            stream.buffer.write(base64.b64decode(frame["data"]))
+            stream.buffer.flush()
+
+    if exit_code is None:
+        sys.stderr.write("Error: the bifrost daemon closed the connection without an exit code\n")
+        return 1
+
+    return exit_code
+
+class OutputFrameWriter(object):
+    """
+    Streams the output of a forwarded command back to the client while it runs,
+    as JSON lines {"stream": "stdout" or "stderr", "data": base64 bytes} followed
+    by a final {"exit_code": ...}. Writes are sent in chunks of up to chunk_size
+    bytes, and on flush.
+    """
+
+    def __init__(self, wfile, chunk_size=65536):
+        self._wfile = wfile
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._stream = None
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, stream, data):
+        with self._lock:
+            if stream != self._stream:
+                self._send()
+                self._stream = stream
+            self._pending.append(bytes(data))
+            self._pending_size += len(data)
+            if self._pending_size >= self.chunk_size:
+                self._send()
+
+    def flush(self):
+        with self._lock:
+            self._send()
+
+    def finish(self, exit_code):
+        import json
+
+        with self._lock:
+            self._send()
+            self._wfile.write(json.dumps({"exit_code": exit_code}).encode("utf-8") + b"\n")
+
+    def _send(self):
+        import json
+        import base64
+
+        if self._pending_size > 0:
+            frame = {"stream": self._stream, "data": base64.b64encode(b"".join(self._pending)).decode("ascii")}
+            self._wfile.write(json.dumps(frame).encode("utf-8") + b"\n")
+
+        self._pending = []
+        self._pending_size = 0
+
+class _FrameBinaryStream(io.RawIOBase):
+    # sys.stdout.buffer stand-in of a forwarded command
+
+    def __init__(self, writer, stream):
+        super().__init__()
+        self._writer = writer
+        self._stream = stream
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._writer.write(self._stream, data)
+        return len(data)
+
+    def flush(self):
+        self._writer.flush()
+
+class _FrameTextStream(io.TextIOBase):
+    # sys.stdout/sys.stderr stand-in of a forwarded command
+
+    encoding = "utf-8"
+
+    def __init__(self, writer, stream):
+        super().__init__()
+        self._writer = writer
+        self._stream = stream
+        self.buffer = _FrameBinaryStream(writer, stream)
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._writer.write(self._stream, text.encode("utf-8"))
+        return len(text)
+
+    def flush(self):
+        self._writer.flush()
+
+def run_server(socket_path="", idle_timeout=0):
+    """
+    Runs the bifrost daemon: listens on a Unix socket and executes forwarded
+    command lines in this process, so that imports, parsed modules and OMERO
+    sessions stay warm between calls. Commands are executed one at a time
+    (they share the working directory, standard output and the process-wide
+    limiter and tracer): while one runs, other clients are told that the
+    daemon is busy and run their command themselves.
+
+    Args:
+        socket_path (string): path of the daemon socket (see get_socket_path)
+        idle_timeout (int): stop after this many seconds without requests (0: never)
+    """
+
+    import os
+    import json
+    import time
+    import socketserver
+    from concurrent.futures import ThreadPoolExecutor
+
+    from omero_bifrost.utils.util_ops import enable_session_cache, close_cached_sessions, invoke_cli_command
+
+    if socket_path == "" and os.environ.get("OMERO_BIFROST_SOCKET", "") == "":
+        _make_private_dir(get_socket_dir())
+
+    socket_path = get_socket_path(socket_path)
+
+    if os.path.exists(socket_path):
+        if not _is_own_socket(socket_path):
+            raise RuntimeError("The socket " + socket_path + " belongs to another user")
+        if send_request({"op": "ping"}, socket_path) is not None:
+            raise RuntimeError("A bifrost daemon is already listening on " + socket_path)
+        os.remove(socket_path) # stale socket of a daemon that did not shut down cleanly
+
+    enable_session_cache()
+
+    # pay the import cost once, before the first request
+    from omero_bifrost.cli import suspend_invocations, resume_invocations
+    try:
+        import omero.gateway
+    except ImportError:
+        pass
+
+    state = {"running": True, "last_request": time.time()}
+    run_lock = threading.Lock()
+    # connections are handled in threads of their own, but commands all run on one thread,
+    # which keeps the gateways of the (per-thread) session cache in use
+    command_thread = ThreadPoolExecutor(max_workers=1)
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            op = request.get("op", "run")
+
+            if op == "run":
+                if not run_lock.acquire(blocking=False):
+                    # don't queue behind a long command (e.g. a pull): the client runs it itself
+                    self.wfile.write(json.dumps({"busy": True}).encode("utf-8") + b"\n")
+                    return
+                writer = OutputFrameWriter(self.wfile)
+                try:
+                    exit_code = command_thread.submit(self.run_command, request, writer).result()
+                finally:
+                    state["last_request"] = time.time()
+                    run_lock.release()
+                try:
+                    # after releasing the lock: the client may send its next command right away
+                    writer.finish(exit_code)
+                except OSError:
+                    pass # the client went away, e.g. its output was piped into head
+                return
+
+            if op == "stop":
+                state["running"] = False
+
+            self.wfile.write(json.dumps({"exit_code": 0, "stdout": "", "stderr": ""}).encode("utf-8") + b"\n")
+
+        def run_command(self, request, writer):
+            previous_cwd = os.getcwd()
+            # each request is an outermost invocation (tracing, transfer limits), not a
+            # command nested in the serve invocation of the daemon
+            depth = suspend_invocations()
+            try:
+                os.chdir(request.get("cwd", previous_cwd))
+                exit_code, std_out, std_err = invoke_cli_command(request["argv"],
+                                                                 _FrameTextStream(writer, "stdout"),
+                                                                 _FrameTextStream(writer, "stderr"))
+                writer.flush()
+            except OSError:
+                exit_code = 1 # the client went away, e.g. its output was piped into head
+            finally:
+                os.chdir(previous_cwd)
+                resume_invocations(depth)
+
+            return exit_code
+
+    previous_umask = os.umask(0o077) # the socket gives access to authenticated sessions
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler)
+    finally:
+        os.umask(previous_umask)
+
+    def handle_timeout():
+        idle = not run_lock.locked() and time.time() - state["last_request"] > idle_timeout
+        if idle_timeout > 0 and idle:
+            state["running"] = False
+
+    # requests run in their own threads: wake up regularly to notice a stop request
+    server.timeout = 0.5
+    server.handle_timeout = handle_timeout
+
+    try:
+        while state["running"]:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        command_thread.shutdown()
+        close_cached_sessions()
+
+def stop_server(socket_path=""):
+    """
+    Asks a running bifrost daemon to shut down.
+
+    Returns:
+        bool: True if a daemon was running
+    """
+
+    return send_request({"op": "stop"}, socket_path) is not None
+
+def main():
+    """
+    Entry point of the omero-bifrost script: forwards the command line to a
+    running daemon, or runs it in this process if there is none.
+    """
+
+    import sys
+
+    argv = sys.argv[1:]
+
+    if len(argv) == 0 or argv[0] != "serve":
+        exit_code = forward_to_server(argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from omero_bifrost.cli import app
+
+    app()
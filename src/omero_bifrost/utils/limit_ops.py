@@ -0,0 +1,258 @@
+import threading
+
+_limiter = None
+_limiter_source = None
+_limiter_lock = threading.Lock()
+
+
+class TokenBucket(object):
+    """
+    Token bucket allowing 'rate' units per second with bursts of up to one second worth of units.
+    A rate of 0 means unlimited. Callers may take more tokens than available; the
+    bucket then goes into debt and the caller (and everyone after it) waits it off.
+    """
+
+    def __init__(self, rate):
+        import time
+
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = float(rate)
+            self.tokens = min(self.tokens, self.rate)
+
+    def reserve(self, amount):
+        """
+        Takes 'amount' tokens and returns how many seconds the caller has to wait for them
+        """
+        import time
+
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class TransferLimiter(object):
+    """
+    Caps the aggregate bytes/s and server calls/s of all workers in the process.
+    Example:
+        limiter = TransferLimiter(50 * 1024**2, 20, [(8*60, 20*60, 10 * 1024**2, 5)])
+    Args:
+        bytes_per_sec (float): default byte rate (0: unlimited)
+        calls_per_sec (float): default call rate (0: unlimited)
+        profiles (list of tuples): (start_minute, end_minute, bytes_per_sec, calls_per_sec)
+                time windows of the local day that override the defaults, the end may
+                lie before the start for windows spanning midnight
+    """
+
+    def __init__(self, bytes_per_sec=0, calls_per_sec=0, profiles=None):
+        self.settings = (bytes_per_sec, calls_per_sec, list(profiles or []))
+        self.default_rates = (bytes_per_sec, calls_per_sec)
+        self.profiles = list(profiles or [])
+        self.byte_bucket = TokenBucket(bytes_per_sec)
+        self.call_bucket = TokenBucket(calls_per_sec)
+        self.throttled_seconds = 0.0
+        self.throttled_count = 0
+        self.total_bytes = 0
+        self.total_calls = 0
+        self._stats_lock = threading.Lock()
+
+    def current_rates(self):
+        """
+        Returns the (bytes_per_sec, calls_per_sec) of the profile matching the local time
+        """
+        import time
+
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+
+        for start, end, bytes_per_sec, calls_per_sec in self.profiles:
+            if start <= end:
+                in_window = start <= minute < end
+            else:
+                in_window = minute >= start or minute < end
+            if in_window:
+                return bytes_per_sec, calls_per_sec
+
+        return self.default_rates
+
+    def throttle(self, calls=0, nbytes=0):
+        """
+        Accounts for 'calls' server calls and 'nbytes' transferred bytes and
+        sleeps as long as needed to stay within the current rates
+        """
+        import time
+
+        bytes_per_sec, calls_per_sec = self.current_rates()
+        if bytes_per_sec != self.byte_bucket.rate:
+            self.byte_bucket.set_rate(bytes_per_sec)
+        if calls_per_sec != self.call_bucket.rate:
+            self.call_bucket.set_rate(calls_per_sec)
+
+        wait = max(self.call_bucket.reserve(calls), self.byte_bucket.reserve(nbytes))
+
+        with self._stats_lock:
+            self.total_calls += calls
+            self.total_bytes += nbytes
+            if wait > 0:
+                self.throttled_seconds += wait
+                self.throttled_count += 1
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def reset_report(self):
+        with self._stats_lock:
+            self.throttled_seconds = 0.0
+            self.throttled_count = 0
+            self.total_bytes = 0
+            self.total_calls = 0
+
+    def report(self):
+        with self._stats_lock:
+            return {"calls": self.total_calls,
+                    "bytes": self.total_bytes,
+                    "throttled_count": self.throttled_count,
+                    "throttled_seconds": round(self.throttled_seconds, 3)}
+
+
+def parse_size(value):
+    """
+    Parses a byte count or rate with an optional binary suffix
+    Example:
+        parse_size("50M") -> 52428800
+    """
+
+    value = str(value).strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+    if value == "":
+        return 0
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(float(value))
+
+def parse_limit_profiles(profiles_str):
+    """
+    Parses time-window profiles in the format "HH:MM-HH:MM=bytes_per_sec/calls_per_sec; ..."
+    Example:
+        parse_limit_profiles("08:00-20:00=20M/10; 20:00-08:00=0/0")
+    Returns:
+        list of tuples: (start_minute, end_minute, bytes_per_sec, calls_per_sec)
+    """
+
+    profiles = []
+
+    for profile in profiles_str.split(";"):
+        profile = profile.strip()
+        if profile == "":
+            continue
+
+        window, rates = profile.split("=")
+        start, end = window.split("-")
+        byte_rate, call_rate = rates.split("/")
+
+        start_h, start_m = start.strip().split(":")
+        end_h, end_m = end.strip().split(":")
+
+        profiles.append((int(start_h) * 60 + int(start_m),
+                         int(end_h) * 60 + int(end_m),
+                         parse_size(byte_rate),
+                         float(call_rate)))
+
+    return profiles
+
+def configure_transfer_limits(bytes_per_sec=0, calls_per_sec=0, profiles=None, source="cli"):
+    """
+    Installs the process-wide transfer limiter used by throttle()
+    Limits set from the command line (source "cli") take priority over the
+    config file (source "config"). Reconfiguring with unchanged settings keeps
+    the current limiter and its statistics.
+    """
+
+    global _limiter, _limiter_source
+
+    settings = (bytes_per_sec, calls_per_sec, list(profiles or []))
+
+    with _limiter_lock:
+        if source == "config" and _limiter is not None and _limiter_source == "cli":
+            return
+        if _limiter is not None and _limiter.settings == settings:
+            _limiter_source = source
+            return
+
+        _limiter = TransferLimiter(bytes_per_sec, calls_per_sec, profiles)
+        _limiter_source = source
+
+def save_transfer_limits():
+    """
+    Starts the transfer limits of one command invocation: returns the current limiter,
+    to be put back by restore_transfer_limits when the invocation ends, and resets its
+    throttle report so that it only counts the calls of the invocation
+    """
+
+    with _limiter_lock:
+        if _limiter is not None:
+            _limiter.reset_report()
+        return _limiter, _limiter_source
+
+def restore_transfer_limits(state):
+    """
+    Puts back the limiter saved by save_transfer_limits, dropping the limits configured
+    since then (from the command line or a config file)
+    """
+
+    global _limiter, _limiter_source
+
+    with _limiter_lock:
+        _limiter, _limiter_source = state
+
+def load_transfer_limits(config):
+    """
+    Configures the transfer limiter from the optional [TransferLimitSection]
+    of a parsed imaging_config.properties file, with the keys
+    limit.bytes_per_sec, limit.calls_per_sec and limit.profiles
+    """
+
+    section = "TransferLimitSection"
+
+    if not config.has_section(section):
+        return
+
+    configure_transfer_limits(parse_size(config.get(section, "limit.bytes_per_sec", fallback="0")),
+                              float(config.get(section, "limit.calls_per_sec", fallback="0")),
+                              parse_limit_profiles(config.get(section, "limit.profiles", fallback="")),
+                              source="config")
+
+def throttle(calls=0, nbytes=0):
+    """
+    Accounts for server calls and transferred bytes against the process-wide
+    limits, sleeping if needed. Does nothing if no limits are configured.
+    """
+
+    if _limiter is not None:
+        _limiter.throttle(calls, nbytes)
+
+def get_throttle_report():
+    """
+    Returns:
+        dict: call and byte totals and the time workers spent throttled, None if no limiter is configured
+    """
+
+    if _limiter is None:
+        return None
+
+    return _limiter.report()
@@ -0,0 +1,272 @@
+
+import os
+import threading
+
+
+# number of transfers kept per kind (import, export, download) in the throughput history
+THROUGHPUT_HISTORY_SIZE = 200
+
+PLAN_CHUNK_SIZE = 1000
+
+# bytes per pixel of the OMERO pixel types, used to estimate the size of OME-TIFF exports
+PIXEL_TYPE_BYTES = {"bit": 1, "int8": 1, "uint8": 1, "int16": 2, "uint16": 2,
+                    "int32": 4, "uint32": 4, "float": 4, "double": 8,
+                    "complex": 8, "double-complex": 16}
+
+_pending_transfers = {}
+_pending_lock = threading.Lock()
+
+
+########################################
+#functions to measure throughput
+
+def get_throughput_history_path():
+    """
+    Returns the path of the throughput history file: $OMERO_BIFROST_THROUGHPUT,
+    or ~/.omero_bifrost/throughput.json
+    """
+
+    path = os.environ.get("OMERO_BIFROST_THROUGHPUT", "")
+    if path == "":
+        path = os.path.join(os.path.expanduser("~"), ".omero_bifrost", "throughput.json")
+
+    return path
+
+def record_transfer(kind, nbytes, seconds):
+    """
+    Records one completed transfer (one OMERO CLI import, export or download) for
+    the throughput history, which is written by save_throughput_history
+    Args:
+        kind (string): "import", "export" or "download"
+        nbytes (int): transferred bytes
+        seconds (float): duration of the transfer, including the OMERO CLI start-up
+    """
+
+    with _pending_lock:
+        _pending_transfers.setdefault(kind, []).append([int(nbytes), round(float(seconds), 3)])
+
+def load_throughput_history(path=None):
+    """
+    Returns the throughput history: dict of kind -> list of [bytes, seconds] transfers
+    (an empty dict if there is no readable history)
+    """
+
+    import json
+
+    path = path or get_throughput_history_path()
+
+    try:
+        with open(path) as file:
+            history = json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+    return history if isinstance(history, dict) else {}
+
+def save_throughput_history(path=None):
+    """
+    Adds the transfers recorded in this process to the throughput history file, keeping the
+    last THROUGHPUT_HISTORY_SIZE transfers per kind. The history is best effort: errors
+    writing it are ignored
+    Returns:
+        bool: True if the history was written
+    """
+
+    import json
+
+    with _pending_lock:
+        pending = dict(_pending_transfers)
+        _pending_transfers.clear()
+
+    if len(pending) == 0:
+        return False
+
+    path = path or get_throughput_history_path()
+    history = load_throughput_history(path)
+    for kind, transfers in pending.items():
+        history[kind] = (history.get(kind, []) + transfers)[-THROUGHPUT_HISTORY_SIZE:]
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp." + str(os.getpid())
+        with open(tmp_path, "w") as file:
+            json.dump(history, file)
+        os.replace(tmp_path, path)
+    except OSError:
+        return False
+
+    return True
+
+def estimate_duration(kind, transfer_count, total_bytes, history=None):
+    """
+    Estimates the duration of transfer_count transfers (OMERO CLI runs) of total_bytes from
+    earlier transfers of the same kind, fitting a fixed cost per transfer (OMERO CLI start-up,
+    login) plus a cost per byte
+    Returns:
+        float: estimated seconds, None without history
+    """
+
+    if history is None:
+        history = load_throughput_history()
+
+    transfers = [(float(nbytes), float(seconds)) for nbytes, seconds in history.get(kind, [])]
+    if len(transfers) == 0:
+        return None
+
+    count = len(transfers)
+    mean_bytes = sum(nbytes for nbytes, seconds in transfers) / count
+    mean_seconds = sum(seconds for nbytes, seconds in transfers) / count
+    bytes_variance = sum((nbytes - mean_bytes) ** 2 for nbytes, seconds in transfers)
+
+    if count >= 2 and bytes_variance > 0:
+        per_byte = sum((nbytes - mean_bytes) * (seconds - mean_seconds) for nbytes, seconds in transfers) / bytes_variance
+        per_transfer = mean_seconds - per_byte * mean_bytes
+        if per_byte >= 0 and per_transfer >= 0:
+            return per_transfer * transfer_count + per_byte * total_bytes
+
+    # not enough spread in the file sizes for a fit: scale by the average rate
+    if mean_bytes > 0:
+        return mean_seconds / mean_bytes * total_bytes
+    return mean_seconds * transfer_count
+
+
+########################################
+#functions to plan transfers
+
+def _iter_projection_chunks(conn, query, image_id_list, chunk_size):
+    from omero.sys import ParametersI
+    from omero.rtypes import rlong, rlist, unwrap
+
+    query_service = conn.getQueryService()
+
+    for start in range(0, len(image_id_list), chunk_size):
+        params = ParametersI()
+        params.add("ids", rlist([rlong(img_id) for img_id in image_id_list[start:start + chunk_size]]))
+        for row in query_service.projection(query, params, conn.SERVICE_OPTS):
+            yield [unwrap(value) for value in row]
+
+def plan_pull_orig_files(conn, image_id_list, chunk_size=PLAN_CHUNK_SIZE):
+    """
+    Plans 'pull orig-files' with one query per chunk of images: the first original file of
+    the fileset of every image (as pulled), without duplicates
+    Returns:
+        dict: plan with "files" (list of [image ID, file ID, name, bytes]), "file_count",
+              "transfer_count", "bytes", "expected_bytes" and "missing" (image IDs without a fileset)
+    """
+
+    image_id_list = list(dict.fromkeys(int(img_id) for img_id in image_id_list))
+    query = ("select i.id, f.id, f.name, f.size from Image i join i.fileset fs join fs.usedFiles u "
+             "join u.originalFile f where i.id in (:ids) order by u.id")
+
+    first_files = {}
+    for img_id, file_id, name, size in _iter_projection_chunks(conn, query, image_id_list, chunk_size):
+        if int(img_id) not in first_files:
+            first_files[int(img_id)] = [int(img_id), int(file_id), str(name), int(size or 0)]
+
+    files = []
+    file_ids = set()
+    for img_id in image_id_list:
+        if img_id in first_files and first_files[img_id][1] not in file_ids:
+            file_ids.add(first_files[img_id][1])
+            files.append(first_files[img_id])
+
+    total_bytes = sum(file_info[3] for file_info in files)
+
+    return {"operation": "pull orig-files", "kind": "download", "files": files,
+            "file_count": len(files), "transfer_count": len(files), "bytes": total_bytes, "expected_bytes": total_bytes,
+            "missing": [img_id for img_id in image_id_list if img_id not in first_files]}
+
+def plan_pull_ome_tiffs(conn, image_id_list, chunk_size=PLAN_CHUNK_SIZE):
+    """
+    Plans 'pull ome-tiffs' with one query per chunk of images: the expected size of every export
+    is the uncompressed pixel data (x * y * z * c * t * bytes per pixel)
+    Returns:
+        dict: plan with "files" (list of [image ID, name, expected bytes, pixel type]), "file_count",
+              "transfer_count", "bytes" (the pixel data), "expected_bytes" and "missing" (image IDs not found)
+    """
+
+    image_id_list = list(dict.fromkeys(int(img_id) for img_id in image_id_list))
+    query = ("select i.id, i.name, p.sizeX, p.sizeY, p.sizeZ, p.sizeC, p.sizeT, pt.value "
+             "from Pixels p join p.image i join p.pixelsType pt where i.id in (:ids)")
+
+    images = {}
+    for img_id, name, size_x, size_y, size_z, size_c, size_t, pixels_type in _iter_projection_chunks(conn, query, image_id_list, chunk_size):
+        nbytes = size_x * size_y * size_z * size_c * size_t * PIXEL_TYPE_BYTES.get(str(pixels_type), 2)
+        images[int(img_id)] = [int(img_id), str(name), int(nbytes), str(pixels_type)]
+
+    files = [images[img_id] for img_id in image_id_list if img_id in images]
+    total_bytes = sum(file_info[2] for file_info in files)
+
+    return {"operation": "pull ome-tiffs", "kind": "export", "files": files,
+            "file_count": len(files), "transfer_count": len(files), "bytes": total_bytes, "expected_bytes": total_bytes,
+            "missing": [img_id for img_id in image_id_list if img_id not in images]}
+
+def plan_push(path, depth=1):
+    """
+    Plans 'push img-file' (a file) or 'push img-folder' (the files of a folder down to
+    the given depth, as imported with a single OMERO CLI run) from the local file sizes
+    Returns:
+        dict: plan with "files" (list of [path, bytes]), "file_count", "transfer_count" (1), "bytes"
+              and "expected_bytes"
+    """
+
+    files = _list_files(path, depth)
+    total_bytes = sum(file_info[1] for file_info in files)
+
+    return {"operation": "push", "kind": "import", "files": files,
+            "file_count": len(files), "transfer_count": 1, "bytes": total_bytes, "expected_bytes": total_bytes, "missing": []}
+
+def _list_files(path, depth):
+    # same traversal as util_ops.get_path_size
+    if os.path.isfile(path):
+        return [[path, os.path.getsize(path)]]
+
+    if not os.path.isdir(path) or depth < 1:
+        return []
+
+    files = []
+    for name in sorted(os.listdir(path)):
+        files.extend(_list_files(os.path.join(path, name), depth - 1))
+    return files
+
+def get_free_disk_space(path):
+    """
+    Returns the free bytes of the file system holding path (or its nearest existing parent)
+    """
+
+    import shutil
+
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+
+    return shutil.disk_usage(path).free
+
+def format_size(nbytes):
+    """
+    Formats a byte count with binary units, e.g. '1.5 GiB'
+    """
+
+    size = float(nbytes)
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if size < 1024 or unit == "TiB":
+            return (str(int(size)) if unit == "B" else "%.1f" % size) + " " + unit
+        size /= 1024
+
+def format_duration(seconds):
+    """
+    Formats a duration in seconds as e.g. '2h 05m 10s'
+    """
+
+    if seconds < 10:
+        return "%.1fs" % seconds
+
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+
+    if hours > 0:
+        return "%dh %02dm %02ds" % (hours, minutes, seconds)
+    if minutes > 0:
+        return "%dm %02ds" % (minutes, seconds)
+    return "%ds" % seconds
@@ -0,0 +1,209 @@
+import threading
+
+from omero_bifrost.utils.limit_ops import throttle
+from omero_bifrost.utils.trace_ops import trace_span, trace_gateway
+
+
+def connect_gateway(usr, pwd, host, port, session_uuid=None):
+    """
+    Opens a BlitzGateway, either by logging in or by joining an existing session
+
+    Args:
+        usr: The username to log into OMERO
+        pwd: a password associated with the given username
+        host: the OMERO hostname
+        port: the port at which the OMERO server can be reached
+        session_uuid: UUID of an open session to join instead of logging in
+
+    Returns:
+        Connected BlitzGateway to the OMERO Server
+    """
+
+    from omero.gateway import BlitzGateway
+
+    throttle(calls=1)
+
+    if session_uuid is None:
+        with trace_span("connect", "login"):
+            conn = BlitzGateway(usr, pwd, host=host, port=port)
+            connected = conn.connect()
+    else:
+        with trace_span("connect", "join session"):
+            conn = BlitzGateway(host=host, port=port)
+            connected = conn.connect(sUuid=session_uuid)
+
+    if not connected:
+        raise ConnectionError("Connection not available: " + str(host) + ":" + str(port))
+
+    conn.setSecure(True)
+
+    return conn
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of gateways for parallel server access. It logs in once and
+    joins that session with up to 'size' gateways, which are handed out one
+    thread at a time. Gateways idle for longer than 'max_idle' seconds are
+    health-checked before reuse and reconnected if the check fails.
+    Example:
+        pool = ConnectionPool("joe_usr", "joe_pwd", "192.168.2.2", 4064, size=4)
+        with pool.connection() as conn:
+            image = conn.getObject("Image", 1234)
+        pool.close()
+    Args:
+        usr (string): username for the OMERO server
+        pwd (string): password for the OMERO server
+        host (string): OMERO server address
+        port (int): OMERO server port
+        size (int): maximum number of gateways
+        max_idle (float): idle seconds after which a gateway is health-checked
+        gateway_factory (callable): gateway_factory(session_uuid) returns a connected
+                gateway, logging in if session_uuid is None (default: connect_gateway)
+    """
+
+    def __init__(self, usr, pwd, host, port=4064, size=4, max_idle=60, gateway_factory=None):
+        import queue
+
+        if gateway_factory is None:
+            gateway_factory = lambda session_uuid: connect_gateway(usr, pwd, host, port, session_uuid)
+
+        self.size = max(1, size)
+        self.max_idle = max_idle
+        self._gateway_factory = gateway_factory
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+        self._owner = gateway_factory(None)
+        self._session_uuid = self._owner.getEventContext().sessionUuid
+
+    def _new_gateway(self):
+
+        try:
+            return self._gateway_factory(self._session_uuid)
+        except Exception:
+            # the shared session is gone (e.g. timed out): log in again
+            with self._lock:
+                if not self._session_is_alive():
+                    self._owner = self._gateway_factory(None)
+                    self._session_uuid = self._owner.getEventContext().sessionUuid
+            return self._gateway_factory(self._session_uuid)
+
+    def _session_is_alive(self):
+
+        try:
+            return bool(self._owner.keepAlive())
+        except Exception:
+            return False
+
+    def _is_healthy(self, conn):
+
+        try:
+            return bool(conn.keepAlive())
+        except Exception:
+            return False
+
+    def _acquire(self, timeout=None):
+        import time
+        import queue
+
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return self._new_gateway()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            conn, last_used = self._idle.get(timeout=timeout)
+
+        if conn is None:
+            # close() was called: pass the wake-up on to the other waiting threads
+            self._idle.put((None, 0))
+            raise RuntimeError("Connection pool is closed")
+
+        if time.time() - last_used > self.max_idle and not self._is_healthy(conn):
+            self._close_gateway(conn)
+            try:
+                conn = self._new_gateway()
+            except Exception:
+                # free the slot of the dropped gateway, otherwise it is lost for good
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return conn
+
+    def _release(self, conn):
+        import time
+
+        if self._closed:
+            self._close_gateway(conn)
+        else:
+            self._idle.put((conn, time.time()))
+
+    def connection(self, timeout=None):
+        """
+        Context manager handing out a gateway for exclusive use by the calling thread.
+        Blocks up to 'timeout' seconds (None: forever) if all gateways are in use.
+        """
+        from contextlib import contextmanager
+
+        @contextmanager
+        def pooled_connection():
+            conn = self._acquire(timeout)
+            try:
+                yield trace_gateway(conn)
+            finally:
+                self._release(conn)
+
+        return pooled_connection()
+
+    def _close_gateway(self, conn):
+
+        try:
+            conn.close(hard=False) # keep the shared session open
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Closes all idle gateways and the shared session. Gateways still in use
+        are closed when they are handed back, threads waiting for a gateway
+        get a RuntimeError.
+        """
+        import queue
+
+        self._closed = True
+
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                self._close_gateway(conn)
+
+        # wakes up the threads blocked in _acquire
+        self._idle.put((None, 0))
+
+        try:
+            self._owner.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,284 @@
+import threading
+import time
+
+_tracer = None
+
+
+class Tracer(object):
+    """
+    Collects counts, latencies and byte volumes of traced operations, grouped by (kind, name).
+    Kinds used by bifrost: "connect", "gateway", "service", "subprocess" and "io".
+    Args:
+        keep_events (bool): also keep every single span (needed for JSON traces)
+    """
+
+    def __init__(self, keep_events=False):
+        self.start_time = time.time()
+        self.stats = {}
+        self.events = [] if keep_events else None
+        self._lock = threading.Lock()
+
+    def record(self, kind, name, start, seconds, nbytes=0):
+        with self._lock:
+            stat = self.stats.get((kind, name))
+            if stat is None:
+                stat = self.stats[(kind, name)] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0}
+            stat["count"] += 1
+            stat["seconds"] += seconds
+            stat["max_seconds"] = max(stat["max_seconds"], seconds)
+            stat["bytes"] += nbytes
+            if self.events is not None:
+                self.events.append({"kind": kind,
+                                    "name": name,
+                                    "start": round(start - self.start_time, 6),
+                                    "seconds": round(seconds, 6),
+                                    "bytes": nbytes,
+                                    "thread": threading.current_thread().name})
+
+    def summary(self):
+        """
+        Returns:
+            list of dicts: one entry per (kind, name), sorted by total time
+        """
+
+        with self._lock:
+            rows = [dict(stat, kind=kind, name=name) for (kind, name), stat in self.stats.items()]
+
+        return sorted(rows, key=lambda row: row["seconds"], reverse=True)
+
+class _Span(object):
+
+    def __init__(self, kind, name, nbytes):
+        self.kind = kind
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.time()
+        self._start_counter = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        tracer = _tracer
+        if tracer is not None:
+            tracer.record(self.kind, self.name, self.start, time.perf_counter() - self._start_counter, self.nbytes)
+        return False
+
+class _NullSpan(object):
+
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+def trace_span(kind, name, nbytes=0):
+    """
+    Context manager timing one operation. Byte volumes that are only known at the
+    end can be set on the returned span (span.nbytes = ...). When tracing is off
+    a shared no-op object is returned, so the cost is a single global lookup.
+    Example:
+        with trace_span("io", "write TSV") as span:
+            ...
+            span.nbytes = os.path.getsize(path)
+    """
+
+    if _tracer is None:
+        return _NULL_SPAN
+
+    return _Span(kind, name, nbytes)
+
+def trace_bytes(kind, name, nbytes):
+    """
+    Records a byte volume that was not measured inside a span (e.g. the size of an exported file)
+    """
+
+    tracer = _tracer
+    if tracer is not None:
+        tracer.record(kind, name, time.time(), 0.0, nbytes)
+
+def enable_tracing(keep_events=False):
+    """
+    Starts a new trace; all traced operations of the process are recorded from now on
+    """
+
+    global _tracer
+
+    _tracer = Tracer(keep_events)
+
+    return _tracer
+
+def disable_tracing():
+    """
+    Stops tracing and returns the finished Tracer (None if tracing was off)
+    """
+
+    global _tracer
+
+    tracer = _tracer
+    _tracer = None
+
+    return tracer
+
+def is_tracing():
+    return _tracer is not None
+
+########################################
+#gateway instrumentation
+
+class TracedProxy(object):
+    """
+    Wraps a BlitzGateway (or an OMERO service) and traces every method call on it.
+    Services returned by the gateway's get*Service/create*Service methods are wrapped
+    as well, and generators (e.g. from getObjects) are traced until exhausted.
+    """
+
+    def __init__(self, target, kind="gateway", prefix=""):
+        object.__setattr__(self, "_traced_target", target)
+        object.__setattr__(self, "_traced_kind", kind)
+        object.__setattr__(self, "_traced_prefix", prefix)
+
+    def __getattr__(self, name):
+        attr = getattr(self._traced_target, name)
+        if not callable(attr):
+            return attr
+
+        kind = self._traced_kind
+        span_name = self._traced_prefix + name
+
+        def traced_call(*args, **kwargs):
+            with trace_span(kind, span_name):
+                result = attr(*args, **kwargs)
+
+            if _is_generator(result):
+                return _traced_generator(result, kind, span_name + " (iteration)")
+            if kind == "gateway" and name.endswith("Service") and (name.startswith("get") or name.startswith("create")):
+                return TracedProxy(result, "service", name[3 if name.startswith("get") else 6:] + ".")
+            return result
+
+        return traced_call
+
+    def __setattr__(self, name, value):
+        setattr(self._traced_target, name, value)
+
+def _is_generator(obj):
+    import types
+
+    return isinstance(obj, types.GeneratorType)
+
+def _traced_generator(generator, kind, name):
+
+    start = time.time()
+    seconds = 0.0
+
+    try:
+        while True:
+            step_start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                seconds += time.perf_counter() - step_start
+                break
+            seconds += time.perf_counter() - step_start
+            yield item
+    finally:
+        tracer = _tracer
+        if tracer is not None:
+            tracer.record(kind, name, start, seconds)
+
+def trace_gateway(conn):
+    """
+    Returns conn wrapped in a TracedProxy if tracing is on, conn itself otherwise
+    """
+
+    if _tracer is None or isinstance(conn, TracedProxy):
+        return conn
+
+    return TracedProxy(conn)
+
+def untrace_gateway(conn):
+    """
+    Returns the gateway wrapped by trace_gateway
+    """
+
+    if isinstance(conn, TracedProxy):
+        return object.__getattribute__(conn, "_traced_target")
+
+    return conn
+
+########################################
+#reports
+
+def format_trace_table(tracer):
+    """
+    Builds a rich Table summarizing a trace
+    """
+
+    from rich.table import Table
+
+    table = Table(title="omero-bifrost profile (" + str(round(time.time() - tracer.start_time, 3)) + "s wall time)",
+                  show_header=True, header_style="bold blue")
+    table.add_column("Kind")
+    table.add_column("Operation", style="green")
+    table.add_column("Count", justify="right")
+    table.add_column("Total s", justify="right")
+    table.add_column("Mean ms", justify="right")
+    table.add_column("Max ms", justify="right")
+    table.add_column("Bytes", justify="right")
+
+    for row in tracer.summary():
+        table.add_row(row["kind"],
+                      row["name"],
+                      str(row["count"]),
+                      "%.3f" % row["seconds"],
+                      "%.1f" % (1000.0 * row["seconds"] / row["count"]),
+                      "%.1f" % (1000.0 * row["max_seconds"]),
+                      str(row["bytes"]))
+
+    return table
+
+def write_trace_json(tracer, file_path):
+    """
+    Writes the summary and (if kept) every span of a trace to a JSON file
+    """
+
+    import json
+
+    with open(file_path, "w") as json_file:
+        json.dump({"start_time": tracer.start_time,
+                   "wall_seconds": time.time() - tracer.start_time,
+                   "summary": tracer.summary(),
+                   "spans": tracer.events or []}, json_file, indent=1)
+
+def write_trace_prometheus(tracer, file_path):
+    """
+    Writes a trace summary in the Prometheus text format, e.g. for the node exporter's
+    textfile collector. The file is replaced atomically.
+    """
+
+    import os
+
+    def labels(row):
+        escape = lambda value: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+        return '{kind="' + escape(row["kind"]) + '",operation="' + escape(row["name"]) + '"}'
+
+    rows = tracer.summary()
+    lines = ["# HELP omero_bifrost_operations_total Number of traced operations.",
+             "# TYPE omero_bifrost_operations_total counter"]
+    lines.extend("omero_bifrost_operations_total" + labels(row) + " " + str(row["count"]) for row in rows)
+    lines.extend(["# HELP omero_bifrost_operation_seconds_total Time spent in traced operations.",
+                  "# TYPE omero_bifrost_operation_seconds_total counter"])
+    lines.extend("omero_bifrost_operation_seconds_total" + labels(row) + " " + repr(row["seconds"]) for row in rows)
+    lines.extend(["# HELP omero_bifrost_operation_bytes_total Bytes moved by traced operations.",
+                  "# TYPE omero_bifrost_operation_bytes_total counter"])
+    lines.extend("omero_bifrost_operation_bytes_total" + labels(row) + " " + str(row["bytes"]) for row in rows)
+
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w") as prom_file:
+        prom_file.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, file_path)
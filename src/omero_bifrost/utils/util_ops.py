@@ -1,3 +1,15 @@
+import threading
+
+from omero_bifrost.utils.limit_ops import load_transfer_limits, throttle
+from omero_bifrost.utils.trace_ops import trace_span, trace_gateway, untrace_gateway
+
+_session_cache = None
+_session_registry = []
+_session_lock = threading.Lock()
+_cli_command = None
+
+OUTPUT_FORMATS = ["xml", "xml-stream", "tsv", "jsonl"]
+
 
 def get_omero_config(config_file_path):
 
@@ -11,6 +23,8 @@ def get_omero_config(config_file_path):
     omero_host = config.get('OmeroServerSection', 'omero.host')
     omero_port = int(config.get('OmeroServerSection', 'omero.port'))
 
+    load_transfer_limits(config)
+
     return omero_username, omero_password, omero_host, omero_port
 
 def format_xml_ouput(output_map):
@@ -30,9 +44,142 @@ def format_xml_ouput(output_map):
 
     return xml_tree
 
+def write_xml(items, out):
+    """
+    Writes output items as XML in the format of format_xml_ouput, with the item count as
+    root attribute. The items are collected first since the count precedes them
+    (see write_xml_stream)
+    Args:
+        items (iterable of dicts): output items, e.g. {"type": "image", "name": "img_1", "id": "101"}
+        out: writable text stream
+    Returns:
+        int: number of items written
+    """
+
+    import xml.etree.ElementTree as ET
+
+    items = list(items)
+
+    output_root_element = ET.Element('omero-bifrost-output')
+    output_root_element.attrib = {"size": str(len(items))}
+    for index, item in enumerate(items):
+        output_element = ET.SubElement(output_root_element, "output-item")
+        output_element.attrib = dict([("index", str(index))] + [(key, str(value)) for key, value in item.items()])
+
+    ET.ElementTree(output_root_element).write(out, encoding="unicode")
+
+    return len(items)
+
+def write_xml_stream(items, out):
+    """
+    Writes output items as XML, one element at a time, without building a tree in memory
+    (output format "xml-stream"). Same items as write_xml, except that the item count is
+    written at the end as <output-summary size="n"/> instead of as a root attribute.
+    Args:
+        items (iterable of dicts): output items, e.g. {"type": "image", "name": "img_1", "id": "101"}
+        out: writable text stream
+    Returns:
+        int: number of items written
+    """
+
+    from xml.sax.saxutils import quoteattr
+
+    count = 0
+
+    out.write("<omero-bifrost-output>\n")
+    for item in items:
+        out.write('<output-item index="' + str(count) + '"')
+        for key, value in item.items():
+            out.write(" " + key + "=" + quoteattr(str(value)))
+        out.write(" />\n")
+        count += 1
+    out.write('<output-summary size="' + str(count) + '" /></omero-bifrost-output>\n')
+
+    return count
+
+def write_tsv_stream(items, out, columns, header=None):
+    """
+    Writes output items as TSV rows, one row at a time
+    Args:
+        items (iterable of dicts): output items
+        out: writable text stream
+        columns (list of strings): item keys to write, in column order
+        header (list of strings): header row (default: the column keys)
+    Returns:
+        int: number of items written
+    """
+
+    import csv
+
+    count = 0
+
+    writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+    writer.writerow(header or columns)
+    for item in items:
+        writer.writerow([item[column] for column in columns])
+        count += 1
+
+    return count
+
+def write_jsonl_stream(items, out):
+    """
+    Writes output items as JSON lines, one object per line
+    Returns:
+        int: number of items written
+    """
+
+    import json
+
+    count = 0
+
+    for item in items:
+        out.write(json.dumps(item) + "\n")
+        count += 1
+
+    return count
+
+def write_output_stream(items, output_path, output_format, columns, header=None):
+    """
+    Writes output items in the given format to a file, or to standard output if output_path
+    is '-' (plain text, no rich markup). xml-stream, tsv and jsonl are written incrementally,
+    xml collects the items first (see write_xml)
+    Returns:
+        int: number of items written
+    """
+
+    import sys
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format: " + str(output_format))
+
+    with trace_span("io", "write " + output_format.upper()):
+        if output_path == "-":
+            out = sys.stdout
+        else:
+            out = open(output_path, "w", newline="")
+
+        try:
+            if output_format == "xml":
+                count = write_xml(items, out)
+            elif output_format == "xml-stream":
+                count = write_xml_stream(items, out)
+            elif output_format == "tsv":
+                count = write_tsv_stream(items, out, columns, header)
+            else:
+                count = write_jsonl_stream(items, out)
+            out.flush()
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+    return count
+
 def omero_connect(usr, pwd, host, port):
     """
     Connects to the OMERO Server with the provided username and password.
+    If the session cache is enabled (see enable_session_cache) an open gateway
+    for the same credentials is reused instead of logging in again.
+    If tracing is on, the gateway is wrapped to trace all calls made on it.
 
     Args:
         usr: The username to log into OMERO
@@ -46,14 +193,328 @@ def omero_connect(usr, pwd, host, port):
     """
     from omero.gateway import BlitzGateway
 
-    conn = BlitzGateway(usr, pwd, host=host, port=port)
-    connected = conn.connect()
-    conn.setSecure(True)
+    throttle(calls=1)
+
+    cache_key = (usr, pwd, host, str(port))
+    if _session_cache is not None:
+        cached_conns = _get_thread_sessions()
+        conn = cached_conns.get(cache_key)
+        if conn is not None:
+            try:
+                if conn.keepAlive():
+                    return trace_gateway(conn)
+            except Exception:
+                pass
+            del cached_conns[cache_key]
+            _forget_session(conn)
+
+    with trace_span("connect", "omero_connect"):
+        conn = BlitzGateway(usr, pwd, host=host, port=port)
+        connected = conn.connect()
+        conn.setSecure(True)
 
     if not connected:
         print("Error: Connection not available")
+    elif _session_cache is not None:
+        _get_thread_sessions()[cache_key] = conn
+        with _session_lock:
+            _session_registry.append(conn)
+
+    return trace_gateway(conn)
+
+def omero_close(conn):
+    """
+    Closes a gateway returned by omero_connect, unless it is kept open
+    by the session cache for later reuse.
+
+    Args:
+        conn: Established Connection to the OMERO Server via a BlitzGateway
+    """
+
+    conn = untrace_gateway(conn)
+
+    with _session_lock:
+        if any(cached is conn for cached in _session_registry):
+            return
+
+    conn.close()
+
+def enable_session_cache():
+    """
+    Makes omero_connect keep its gateways open and reuse them for later calls
+    with the same credentials. Each thread gets its own gateway, since a
+    BlitzGateway must not be shared between threads.
+    Used by long-running processes (e.g. the bifrost daemon).
+
+    Returns:
+        bool: True if the cache was enabled by this call, False if it already was
+    """
+
+    global _session_cache
+
+    if _session_cache is not None:
+        return False
+
+    _session_cache = threading.local()
+
+    return True
+
+def close_cached_sessions():
+    """
+    Closes all gateways kept open by the session cache (in all threads).
+    """
+
+    with _session_lock:
+        conns = list(_session_registry)
+        del _session_registry[:]
+
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def close_thread_sessions():
+    """
+    Closes the gateways kept open by the session cache for the calling thread,
+    e.g. in a worker thread that ends before the cache does
+    """
+
+    if _session_cache is None:
+        return
+
+    cached_conns = _get_thread_sessions()
+    conns = list(cached_conns.values())
+    cached_conns.clear()
+
+    for conn in conns:
+        _forget_session(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def _get_thread_sessions():
+
+    if not hasattr(_session_cache, "conns"):
+        _session_cache.conns = {}
+
+    return _session_cache.conns
+
+def _forget_session(conn):
+
+    with _session_lock:
+        for i, cached in enumerate(_session_registry):
+            if cached is conn:
+                del _session_registry[i]
+                break
+
+def invoke_cli_command(argv, std_out=None, std_err=None):
+    """
+    Runs an omero-bifrost command line inside the current process and
+    captures everything it prints. Output is captured per thread, so several
+    commands can run concurrently from different threads.
+
+    Example:
+        exit_code, std_out, std_err = invoke_cli_command(["query", "dataset-id", "proj", "ds"])
+    Args:
+        argv (list of strings): command line arguments, without the program name
+        std_out, std_err: optional text streams receiving the output as it is
+                written, instead of capturing it in memory
+    Returns:
+        int, string, string: exit code, captured standard output and standard error
+                (empty for output sent to the given streams)
+    """
+
+    import io
+    import sys
+    import traceback
+    import click
+    import typer
+
+    from omero_bifrost.cli import app
+
+    global _cli_command
+
+    if _cli_command is None:
+        _cli_command = typer.main.get_command(app)
+
+    with _session_lock:
+        if not isinstance(sys.stdout, _OutputRouter):
+            sys.stdout = _OutputRouter(sys.stdout)
+        if not isinstance(sys.stderr, _OutputRouter):
+            sys.stderr = _OutputRouter(sys.stderr)
+        out_router, err_router = sys.stdout, sys.stderr
+
+    capture_out = std_out is None
+    capture_err = std_err is None
+    if capture_out:
+        std_out = io.StringIO()
+    if capture_err:
+        std_err = io.StringIO()
+    out_router.capture(std_out)
+    err_router.capture(std_err)
+
+    try:
+        result = _cli_command.main(args=list(argv), prog_name="omero-bifrost", standalone_mode=False)
+        exit_code = result if isinstance(result, int) else 0
+    except click.exceptions.ClickException as e:
+        e.show(file=std_err)
+        exit_code = e.exit_code
+    except click.exceptions.Abort:
+        std_err.write("Aborted!\n")
+        exit_code = 1
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            std_err.write(str(e.code) + "\n")
+            exit_code = 1
+    except Exception:
+        traceback.print_exc(file=std_err)
+        exit_code = 1
+    finally:
+        out_router.release()
+        err_router.release()
+
+    return exit_code, std_out.getvalue() if capture_out else "", std_err.getvalue() if capture_err else ""
+
+class _OutputRouter(object):
+    """
+    Stand-in for sys.stdout/sys.stderr that sends writes of a capturing
+    thread to its own buffer and everything else to the original stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, buffer):
+        self._local.buffer = buffer
+
+    def release(self):
+        self._local.buffer = None
+
+    def _target(self):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            return self._stream
+        return buffer
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self):
+        return self._target().isatty()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+def get_omero_cli_cmd(action, usr, pwd, host, port=4064):
+    """
+    Builds the start of an OMERO CLI command line, including the login arguments
+    Example:
+        get_omero_cli_cmd("tag create", "joe_usr", "joe_pwd", "192.168.2.2") + " --name tag1"
+    Args:
+        action (string): the OMERO CLI subcommand, e.g. "import" or "tag link"
+        usr (string): username for the OMERO server
+        pwd (string): password for the OMERO server
+        host (string): OMERO server address
+        port (int): OMERO server port
+    Returns:
+        string: the command line
+    """
+
+    return "omero " + action + " -s " + host + " -p " + str(port) + " -u " + usr + " -w " + pwd
+
+def run_omero_cmd(cmd, nbytes=0):
+    """
+    Runs an OMERO CLI command line (see get_omero_cli_cmd) and waits for it to finish
+    Args:
+        cmd (string): the command line
+        nbytes (int): bytes the command uploads, accounted for by the transfer limiter
+    Returns:
+        int, string, string: return code, standard output and standard error of the command
+    """
+
+    import subprocess
+
+    throttle(calls=1, nbytes=nbytes)
+
+    with trace_span("subprocess", cmd.split(" -s ")[0], nbytes):
+        proc = subprocess.Popen(cmd,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            shell=True,
+                            universal_newlines=True)
+
+        std_out, std_err = proc.communicate()
+
+    return int(proc.returncode), std_out, std_err
+
+def open_omero_cmd_stream(cmd):
+    """
+    Starts an OMERO CLI command line whose result is written to its standard output
+    (e.g. "omero export --file - ..."), for the caller to read from proc.stdout
+    Returns:
+        Popen, file: the running process and a temporary file collecting its standard error
+    """
+
+    import subprocess
+    import tempfile
+
+    throttle(calls=1)
+
+    std_err_file = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd,
+                        stdout=subprocess.PIPE,
+                        stderr=std_err_file,
+                        shell=True)
+
+    return proc, std_err_file
+
+def parse_omero_cli_ids(std_out, prefix, first_only=True):
+    """
+    Collects object IDs from OMERO CLI output lines of the form "Prefix:id_1,id_2,...,id_n"
+    Example:
+        parse_omero_cli_ids("...\nImage:101,102\n", "Image:") -> ["101", "102"]
+    Args:
+        std_out (string): standard output of an OMERO CLI command
+        prefix (string): the line prefix, e.g. "Image:" or "TagAnnotation:"
+        first_only (bool): stop at the first matching line
+    Returns:
+        list of strings: the IDs found
+    """
+
+    ids = []
+
+    for line in std_out.splitlines():
+        if line[:len(prefix)] == prefix:
+            ids.extend(line[len(prefix):].split(','))
+            if first_only:
+                break
+
+    return ids
+
+def get_path_size(path, depth=0):
+    """
+    Returns the size in bytes of a file, or of the files in a folder down to the given depth (0 if the path does not exist)
+    """
+
+    import os
+
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    if not os.path.isdir(path) or depth < 1:
+        return 0
 
-    return conn
+    return sum(get_path_size(os.path.join(path, name), depth - 1) for name in os.listdir(path))
 
 def img_map_from_tsv(tsv_file_path):
     import csv
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# run against the source tree and the fakes of the benchmark suite without installing the package
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+sys.path.insert(0, ROOT_DIR)
@@ -0,0 +1,47 @@
+import os
+import asyncio
+
+from omero_bifrost.aio import aio_ops
+from omero_bifrost.aio.aio_ops import OperationScheduler, export_ome_tiff_file, download_original_image_file
+
+FAKE_OMERO_BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "bin")
+
+
+def use_fake_omero(monkeypatch):
+    monkeypatch.setenv("PATH", FAKE_OMERO_BIN + os.pathsep + os.environ.get("PATH", ""))
+    monkeypatch.setenv("FAKE_OMERO_STARTUP", "0")
+    monkeypatch.setenv("FAKE_OMERO_EXPORT_BYTES", "1000")
+
+
+def test_pulls_run_on_the_running_loop(tmp_path, monkeypatch):
+    use_fake_omero(monkeypatch)
+    throttled = []
+    monkeypatch.setattr(aio_ops, "throttle", lambda calls=0, nbytes=0: throttled.append(nbytes))
+
+    async def pull():
+        scheduler = OperationScheduler()
+        await asyncio.gather(export_ome_tiff_file(1, str(tmp_path / "img_"), "u", "p", "h", scheduler=scheduler),
+                             download_original_image_file(2, str(tmp_path / "file.nd2"), "u", "p", "h", scheduler=scheduler))
+
+    asyncio.run(pull())
+
+    assert os.path.exists(str(tmp_path / "img_ome.tiff"))
+    assert sorted(nbytes for nbytes in throttled if nbytes > 0) == [1000, 1000]
+
+def test_transfers_are_recorded(tmp_path, monkeypatch):
+    use_fake_omero(monkeypatch)
+    transfers = []
+    monkeypatch.setattr(aio_ops, "record_transfer", lambda kind, nbytes, seconds: transfers.append((kind, nbytes)))
+
+    image_path = tmp_path / "img.nd2"
+    image_path.write_bytes(b"x" * 300)
+
+    async def transfer():
+        scheduler = OperationScheduler()
+        await asyncio.gather(export_ome_tiff_file(1, str(tmp_path / "img_"), "u", "p", "h", scheduler=scheduler),
+                             download_original_image_file(2, str(tmp_path / "file.nd2"), "u", "p", "h", scheduler=scheduler),
+                             aio_ops.register_image_file_with_dataset_id(str(image_path), 3, "u", "p", "h", scheduler=scheduler))
+
+    asyncio.run(transfer())
+
+    assert sorted(transfers) == [("download", 1000), ("export", 1000), ("import", 300)]
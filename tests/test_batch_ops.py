@@ -0,0 +1,77 @@
+import io
+import json
+
+import pytest
+
+from omero_bifrost.batch.batch_ops import read_batch_file, group_batch_ops
+
+
+def write_ops(tmp_path, lines):
+    path = tmp_path / "ops.jsonl"
+    path.write_text("\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines) + "\n")
+    return str(path)
+
+
+def test_read_batch_file(tmp_path):
+    path = write_ops(tmp_path, ["# comment", "",
+                                {"command": "push img-tag", "args": ["1", "tag a"], "group": "img_1"},
+                                {"argv": ["query", "list-all"]}])
+
+    ops = read_batch_file(path)
+
+    assert ops == [{"line": 3, "argv": ["push", "img-tag", "1", "tag a"], "group": "img_1"},
+                   {"line": 4, "argv": ["query", "list-all"], "group": None}]
+
+@pytest.mark.parametrize("command", ["batch", "serve"])
+def test_read_batch_file_rejects_nested_commands(tmp_path, command):
+    path = write_ops(tmp_path, [{"command": command, "args": ["ops.jsonl"]}])
+
+    with pytest.raises(ValueError):
+        read_batch_file(path)
+
+def test_group_batch_ops_keeps_group_order():
+    ops = [{"line": 1, "argv": ["a"], "group": "x"},
+           {"line": 2, "argv": ["b"], "group": None},
+           {"line": 3, "argv": ["c"], "group": "y"},
+           {"line": 4, "argv": ["d"], "group": "x"},
+           {"line": 5, "argv": ["e"], "group": None}]
+
+    groups = group_batch_ops(ops)
+
+    assert [[op["line"] for op in group] for group in groups] == [[1, 4], [2], [3], [5]]
+
+def test_batch_closes_worker_gateways_of_a_longer_lived_session_cache(tmp_path, monkeypatch):
+    from benchmarks.fake_gateway import FakeServer, FakeGateway
+    from omero_bifrost import cli
+    from omero_bifrost.utils import util_ops
+    from omero_bifrost.batch.batch_ops import run_batch
+
+    server = FakeServer(n_projects=1, n_datasets=1, n_images=1)
+    gateways = []
+
+    def cached_connect(usr, pwd, host, port):
+        # the session cache path of util_ops.omero_connect
+        sessions = util_ops._get_thread_sessions()
+        if "conn" not in sessions:
+            sessions["conn"] = FakeGateway(server)
+            gateways.append(sessions["conn"])
+            with util_ops._session_lock:
+                util_ops._session_registry.append(sessions["conn"])
+        return sessions["conn"]
+
+    monkeypatch.setattr(cli, "omero_connect", cached_connect)
+    monkeypatch.setattr(util_ops, "_session_cache", None)
+    config_path = tmp_path / "config.properties"
+    config_path.write_text("[OmeroServerSection]\nomero.username = u\nomero.password = p\nomero.host = h\nomero.port = 4064\n")
+    ops_path = write_ops(tmp_path, [{"command": "query list-all", "args": ["--to-file", "-o", str(tmp_path / ("out" + str(i) + ".xml"))]}
+                                    for i in range(6)])
+
+    util_ops.enable_session_cache() # e.g. by the daemon
+    try:
+        assert run_batch(ops_path, io.StringIO(), str(config_path), parallel=3) == 0
+
+        assert 1 <= len(gateways) <= 3
+        assert all(gateway.closed for gateway in gateways)
+        assert util_ops._session_registry == []
+    finally:
+        util_ops.close_cached_sessions()
@@ -0,0 +1,66 @@
+import pytest
+
+from omero_bifrost.hcs.hcs_ops import _parse_well, get_well_name, select_fields
+
+
+def make_layout(rows=3, columns=4, fields=2):
+    layout = []
+    for row in range(rows):
+        for column in range(columns):
+            for field in range(fields):
+                layout.append({"image_id": len(layout) + 1, "well": get_well_name(row, column),
+                               "row": row, "column": column, "field": field, "well_id": row * columns + column})
+    return layout
+
+def selected_wells(entries):
+    return sorted(set(entry["well"] for entry in entries))
+
+
+def test_get_well_name():
+    assert get_well_name(1, 2) == "B03"
+    assert get_well_name(25, 11) == "Z12"
+    assert get_well_name(26, 0) == "AA01"
+    assert get_well_name(1, 2, "number", "number") == "203"
+
+def test_parse_well():
+    assert _parse_well("B03") == (1, 2)
+    assert _parse_well("b3") == (1, 2)
+    assert _parse_well("AA1") == (26, 0)
+    assert _parse_well("1, 2") == (1, 2)
+    assert _parse_well("C") == (2, None)
+    assert _parse_well("4") == (None, 3)
+
+@pytest.mark.parametrize("well_spec", ["", "B?", "3B", "1,2,3"])
+def test_parse_well_rejects_invalid_names(well_spec):
+    with pytest.raises(ValueError):
+        _parse_well(well_spec)
+
+def test_select_all_fields():
+    layout = make_layout()
+
+    assert select_fields(layout) == layout
+    assert select_fields(layout, [], []) == layout
+
+def test_select_wells_by_name_position_row_and_column():
+    layout = make_layout()
+
+    assert selected_wells(select_fields(layout, ["B03"])) == ["B03"]
+    assert selected_wells(select_fields(layout, ["0,0"])) == ["A01"]
+    assert selected_wells(select_fields(layout, ["C"])) == ["C01", "C02", "C03", "C04"]
+    assert selected_wells(select_fields(layout, ["4"])) == ["A04", "B04", "C04"]
+
+def test_select_well_range_in_any_corner_order():
+    layout = make_layout()
+
+    expected = ["A02", "A03", "B02", "B03"]
+    assert selected_wells(select_fields(layout, ["A02:B03"])) == expected
+    assert selected_wells(select_fields(layout, ["B02:A03"])) == expected
+
+def test_select_fields_by_index():
+    selection = select_fields(make_layout(), ["A01", "B02"], [1])
+
+    assert [(entry["well"], entry["field"]) for entry in selection] == [("A01", 1), ("B02", 1)]
+
+def test_select_rejects_open_ranges():
+    with pytest.raises(ValueError):
+        select_fields(make_layout(), ["A:B03"])
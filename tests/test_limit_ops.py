@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from omero_bifrost.utils.limit_ops import TokenBucket, TransferLimiter, parse_size, parse_limit_profiles
+
+
+def test_parse_size():
+    assert parse_size("") == 0
+    assert parse_size("0") == 0
+    assert parse_size("1500") == 1500
+    assert parse_size("50M") == 50 * 1024 ** 2
+    assert parse_size("1.5k") == 1536
+    assert parse_size("2GB") == 2 * 1024 ** 3
+
+def test_parse_limit_profiles():
+    profiles = parse_limit_profiles("08:00-20:00=20M/10; 20:00-08:00=0/0;")
+
+    assert profiles == [(8 * 60, 20 * 60, 20 * 1024 ** 2, 10.0),
+                        (20 * 60, 8 * 60, 0, 0.0)]
+
+def test_parse_limit_profiles_rejects_malformed_windows():
+    with pytest.raises(ValueError):
+        parse_limit_profiles("08:00=20M/10")
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+
+    assert bucket.reserve(10 ** 12) == 0.0
+
+def test_token_bucket_burst_then_debt():
+    bucket = TokenBucket(10)
+
+    assert bucket.reserve(10) == 0.0 # one second worth of burst
+    assert bucket.reserve(5) == pytest.approx(0.5, abs=0.05)
+    assert bucket.reserve(5) == pytest.approx(1.0, abs=0.05)
+
+def test_limiter_profile_overrides_default_rates():
+    now = time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    limiter = TransferLimiter(100, 1, [((minute - 1) % 1440, (minute + 2) % 1440, 7, 3)])
+
+    assert limiter.current_rates() == (7, 3)
+
+    limiter = TransferLimiter(100, 1, [((minute + 2) % 1440, (minute + 3) % 1440, 7, 3)])
+    assert limiter.current_rates() == (100, 1)
+
+def test_limiter_report_counts_throttled_waits():
+    limiter = TransferLimiter(0, 100)
+
+    start = time.monotonic()
+    for _ in range(110):
+        limiter.throttle(calls=1)
+    elapsed = time.monotonic() - start
+
+    report = limiter.report()
+    assert report["calls"] == 110
+    assert report["throttled_count"] > 0
+    assert elapsed >= 0.05
+
+def test_command_line_limits_are_restored_after_the_invocation():
+    import configparser
+    from omero_bifrost.utils import limit_ops
+
+    config = configparser.RawConfigParser()
+    config.read_string("[TransferLimitSection]\nlimit.bytes_per_sec = 10M\n")
+
+    limit_ops.load_transfer_limits(config)
+    config_limiter = limit_ops._limiter
+    config_limiter.throttle(calls=1)
+
+    state = limit_ops.save_transfer_limits()
+    assert limit_ops.get_throttle_report()["calls"] == 0
+
+    limit_ops.configure_transfer_limits(1024, 5, source="cli")
+    limit_ops.load_transfer_limits(config) # the command line wins within the invocation
+    assert limit_ops._limiter.settings == (1024, 5, [])
+
+    limit_ops.restore_transfer_limits(state)
+    assert limit_ops._limiter is config_limiter
+    limit_ops.load_transfer_limits(config)
+    assert limit_ops._limiter is config_limiter
+
+    limit_ops.restore_transfer_limits((None, None))
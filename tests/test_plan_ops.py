@@ -0,0 +1,47 @@
+import pytest
+
+from omero_bifrost.utils.plan_ops import (estimate_duration, record_transfer, save_throughput_history,
+                                          load_throughput_history, plan_push, format_size, format_duration)
+
+
+def test_estimate_without_history():
+    assert estimate_duration("export", 3, 1000, history={}) is None
+
+def test_estimate_fits_cost_per_transfer_and_per_byte():
+    # 2 s start-up per run plus 1 s per MB
+    history = {"download": [[0, 2.0], [10 ** 6, 3.0], [4 * 10 ** 6, 6.0]]}
+
+    assert estimate_duration("download", 10, 5 * 10 ** 6, history) == pytest.approx(25.0)
+
+def test_estimate_scales_average_rate_without_size_spread():
+    history = {"import": [[10 ** 6, 2.0], [10 ** 6, 4.0]]}
+
+    assert estimate_duration("import", 1, 3 * 10 ** 6, history) == pytest.approx(9.0)
+
+def test_throughput_history_round_trip(tmp_path):
+    path = str(tmp_path / "throughput.json")
+
+    record_transfer("export", 100, 1.5)
+    record_transfer("export", 200, 2.5)
+
+    assert save_throughput_history(path)
+    assert load_throughput_history(path) == {"export": [[100, 1.5], [200, 2.5]]}
+    assert not save_throughput_history(path) # nothing new recorded
+
+def test_plan_push_follows_import_depth(tmp_path):
+    (tmp_path / "a.nd2").write_bytes(b"x" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.nd2").write_bytes(b"x" * 5)
+
+    plan = plan_push(str(tmp_path), depth=1)
+    assert (plan["file_count"], plan["bytes"], plan["transfer_count"]) == (1, 10, 1)
+
+    plan = plan_push(str(tmp_path), depth=2)
+    assert (plan["file_count"], plan["bytes"]) == (2, 15)
+
+def test_format_size_and_duration():
+    assert format_size(512) == "512 B"
+    assert format_size(1536) == "1.5 KiB"
+    assert format_duration(0.25) == "0.2s"
+    assert format_duration(125) == "2m 05s"
+    assert format_duration(7322) == "2h 02m 02s"
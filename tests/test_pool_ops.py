@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_gateway import FakeServer, FakeGateway, fake_gateway_factory
+from omero_bifrost.utils.pool_ops import ConnectionPool
+
+
+class FlakyGateway(FakeGateway):
+
+    def __init__(self, server, state):
+        FakeGateway.__init__(self, server)
+        self._state = state
+
+    def keepAlive(self):
+        return not self._state["down"] and not self.closed
+
+def flaky_factory(server, state):
+    def factory(session_uuid):
+        if state["down"] and session_uuid is not None:
+            raise ConnectionError("server down")
+        return FlakyGateway(server, state)
+    return factory
+
+
+def test_connection_reuses_gateways():
+    pool = ConnectionPool("usr", "pwd", "host", size=2, gateway_factory=fake_gateway_factory(FakeServer()))
+
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        second = conn
+
+    assert pool._created == 1
+    assert first.getEventContext().sessionUuid == second.getEventContext().sessionUuid
+    pool.close()
+
+def test_exhausted_pool_times_out():
+    pool = ConnectionPool("usr", "pwd", "host", size=1, gateway_factory=fake_gateway_factory(FakeServer()))
+
+    with pool.connection():
+        with pytest.raises(queue.Empty):
+            with pool.connection(timeout=0.05):
+                pass
+
+    with pool.connection(timeout=0.05):
+        pass
+    pool.close()
+
+def test_exhausted_pool_hands_over_released_gateway():
+    pool = ConnectionPool("usr", "pwd", "host", size=1, gateway_factory=fake_gateway_factory(FakeServer()))
+    acquired = []
+
+    def worker():
+        with pool.connection(timeout=2):
+            acquired.append(True)
+
+    with pool.connection():
+        thread = threading.Thread(target=worker)
+        thread.start()
+        time.sleep(0.05)
+        assert acquired == []
+
+    thread.join(2)
+    assert acquired == [True]
+    pool.close()
+
+def test_unhealthy_gateway_is_replaced():
+    state = {"down": False}
+    pool = ConnectionPool("usr", "pwd", "host", size=1, max_idle=0, gateway_factory=flaky_factory(FakeServer(), state))
+
+    with pool.connection():
+        pass
+    time.sleep(0.01)
+    old_gateway = pool._idle.queue[-1][0]
+    old_gateway.closed = True # fails its health check
+
+    with pool.connection() as conn:
+        assert conn is not old_gateway
+    assert pool._created == 1
+    pool.close()
+
+def test_failed_reconnect_frees_the_slot():
+    state = {"down": False}
+    pool = ConnectionPool("usr", "pwd", "host", size=1, max_idle=0, gateway_factory=flaky_factory(FakeServer(), state))
+
+    with pool.connection():
+        pass
+    time.sleep(0.01)
+    state["down"] = True
+
+    with pytest.raises(ConnectionError):
+        with pool.connection(timeout=1):
+            pass
+    assert pool._created == 0
+
+    state["down"] = False
+    with pool.connection(timeout=1) as conn:
+        assert conn.keepAlive()
+    pool.close()
+
+def test_close_wakes_waiting_threads():
+    pool = ConnectionPool("usr", "pwd", "host", size=1, gateway_factory=fake_gateway_factory(FakeServer()))
+    errors = []
+
+    def worker():
+        try:
+            with pool.connection():
+                pass
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    with pool.connection():
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        pool.close()
+        for thread in threads:
+            thread.join(2)
+
+    assert errors == ["Connection pool is closed"] * 3
+    assert not any(thread.is_alive() for thread in threads)
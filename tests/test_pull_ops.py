@@ -0,0 +1,269 @@
+import os
+import pytest
+
+from omero_bifrost.pull import pull_ops
+from omero_bifrost.pull.pull_ops import get_export_path, get_export_cmd, export_ome_tiff_file
+
+
+def test_get_export_path():
+    assert get_export_path("out/img.ome.tiff") == "out/img.ome.tiff"
+    assert get_export_path("out/img.tif") == "out/img.tif"
+    assert get_export_path("out/img_") == "out/img_ome.tiff"
+    assert get_export_path("-") == "-"
+
+def test_get_export_cmd_writes_to_the_export_path():
+    assert " --file out/img_ome.tiff " in get_export_cmd(5, "out/img_", "u", "p", "h")
+
+def test_export_measures_the_written_file(tmp_path, monkeypatch):
+    download_path = str(tmp_path / "img_")
+    transfers = []
+
+    def fake_run(cmd):
+        with open(get_export_path(download_path), "wb") as file:
+            file.write(b"x" * 100)
+        return 0, "", ""
+
+    monkeypatch.setattr(pull_ops, "run_omero_cmd", fake_run)
+    monkeypatch.setattr(pull_ops, "record_transfer", lambda kind, nbytes, seconds: transfers.append((kind, nbytes)))
+
+    export_ome_tiff_file(5, download_path, "u", "p", "h")
+
+    assert os.path.exists(download_path + "ome.tiff")
+    assert transfers == [("export", 100)]
+
+def read_bundle(path, bundle_format):
+    # archive entry name -> content
+    import tarfile
+    import zipfile
+
+    if bundle_format == "zip":
+        with zipfile.ZipFile(path) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+
+    with tarfile.open(path) as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+
+def parse_manifest(data):
+    lines = data.decode("utf-8").splitlines()
+    assert lines[0] == "OMERO_IMG_ID\tOMERO_FILE_ID\tNAME\tBYTES\tSHA256\tSTATUS"
+    return [line.split("\t") for line in lines[1:]]
+
+def test_sized_reader():
+    import io
+
+    reader = pull_ops._SizedReader(io.BytesIO(b"abcdef"), 6)
+    assert reader.read(4) + reader.read() == b"abcdef"
+    reader.check_end()
+    assert not reader.mismatch
+
+    # a short stream is padded with zeros
+    reader = pull_ops._SizedReader(io.BytesIO(b"abc"), 6)
+    assert reader.read() == b"abc\0\0\0"
+    assert reader.read() == b""
+    assert reader.mismatch
+
+    # extra data is only read by check_end
+    reader = pull_ops._SizedReader(io.BytesIO(b"abcdefgh"), 6)
+    assert reader.read() == b"abcdef"
+    assert not reader.mismatch
+    reader.check_end()
+    assert reader.mismatch
+
+@pytest.mark.parametrize("bundle_format", ["tar", "tar.gz", "zip"])
+def test_export_bundle(tmp_path, bundle_format):
+    import io
+    import hashlib
+
+    path = str(tmp_path / ("bundle." + bundle_format))
+    bundle = pull_ops.ExportBundle(path, bundle_format)
+
+    bundle.add_stream("exact.bin", io.BytesIO(b"x" * 10), size=10, image_id=1, file_id=11)
+    bundle.add_stream("short.bin", io.BytesIO(b"x" * 5), size=10, image_id=2, file_id=12)
+    bundle.add_stream("long.bin", io.BytesIO(b"x" * 15), size=10, image_id=3)
+    bundle.add_stream("unknown.bin", io.BytesIO(b"y" * 7), succeeded=lambda: True, image_id=4)
+    bundle.add_stream("failed.bin", io.BytesIO(b"z" * 7), succeeded=lambda: False, image_id=5)
+    bundle.close()
+
+    manifest = parse_manifest(open(path + ".manifest.tsv", "rb").read())
+    assert [(row[0], row[1], row[2], row[3], row[5]) for row in manifest] == [
+        ("1", "11", "exact.bin", "10", "ok"),
+        ("2", "12", "short.bin", "5", "error"),
+        ("3", "", "long.bin", "15", "error"),
+        ("4", "", "unknown.bin", "7", "ok"),
+        ("5", "", "failed.bin", "7", "error")]
+    assert manifest[0][4] == hashlib.sha256(b"x" * 10).hexdigest()
+
+    entries = read_bundle(path, bundle_format)
+    assert entries["MANIFEST.tsv"] == open(path + ".manifest.tsv", "rb").read()
+    assert entries["exact.bin"] == b"x" * 10
+    assert entries["unknown.bin"] == b"y" * 7
+    if bundle_format == "zip":
+        assert entries["short.bin"] == b"x" * 5
+        assert entries["long.bin"] == b"x" * 15
+        assert entries["failed.bin"] == b"z" * 7
+    else:
+        # tar entries keep their declared size, buffered files of failed producers are left out
+        assert entries["short.bin"] == b"x" * 5 + bytes(5)
+        assert entries["long.bin"] == b"x" * 10
+        assert "failed.bin" not in entries
+
+def test_export_bundle_on_standard_output(tmp_path, monkeypatch):
+    import io
+    import sys
+    import types
+
+    std_out = io.BytesIO()
+    monkeypatch.setattr(sys, "stdout", types.SimpleNamespace(buffer=std_out))
+
+    bundle = pull_ops.ExportBundle("ignored", "-")
+    bundle.add_stream("img.bin", io.BytesIO(b"abc"), size=3, image_id=1)
+    bundle.close()
+
+    path = tmp_path / "stream.tar"
+    path.write_bytes(std_out.getvalue())
+    entries = read_bundle(str(path), "tar")
+    assert entries["img.bin"] == b"abc"
+    assert parse_manifest(entries["MANIFEST.tsv"])[0][5] == "ok"
+    assert not os.path.exists("ignored.manifest.tsv")
+
+def test_export_bundle_needs_a_binary_standard_output(monkeypatch):
+    import io
+    import sys
+
+    monkeypatch.setattr(sys, "stdout", io.StringIO())
+
+    with pytest.raises(ValueError):
+        pull_ops.ExportBundle("ignored", "-")
+
+def test_export_bundle_rejects_unknown_formats(tmp_path):
+    with pytest.raises(ValueError):
+        pull_ops.ExportBundle(str(tmp_path / "bundle.rar"), "rar")
+
+@pytest.mark.parametrize("exit_code, status", [(0, "ok"), (3, "error")])
+def test_bundle_omero_cmd_output(tmp_path, exit_code, status):
+    path = str(tmp_path / "bundle.tar")
+    bundle = pull_ops.ExportBundle(path, "tar")
+
+    cmd = "printf abcde; printf oops >&2; exit " + str(exit_code)
+    manifest_entry, std_err = pull_ops.bundle_omero_cmd_output(bundle, cmd, "img.bin", image_id=7)
+    bundle.close()
+
+    assert std_err == "oops"
+    assert (manifest_entry["bytes"], manifest_entry["status"]) == (5, status)
+    assert ("img.bin" in read_bundle(path, "tar")) == (exit_code == 0)
+
+def test_bundle_omero_cmd_output_is_throttled_per_chunk(tmp_path, monkeypatch):
+    throttled = []
+    monkeypatch.setattr(pull_ops, "throttle", lambda calls=0, nbytes=0: throttled.append(nbytes))
+
+    bundle = pull_ops.ExportBundle(str(tmp_path / "bundle.tar"), "tar")
+    nbytes = 3 * pull_ops.BUNDLE_CHUNK_SIZE + 10
+    manifest_entry, std_err = pull_ops.bundle_omero_cmd_output(bundle, "head -c " + str(nbytes) + " /dev/zero", "zeros.bin")
+    bundle.close()
+
+    assert manifest_entry["bytes"] == nbytes
+    assert sum(throttled) == nbytes
+    assert max(throttled) <= pull_ops.BUNDLE_CHUNK_SIZE
+
+def test_pull_metadata_rejects_a_dataset_without_project(tmp_path):
+    from omero_bifrost.utils.util_ops import invoke_cli_command
+
+    output_path = str(tmp_path / "table.csv")
+    exit_code, std_out, std_err = invoke_cli_command(["pull", "metadata", output_path, "--dataset", "ds"])
+
+    assert exit_code == 1
+    assert "--dataset needs the --project" in std_out
+    assert not os.path.exists(output_path)
+
+def test_fetch_image_metadata():
+    pytest.importorskip("omero")
+    from benchmarks.fake_gateway import FakeServer, FakeGateway
+
+    server = FakeServer(n_projects=1, n_datasets=2, n_images=2)
+    conn = FakeGateway(server)
+
+    # image 99 does not exist, duplicates are fetched once
+    rows, columns = pull_ops.fetch_image_metadata(conn, [3, 1, 3, 99], chunk_size=2)
+
+    assert columns == pull_ops.METADATA_COLUMNS + ["KV:condition", "KV:well"]
+    assert server.calls == 2 * 5
+    assert [row["OMERO_IMG_ID"] for row in rows] == [3, 1]
+    assert rows[0]["OMERO_IMG_NAME"] == "image 3"
+    assert (rows[0]["OMERO_PROJECT"], rows[0]["OMERO_DATASET"]) == ("project 1", "dataset 2")
+    assert (rows[0]["SIZE_X"], rows[0]["SIZE_C"], rows[0]["PIXEL_TYPE"]) == (256, 2, "uint16")
+    assert (rows[0]["KV:condition"], rows[0]["KV:well"]) == ("treated", "A4")
+    assert (rows[1]["KV:condition"], rows[1]["KV:well"]) == ("control", "A2")
+    assert (rows[0]["TAGS"], rows[0]["FILE_ANNOTATIONS"]) == ("bench_tag", "analysis_3.csv")
+
+def test_write_metadata_table(tmp_path, capsys):
+    import csv
+
+    columns = pull_ops.METADATA_COLUMNS + ["KV:condition"]
+    rows = [dict((column, "") for column in columns), dict((column, "") for column in columns)]
+    rows[0].update({"OMERO_IMG_ID": 1, "SIZE_X": 256, "TAGS": "a;b", "KV:condition": "treated"})
+    rows[1].update({"OMERO_IMG_ID": 2, "OMERO_IMG_NAME": "name, with comma"})
+
+    output_path = str(tmp_path / "table.csv")
+    pull_ops.write_metadata_table(rows, columns, output_path)
+
+    with open(output_path, newline="") as file:
+        reader = csv.DictReader(file)
+        assert reader.fieldnames == columns
+        table = list(reader)
+    assert [row["OMERO_IMG_ID"] for row in table] == ["1", "2"]
+    assert (table[0]["TAGS"], table[0]["KV:condition"]) == ("a;b", "treated")
+    assert table[1]["OMERO_IMG_NAME"] == "name, with comma"
+
+    pull_ops.write_metadata_table(rows, columns, "-")
+    assert capsys.readouterr().out.replace("\r\n", "\n") == open(output_path, newline="").read().replace("\r\n", "\n")
+
+def test_iter_thumbnails():
+    from benchmarks.fake_gateway import FakeServer, FakeGateway, fake_gateway_factory
+    from omero_bifrost.utils.pool_ops import ConnectionPool
+
+    server = FakeServer(n_projects=1, n_datasets=1, n_images=10)
+    conn = FakeGateway(server)
+    image_id_list = [7, 99, 2, "5", 1, 10, 3]
+
+    thumbnails = list(pull_ops.iter_thumbnails(conn, image_id_list, max_size=16, batch_size=3))
+
+    # image 99 does not exist, the others come in input order with one call per batch
+    assert [img_id for img_id, data in thumbnails] == [7, 2, 5, 1, 10, 3]
+    assert all(data.startswith(b"\xff\xd8") for img_id, data in thumbnails)
+    assert server.calls == 3
+
+    pool = ConnectionPool("usr", "pwd", "host", size=3, gateway_factory=fake_gateway_factory(server))
+    try:
+        assert list(pull_ops.iter_thumbnails(conn, image_id_list, max_size=16, batch_size=2, pool=pool)) == thumbnails
+    finally:
+        pool.close()
+
+def test_write_thumbnails_as_files(tmp_path):
+    output_path = str(tmp_path / "previews")
+
+    assert pull_ops.write_thumbnails([(1, b"first"), (2, b"second")], output_path) == 2
+    assert sorted(os.listdir(output_path)) == ["omero_img_id_1.jpg", "omero_img_id_2.jpg"]
+    assert open(os.path.join(output_path, "omero_img_id_2.jpg"), "rb").read() == b"second"
+
+@pytest.mark.parametrize("stack_name", ["stack", "stack.npy"])
+def test_write_thumbnails_as_stack(tmp_path, stack_name):
+    import io
+    import csv
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+
+    def jpeg(width, height):
+        output = io.BytesIO()
+        Image.new("RGB", (width, height), (255, 255, 255)).save(output, format="JPEG")
+        return output.getvalue()
+
+    items = [(4, jpeg(8, 4)), (2, jpeg(6, 8))]
+    assert pull_ops.write_thumbnails(items, str(tmp_path / stack_name), "npy", max_size=8) == 2
+
+    assert sorted(os.listdir(str(tmp_path))) == ["stack.npy", "stack.npy.ids.tsv"]
+    stack = np.load(str(tmp_path / "stack.npy"))
+    assert stack.shape == (2, 8, 8, 3)
+    assert stack[0, 4:].max() == 0 and stack[0, :4].min() > 200 # padded at the bottom
+    assert stack[1, :, 6:].max() == 0 # padded at the right
+    with open(str(tmp_path / "stack.npy.ids.tsv"), newline="") as file:
+        assert list(csv.reader(file, delimiter="\t")) == [["OMERO_IMG_ID", "STACK_INDEX"], ["4", "0"], ["2", "1"]]
@@ -0,0 +1,87 @@
+import pytest
+
+from benchmarks.fake_gateway import FakeServer, FakeGateway
+from omero_bifrost.query.query_ops import iter_object_pages, iter_all_objects
+
+
+def test_iter_object_pages_splits_into_pages():
+    server = FakeServer(n_projects=1, n_datasets=1, n_images=25)
+    conn = FakeGateway(server)
+
+    pages = list(iter_object_pages(conn, "Image", 10))
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert len(set(image.getId() for page in pages for image in page)) == 25
+
+@pytest.mark.parametrize("page_size", [0, -1])
+def test_iter_object_pages_rejects_invalid_page_size(page_size):
+    conn = FakeGateway(FakeServer())
+
+    with pytest.raises(ValueError):
+        next(iter_object_pages(conn, "Image", page_size))
+
+def test_iter_all_objects_is_independent_of_page_size():
+    server = FakeServer(n_projects=2, n_datasets=2, n_images=3)
+    conn = FakeGateway(server)
+
+    assert list(iter_all_objects(conn, 1)) == list(iter_all_objects(conn, 1000))
+
+@pytest.fixture
+def name_cache(monkeypatch):
+    from omero_bifrost.query import query_ops
+
+    monkeypatch.setattr(query_ops, "_dataset_id_cache", {})
+
+def test_resolve_dataset_ids(name_cache):
+    pytest.importorskip("omero")
+    from omero_bifrost.query.query_ops import resolve_dataset_ids
+
+    server = FakeServer(n_projects=2, n_datasets=3, n_images=1)
+    conn = FakeGateway(server)
+
+    # project 1 holds datasets 1..3, project 2 datasets 4..6
+    pairs = [("project 1", "dataset 3"), ("project 2", "dataset 6"), ("project 1", "dataset 6")]
+
+    assert resolve_dataset_ids(conn, pairs) == {("project 1", "dataset 3"): 3,
+                                                ("project 2", "dataset 6"): 6,
+                                                ("project 1", "dataset 6"): -1}
+    assert server.calls == 1
+
+def test_resolve_dataset_ids_is_memoized(name_cache):
+    pytest.importorskip("omero")
+    from omero_bifrost.query.query_ops import resolve_dataset_ids
+
+    server = FakeServer(n_projects=2, n_datasets=3, n_images=1)
+    conn = FakeGateway(server)
+    pairs = [("project 1", "dataset 3"), ("project 2", "dataset 6")]
+
+    first = resolve_dataset_ids(conn, pairs)
+    calls = server.calls
+
+    assert resolve_dataset_ids(conn, pairs) == first
+    assert server.calls == calls
+
+def test_resolve_dataset_ids_creates_missing(name_cache):
+    pytest.importorskip("omero")
+    from omero_bifrost.query.query_ops import resolve_dataset_ids
+
+    server = FakeServer(n_projects=1, n_datasets=2, n_images=1)
+    conn = FakeGateway(server)
+    pairs = [("project 1", "dataset 2"), ("project 1", "new a"),
+             ("new project", "new b"), ("new project", "new c")]
+
+    dataset_ids = resolve_dataset_ids(conn, pairs, create_missing=True)
+
+    assert dataset_ids[("project 1", "dataset 2")] == 2
+    assert len(set(dataset_ids.values())) == 4
+    assert -1 not in dataset_ids.values()
+    # one project per name, even with several new datasets in it
+    assert list(server.created_projects.values()) == ["new project"]
+    new_project_id = list(server.created_projects)[0]
+    assert sorted((project_id, name) for project_id, dataset_id, name in server.created_datasets) == \
+        [(1, "new a"), (new_project_id, "new b"), (new_project_id, "new c")]
+
+    # the new datasets are found by name afterwards
+    from omero_bifrost.query import query_ops
+    query_ops._dataset_id_cache.clear()
+    assert resolve_dataset_ids(conn, pairs) == dataset_ids
@@ -0,0 +1,178 @@
+import io
+import os
+import json
+import base64
+import threading
+
+import pytest
+
+from omero_bifrost.serve.serve_ops import OutputFrameWriter, stop_server, send_request, forward_to_server
+from omero_bifrost.utils.util_ops import invoke_cli_command
+
+
+def read_frames(data):
+    return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+
+def test_frames_keep_stream_order():
+    out = io.BytesIO()
+    writer = OutputFrameWriter(out)
+
+    writer.write("stdout", b"a")
+    writer.write("stdout", b"b")
+    writer.write("stderr", b"c")
+    writer.write("stdout", b"\x00\xff")
+    writer.finish(3)
+
+    frames = read_frames(out.getvalue())
+    assert [(frame["stream"], base64.b64decode(frame["data"])) for frame in frames[:-1]] == \
+           [("stdout", b"ab"), ("stderr", b"c"), ("stdout", b"\x00\xff")]
+    assert frames[-1] == {"exit_code": 3}
+
+def test_frames_are_sent_in_chunks_and_on_flush():
+    out = io.BytesIO()
+    writer = OutputFrameWriter(out, chunk_size=4)
+
+    writer.write("stdout", b"abc")
+    assert out.getvalue() == b""
+    writer.write("stdout", b"de")
+    assert len(read_frames(out.getvalue())) == 1
+
+    writer.write("stdout", b"f")
+    writer.flush()
+    assert base64.b64decode(read_frames(out.getvalue())[-1]["data"]) == b"f"
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    # started through the serve command, like 'omero-bifrost serve'
+    socket_path = str(tmp_path / "bifrost.sock")
+    monkeypatch.delenv("OMERO_BIFROST_NO_DAEMON", raising=False)
+
+    server = threading.Thread(target=invoke_cli_command, args=(["serve", "--socket", socket_path],))
+    server.start()
+    try:
+        for _ in range(100):
+            if send_request({"op": "ping"}, socket_path) is not None:
+                break
+            threading.Event().wait(0.05)
+        yield socket_path
+    finally:
+        stop_server(socket_path)
+        server.join(10)
+
+
+def test_forwarded_command_output(daemon, capfd):
+    assert forward_to_server(["query", "--help"], daemon) == 0
+    assert "list-all" in capfd.readouterr().out
+
+    assert forward_to_server(["query", "nope"], daemon) == 2
+    assert "No such command" in capfd.readouterr().err
+
+def test_forwarded_command_is_profiled(daemon, tmp_path, capfd):
+    file_path = tmp_path / "f.txt"
+    file_path.write_text("data")
+
+    assert forward_to_server(["--profile", "push", "img-file", str(file_path), "--dry-run"], daemon) == 0
+    assert "omero-bifrost profile" in capfd.readouterr().err
+
+def test_no_daemon(tmp_path, monkeypatch):
+    monkeypatch.delenv("OMERO_BIFROST_NO_DAEMON", raising=False)
+
+    assert forward_to_server(["query", "--help"], str(tmp_path / "bifrost.sock")) is None
+
+def test_forwarded_command_line_limits(daemon, tmp_path, monkeypatch, capfd):
+    from benchmarks.fake_gateway import FakeServer, FakeGateway
+    from omero_bifrost import cli
+    from omero_bifrost.utils import limit_ops
+
+    server = FakeServer(n_projects=1, n_datasets=1, n_images=6)
+    monkeypatch.setattr(cli, "omero_connect", lambda *args: FakeGateway(server))
+    config_path = tmp_path / "config.properties"
+    config_path.write_text("[OmeroServerSection]\nomero.username = u\nomero.password = p\nomero.host = h\nomero.port = 4064\n"
+                           "[TransferLimitSection]\nlimit.calls_per_sec = 1000\n")
+
+    argv = ["--max-calls-per-sec", "4", "pull", "thumbnails", str(tmp_path / "previews"),
+            "--batch-size", "1", "-c", str(config_path)] + [arg for img_id in range(1, 7) for arg in ("--img-id", str(img_id))]
+    assert forward_to_server(argv, daemon) == 0
+
+    std_err = capfd.readouterr().err
+    assert "ignored" not in std_err
+    assert "Throttled" in std_err
+    # neither the command line nor the config file limits of a request outlive it
+    assert limit_ops._limiter is None
+
+def test_busy_daemon_lets_the_client_run_locally(daemon, tmp_path, monkeypatch):
+    from benchmarks.fake_gateway import FakeServer, FakeGateway
+    from omero_bifrost import cli
+
+    server = FakeServer(n_projects=1, n_datasets=1, n_images=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_connect(*args):
+        started.set()
+        release.wait(10)
+        return FakeGateway(server)
+
+    monkeypatch.setattr(cli, "omero_connect", blocking_connect)
+    config_path = tmp_path / "config.properties"
+    config_path.write_text("[OmeroServerSection]\nomero.username = u\nomero.password = p\nomero.host = h\nomero.port = 4064\n")
+
+    results = []
+    client = threading.Thread(target=lambda: results.append(
+        forward_to_server(["query", "list-all", "-c", str(config_path), "--to-file", "-o", str(tmp_path / "out.xml")], daemon)))
+    client.start()
+    try:
+        assert started.wait(10)
+        assert forward_to_server(["query", "--help"], daemon) is None
+    finally:
+        release.set()
+        client.join(10)
+
+    assert results == [0]
+    assert forward_to_server(["query", "--help"], daemon) == 0
+
+def test_default_socket_is_in_a_private_directory(tmp_path, monkeypatch):
+    from omero_bifrost.serve.serve_ops import get_socket_path, _make_private_dir
+
+    monkeypatch.delenv("OMERO_BIFROST_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+
+    assert get_socket_path() == str(tmp_path / "omero-bifrost" / "bifrost.sock")
+
+    _make_private_dir(str(tmp_path / "omero-bifrost"))
+    assert os.stat(str(tmp_path / "omero-bifrost")).st_mode & 0o777 == 0o700
+
+    os.chmod(str(tmp_path / "omero-bifrost"), 0o777)
+    with pytest.raises(RuntimeError):
+        _make_private_dir(str(tmp_path / "omero-bifrost"))
+
+@pytest.mark.skipif(not hasattr(os, "geteuid") or os.geteuid() != 0, reason="needs root to hand a file to another user")
+def test_sockets_of_other_users_are_ignored(daemon):
+    os.chown(daemon, 4242, -1)
+    try:
+        assert forward_to_server(["query", "--help"], daemon) is None
+    finally:
+        os.chown(daemon, os.getuid(), -1)
+
+def test_forwarded_commands_share_one_thread(daemon, tmp_path, monkeypatch):
+    from benchmarks.fake_gateway import FakeServer, FakeGateway
+    from omero_bifrost import cli
+
+    server = FakeServer(n_projects=1, n_datasets=1, n_images=1)
+    threads = []
+
+    def connect(*args):
+        # the session cache of omero_connect is per thread
+        threads.append(threading.get_ident())
+        return FakeGateway(server)
+
+    monkeypatch.setattr(cli, "omero_connect", connect)
+    config_path = tmp_path / "config.properties"
+    config_path.write_text("[OmeroServerSection]\nomero.username = u\nomero.password = p\nomero.host = h\nomero.port = 4064\n")
+
+    for _ in range(3):
+        assert forward_to_server(["query", "list-all", "-c", str(config_path), "--to-file", "-o", str(tmp_path / "out.xml")], daemon) == 0
+
+    assert len(threads) == 3
+    assert len(set(threads)) == 1
@@ -0,0 +1,71 @@
+import io
+import json
+from xml.etree import ElementTree
+
+import pytest
+
+from omero_bifrost.utils.util_ops import (format_xml_ouput, write_xml, write_xml_stream, write_tsv_stream,
+                                          write_jsonl_stream, write_output_stream)
+
+
+ITEMS = [{"type": "image", "name": "img 1", "id": "101"},
+         {"type": "image", "name": "img\t2", "id": "102"}]
+
+
+def test_write_tsv_stream():
+    out = io.StringIO()
+
+    count = write_tsv_stream(iter(ITEMS), out, ["id", "name"], header=["OMERO_IMG_ID", "OMERO_IMG_NAME"])
+
+    assert count == 2
+    assert out.getvalue().splitlines()[0] == "OMERO_IMG_ID\tOMERO_IMG_NAME"
+    assert out.getvalue().splitlines()[1] == "101\timg 1"
+
+def test_write_jsonl_stream():
+    out = io.StringIO()
+
+    count = write_jsonl_stream(iter(ITEMS), out)
+
+    assert count == 2
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == ITEMS
+
+def test_write_output_stream_to_file(tmp_path):
+    path = str(tmp_path / "out.tsv")
+
+    count = write_output_stream(iter(ITEMS), path, "tsv", ["type", "id"])
+
+    assert count == 2
+    with open(path) as file:
+        assert file.read() == "type\tid\nimage\t101\nimage\t102\n"
+
+def test_write_output_stream_to_stdout(capsys):
+    write_output_stream(iter(ITEMS), "-", "jsonl", [])
+
+    assert len(capsys.readouterr().out.splitlines()) == 2
+
+def test_write_xml_matches_format_xml_ouput():
+    items = [{"type": "project", "name": 'p "1" & <2>', "id": "1"}, {"type": "image", "name": "img", "id": "7"}]
+    out = io.StringIO()
+
+    count = write_xml(iter(items), out)
+
+    expected = io.StringIO()
+    format_xml_ouput(dict(enumerate(items))).write(expected, encoding="unicode")
+    assert count == 2
+    assert out.getvalue() == expected.getvalue()
+    assert out.getvalue().startswith('<omero-bifrost-output size="2">')
+
+def test_write_xml_stream_puts_the_count_at_the_end():
+    out = io.StringIO()
+
+    count = write_xml_stream(iter(ITEMS), out)
+
+    root = ElementTree.fromstring(out.getvalue())
+    assert count == 2
+    assert [item.get("id") for item in root.findall("output-item")] == ["101", "102"]
+    assert root.find("output-summary").get("size") == "2"
+    assert root.get("size") is None
+
+def test_write_output_stream_rejects_unknown_formats(tmp_path):
+    with pytest.raises(ValueError):
+        write_output_stream(iter(ITEMS), str(tmp_path / "out.csv"), "csv", [])